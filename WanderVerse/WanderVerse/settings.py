@@ -92,6 +92,55 @@ DATABASES = {
 }
 
 
+# Caches
+# 'shared' is file based so API lookups are reused by every worker process on
+# the host, not just the one that fetched them. It holds bulk, refetchable
+# data and culls old entries when full.
+# 'state' holds what must not be culled and needs an atomic add: itinerary
+# jobs, their in-flight keys and the Amadeus token and its refresh lock. It
+# is a database table (create it with `manage.py createcachetable`).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('SHARED_CACHE_DIR', os.path.join(BASE_DIR, '.cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    },
+    'state': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'wanderverse_state_cache',
+        'OPTIONS': {
+            # Expired entries are still removed; live ones are never culled.
+            'MAX_ENTRIES': 10 ** 9,
+        },
+    },
+}
+
+# AI itinerary generation backend: 'gemini' calls the Gemini API; 'local' is
+# a deterministic offline generator for load tests and keyless development.
+ITINERARY_BACKEND = os.getenv('ITINERARY_BACKEND', 'gemini')
+ITINERARY_LOCAL_BACKEND = {
+    'latency': float(os.getenv('ITINERARY_LOCAL_LATENCY', '2.0')),
+    'latency_per_day': float(os.getenv('ITINERARY_LOCAL_LATENCY_PER_DAY', '0.5')),
+    'jitter': float(os.getenv('ITINERARY_LOCAL_JITTER', '0.2')),
+    'failure_rate': float(os.getenv('ITINERARY_LOCAL_FAILURE_RATE', '0')),
+    'malformed_rate': float(os.getenv('ITINERARY_LOCAL_MALFORMED_RATE', '0')),
+}
+
+# Where trips are stored: 'firestore', 'sqlite' (a local file) or 'memory'
+# (lost on restart). With TRIP_REPOSITORY_CACHE_TTL > 0, trips read from
+# Firestore are cached in a local SQLite file for that many seconds.
+TRIP_REPOSITORY = os.getenv('TRIP_REPOSITORY', 'firestore')
+TRIP_REPOSITORY_SQLITE_PATH = os.getenv('TRIP_REPOSITORY_SQLITE_PATH', str(BASE_DIR / 'trips.sqlite3'))
+TRIP_REPOSITORY_CACHE_TTL = int(os.getenv('TRIP_REPOSITORY_CACHE_TTL', '0'))
+TRIP_REPOSITORY_CACHE_PATH = os.getenv('TRIP_REPOSITORY_CACHE_PATH', str(BASE_DIR / 'trip_cache.sqlite3'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -15,6 +15,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
+from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.urls import path, include
 
 urlpatterns = [
@@ -23,3 +24,7 @@ urlpatterns = [
     path('trips/', include('trips.urls')),
     path('', include('pages.urls')),  # Main app URLs
 ]
+
+# runserver serves static files itself; uvicorn (see docker-compose.yml) does
+# not, so serve them from here in development. This is a no-op unless DEBUG.
+urlpatterns += staticfiles_urlpatterns()
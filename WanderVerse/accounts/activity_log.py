@@ -0,0 +1,157 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+# Activities are written when this many are waiting, or when the oldest
+# waiting activity is ACTIVITY_FLUSH_INTERVAL seconds old. Firestore allows
+# at most 500 writes per batch.
+ACTIVITY_BATCH_SIZE = min(int(os.getenv("ACTIVITY_BATCH_SIZE", "100")), 500)
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "2.0"))
+ACTIVITY_QUEUE_SIZE = int(os.getenv("ACTIVITY_QUEUE_SIZE", "5000"))
+# How long a request waits for room in a full queue before the activity is dropped.
+ACTIVITY_ENQUEUE_TIMEOUT = float(os.getenv("ACTIVITY_ENQUEUE_TIMEOUT", "0.05"))
+
+_STOP = object()
+
+
+class ActivityLogger:
+    """
+    Buffers user activities in memory and writes them to
+    users/{uid}/activities in batched Firestore writes on a background
+    thread, so logging costs a request no more than a queue put.
+
+    When the queue is full, ``log`` waits up to ``enqueue_timeout`` for the
+    writer to catch up and then drops the activity, so a slow or
+    unreachable Firestore cannot stall page traffic. Pending activities are
+    flushed when the process exits.
+    """
+
+    def __init__(self, get_db, batch_size=ACTIVITY_BATCH_SIZE, flush_interval=ACTIVITY_FLUSH_INTERVAL,
+                 max_queue=ACTIVITY_QUEUE_SIZE, enqueue_timeout=ACTIVITY_ENQUEUE_TIMEOUT):
+        self._get_db = get_db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def log(self, uid, title, description, extra_data=None):
+        """Queue an activity for ``uid``. Returns False if it had to be dropped."""
+        activity = {
+            'title': title,
+            'description': description,
+            'timestamp': firestore.SERVER_TIMESTAMP
+        }
+        if extra_data and isinstance(extra_data, dict):
+            activity.update(extra_data)
+
+        self._ensure_started()
+        try:
+            self._queue.put((uid, activity), timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.warning(f"Activity queue full, dropped activity '{title}' for {uid}")
+            return False
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='activity-log', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _next_batch(self):
+        """Block for one activity, then gather more until the size or time threshold."""
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        try:
+            db = self._get_db()
+            if not db:
+                raise RuntimeError("Firestore is not available")
+            write_batch = db.batch()
+            for uid, activity in batch:
+                ref = db.collection('users').document(uid).collection('activities').document()
+                write_batch.set(ref, activity)
+            write_batch.commit()
+            with self._lock:
+                self.written += len(batch)
+        except Exception as e:
+            with self._lock:
+                self.failed += len(batch)
+            logger.error(f"Error writing {len(batch)} user activities: {str(e)}")
+
+    def flush(self):
+        """Write everything queued so far from the calling thread."""
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                continue
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def close(self, timeout=5):
+        """Stop the writer thread, letting it finish its batch, and flush the rest."""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+            }
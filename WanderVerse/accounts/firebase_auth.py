@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.core.cache import caches
 from django.contrib import messages
 from django.shortcuts import redirect
 from django.http import JsonResponse
@@ -8,9 +9,27 @@ import os
 import logging
 import traceback
 from datetime import datetime
+from trips.utils.cache_utils import LRUCache, make_cache_key
+from .activity_log import ActivityLogger
 
 logger = logging.getLogger(__name__)
 
+# User documents are cached per process and in the shared cache. Writes
+# through create_or_update_user invalidate both tiers in this process and
+# the shared tier; other processes may serve their local copy for up to
+# USER_LOCAL_CACHE_TTL seconds.
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "120"))
+USER_LOCAL_CACHE_TTL = int(os.getenv("USER_LOCAL_CACHE_TTL", "10"))
+
+# Firestore accepts at most this many writes in one batch.
+FIRESTORE_BATCH_LIMIT = 500
+
+_user_cache = LRUCache(maxsize=2048, ttl=USER_LOCAL_CACHE_TTL)
+
+
+def _user_cache_key(uid):
+    return make_cache_key('user_data', uid)
+
 class FirebaseAuth:
     """
     Firebase Authentication and Firestore Database Handler
@@ -77,7 +96,24 @@ class FirebaseAuth:
 
     @classmethod
     def get_user_data(cls, uid):
-        """Get user data from Firestore"""
+        """
+        Get user data from Firestore, reading through the in-process and
+        shared caches. Missing users and errors are not cached. Returns a
+        copy, so callers may modify it.
+        """
+        found, user_data = _user_cache.lookup(uid)
+        if not found:
+            user_data = caches['shared'].get(_user_cache_key(uid))
+            if user_data is None:
+                user_data = cls._fetch_user_data(uid)
+                if user_data is None:
+                    return None
+                caches['shared'].set(_user_cache_key(uid), user_data, timeout=USER_CACHE_TTL)
+            _user_cache.set(uid, user_data)
+        return dict(user_data)
+
+    @classmethod
+    def _fetch_user_data(cls, uid):
         if not cls.initialize_firebase():
             return None
             
@@ -96,28 +132,70 @@ class FirebaseAuth:
             logger.error(f"Error getting user data: {str(e)}")
             return None
 
+    @classmethod
+    def invalidate_user_data(cls, uid):
+        """Drop the cached user document so the next read goes to Firestore."""
+        _user_cache.delete(uid)
+        try:
+            caches['shared'].delete(_user_cache_key(uid))
+        except Exception as e:
+            logger.error(f"Error invalidating cached user data: {str(e)}")
+
     @classmethod
     def create_or_update_user(cls, uid, user_data):
-        """Create or update user document in Firestore"""
+        """
+        Create or update user document in Firestore with a single merge
+        write: only the keys in ``user_data`` are written and the document
+        is created if it does not exist yet, so no read is needed first.
+
+        Returns the names of the fields written, or None on failure.
+        """
+        written = cls.upsert_users([(uid, user_data)])
+        if written is None:
+            return None
+        return written.get(uid, [])
+
+    @classmethod
+    def upsert_users(cls, updates):
+        """
+        Merge field updates into several user documents without reading
+        them first. ``updates`` is an iterable of ``(uid, fields)``; updates
+        for the same user are combined, later values winning, and are sent
+        as one write per user in batches of up to 500 documents.
+
+        Each write uses the user's field names as its field mask, so other
+        fields are left alone. Returns ``{uid: [field names written]}``, or
+        None if a batch failed.
+        """
+        merged = {}
+        for uid, fields in updates:
+            merged.setdefault(uid, {}).update(fields)
+        merged = {uid: fields for uid, fields in merged.items() if fields}
+        if not merged:
+            return {}
         if not cls.initialize_firebase():
-            return False
-            
+            return None
+
         try:
             db = cls.get_db()
             if not db:
-                return False
-                
-            user_ref = db.collection('users').document(uid)
-            user_doc = user_ref.get()
-            
-            if user_doc.exists:
-                user_ref.update(user_data)
-            else:
-                user_ref.set(user_data)
-            return True
+                return None
+
+            uids = list(merged)
+            for start in range(0, len(uids), FIRESTORE_BATCH_LIMIT):
+                batch = db.batch()
+                for uid in uids[start:start + FIRESTORE_BATCH_LIMIT]:
+                    fields = merged[uid]
+                    batch.set(db.collection('users').document(uid), fields, merge=list(fields))
+                batch.commit()
+            return {uid: sorted(fields) for uid, fields in merged.items()}
         except Exception as e:
             logger.error(f"Error updating user data: {str(e)}")
-            return False
+            return None
+        finally:
+            # A write may have been applied even if a later batch raised.
+            for uid in merged:
+                cls.invalidate_user_data(uid)
 
     @classmethod
     def get_firebase_config(cls):
@@ -135,26 +213,19 @@ class FirebaseAuth:
 
     @classmethod
     def log_user_activity(cls, uid, title, description, extra_data=None):
-        """Log a user activity in Firestore under users/{uid}/activities."""
-        if not cls.initialize_firebase():
-            return False
+        """
+        Log a user activity under users/{uid}/activities.
+
+        The activity is queued and written in a batch by a background thread,
+        so this returns without waiting for Firestore.
+        """
         try:
-            db = cls.get_db()
-            if not db:
-                return False
-            activity = {
-                'title': title,
-                'description': description,
-                'timestamp': firestore.SERVER_TIMESTAMP
-            }
-            if extra_data and isinstance(extra_data, dict):
-                activity.update(extra_data)
-            activities_ref = db.collection('users').document(uid).collection('activities')
-            activities_ref.add(activity)
-            return True
+            return activity_logger.log(uid, title, description, extra_data)
         except Exception as e:
             logger.error(f"Error logging user activity: {str(e)}")
             return False
 
+activity_logger = ActivityLogger(FirebaseAuth.get_db)
+
 # Initialize Firebase when module is imported
 FirebaseAuth.initialize_firebase() 
\ No newline at end of file
@@ -4,6 +4,7 @@ from django.contrib import messages
 from django.http import JsonResponse
 from .firebase_auth import FirebaseAuth
 import logging
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 
 logger = logging.getLogger(__name__)
 
@@ -13,10 +14,15 @@ class FirebaseAuthMiddleware:
     Checks if the user is authenticated via Firebase for routes that require authentication.
     """
     
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
-    def __call__(self, request):
+    def _is_public(self, request):
         # List of URLs that don't require authentication
         PUBLIC_URLS = [
             reverse('accounts:verify_token'),
@@ -27,15 +33,32 @@ class FirebaseAuthMiddleware:
         ]
         
         # Check if the current URL is public and doesn't need auth
-        path_is_public = any(request.path.startswith(url) for url in PUBLIC_URLS)
-        if path_is_public:
+        return any(request.path.startswith(url) for url in PUBLIC_URLS)
+
+    def _unauthenticated_response(self, request):
+        if request.path.startswith('/api/'):
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        messages.warning(request, 'Please sign in to access this page')
+        return redirect('/')
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self._is_public(request):
             return self.get_response(request)
             
         # Check if user is authenticated
         if not request.session.get('user_id'):
-            if request.path.startswith('/api/'):
-                return JsonResponse({'error': 'Authentication required'}, status=401)
-            messages.warning(request, 'Please sign in to access this page')
-            return redirect('/')
+            return self._unauthenticated_response(request)
             
-        return self.get_response(request) 
\ No newline at end of file
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        """Async path so async views run on the event loop without a thread hop."""
+        if self._is_public(request):
+            return await self.get_response(request)
+
+        if not await request.session.aget('user_id'):
+            return self._unauthenticated_response(request)
+
+        return await self.get_response(request)
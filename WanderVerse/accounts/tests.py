@@ -1,3 +1,177 @@
-from django.test import TestCase
+import threading
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from . import firebase_auth
+from .activity_log import ActivityLogger
+from .firebase_auth import FirebaseAuth
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'accounts-default'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'accounts-shared'},
+}
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref, data))
+        self._db.merge_fields[ref.path] = merge
+
+    def commit(self):
+        self._db.commits.append(self._writes)
+        for ref, data in self._writes:
+            self._db.docs.setdefault(ref.path, {}).update(data)
+
+
+class FakeSnapshot:
+    def __init__(self, data):
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeRef:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+
+    def collection(self, name):
+        return FakeRef(self._db, self.path + (name,))
+
+    def document(self, doc_id='auto'):
+        return FakeRef(self._db, self.path + (doc_id,))
+
+    def get(self):
+        self._db.reads += 1
+        return FakeSnapshot(self._db.docs.get(self.path))
+
+
+class FakeDb(FakeRef):
+    """Just enough of a Firestore client for batched writes and document reads."""
+
+    def __init__(self):
+        super().__init__(self, ())
+        self.commits = []
+        self.docs = {}
+        self.merge_fields = {}
+        self.reads = 0
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+class ActivityLoggerTests(SimpleTestCase):
+    def test_activities_are_written_in_batches(self):
+        db = FakeDb()
+        activity_logger = ActivityLogger(lambda: db, batch_size=2, flush_interval=60)
+        for i in range(5):
+            self.assertTrue(activity_logger.log(f"user{i % 2}", f"Title {i}", "Description", {'n': i}))
+        activity_logger.close()
+
+        self.assertTrue(all(len(writes) <= 2 for writes in db.commits))
+        writes = [write for commit in db.commits for write in commit]
+        self.assertEqual(sorted(data['n'] for _, data in writes), [0, 1, 2, 3, 4])
+        self.assertEqual({ref.path[:3] for ref, data in writes if data['n'] == 3},
+                         {('users', 'user1', 'activities')})
+        self.assertEqual(activity_logger.stats()['written'], 5)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        writing = threading.Event()
+        release = threading.Event()
+        db = FakeDb()
+
+        def get_db():
+            writing.set()
+            release.wait(5)
+            return db
+
+        activity_logger = ActivityLogger(get_db, batch_size=1, flush_interval=0, max_queue=1, enqueue_timeout=0.01)
+        self.assertTrue(activity_logger.log('u', 'first', ''))
+        self.assertTrue(writing.wait(5))
+        self.assertTrue(activity_logger.log('u', 'second', ''))
+        self.assertFalse(activity_logger.log('u', 'third', ''))
+        release.set()
+        activity_logger.close()
+
+        self.assertEqual(activity_logger.stats()['dropped'], 1)
+        self.assertEqual(activity_logger.stats()['written'], 2)
+
+    def test_write_failures_are_counted(self):
+        activity_logger = ActivityLogger(lambda: None, batch_size=10, flush_interval=60)
+        activity_logger.log('u', 'title', '')
+        activity_logger.close()
+        self.assertEqual(activity_logger.stats()['failed'], 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FirebaseUserTestCase(SimpleTestCase):
+    def setUp(self):
+        self.db = FakeDb()
+        firebase_auth._user_cache.clear()
+        caches['shared'].clear()
+        for name, value in (('initialize_firebase', True), ('get_db', self.db)):
+            patcher = mock.patch.object(FirebaseAuth, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class UserCacheTests(FirebaseUserTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db.docs[('users', 'u1')] = {'name': 'Ada', 'email': 'ada@example.com'}
+
+    def test_second_read_hits_the_cache(self):
+        self.assertEqual(FirebaseAuth.get_user_data('u1')['name'], 'Ada')
+        self.assertEqual(FirebaseAuth.get_user_data('u1')['name'], 'Ada')
+        self.assertEqual(self.db.reads, 1)
+
+        firebase_auth._user_cache.clear()
+        self.assertEqual(FirebaseAuth.get_user_data('u1')['name'], 'Ada')
+        self.assertEqual(self.db.reads, 1)
+
+    def test_update_invalidates_both_tiers(self):
+        FirebaseAuth.get_user_data('u1')
+        self.assertEqual(FirebaseAuth.create_or_update_user('u1', {'name': 'Grace'}), ['name'])
+
+        self.assertFalse(firebase_auth._user_cache.lookup('u1')[0])
+        self.assertIsNone(caches['shared'].get(firebase_auth._user_cache_key('u1')))
+        self.assertEqual(FirebaseAuth.get_user_data('u1'), {'name': 'Grace', 'email': 'ada@example.com'})
+        self.assertEqual(self.db.reads, 2)
+
+    def test_missing_users_are_not_cached(self):
+        self.assertIsNone(FirebaseAuth.get_user_data('nobody'))
+        self.assertIsNone(FirebaseAuth.get_user_data('nobody'))
+        self.assertEqual(self.db.reads, 2)
+
+
+class UpsertUsersTests(FirebaseUserTestCase):
+    def test_writes_are_split_into_batches_of_500(self):
+        written = FirebaseAuth.upsert_users((f'u{i}', {'seen': i}) for i in range(1201))
+        self.assertEqual([len(writes) for writes in self.db.commits], [500, 500, 201])
+        self.assertEqual(len(written), 1201)
+
+    def test_updates_are_merged_per_user_with_a_field_mask(self):
+        written = FirebaseAuth.upsert_users([
+            ('u1', {'name': 'Ada', 'city': 'Paris'}),
+            ('u2', {'name': 'Grace'}),
+            ('u1', {'city': 'Rome'}),
+            ('u3', {}),
+        ])
+        self.assertEqual(written, {'u1': ['city', 'name'], 'u2': ['name']})
+        self.assertEqual(len(self.db.commits), 1)
+        self.assertEqual(self.db.docs[('users', 'u1')], {'name': 'Ada', 'city': 'Rome'})
+        self.assertEqual(sorted(self.db.merge_fields[('users', 'u1')]), ['city', 'name'])
+        self.assertEqual(self.db.merge_fields[('users', 'u2')], ['name'])
+
+    def test_nothing_to_write(self):
+        self.assertEqual(FirebaseAuth.upsert_users([('u1', {})]), {})
+        self.assertEqual(self.db.commits, [])
 
-# Create your tests here.
@@ -8,6 +8,7 @@ import json
 import logging
 import traceback
 from .firebase_auth import FirebaseAuth
+from trips.utils.trip_repository import get_repository
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from datetime import datetime
@@ -155,7 +156,7 @@ def profile(request):
             'photoURL': user_data.get('photoURL', request.session.get('user_picture', '')),
             'createdAt': user_data.get('createdAt', datetime.now()),
             'isPremium': user_data.get('isPremium', False),
-            'tripsPlanned': user_data.get('tripsPlanned', 0),
+            'tripsPlanned': get_trips_planned(request.session['uid'], user_data.get('tripsPlanned', 0)),
             'destinationsVisited': user_data.get('destinationsVisited', 0),
             'reviewsCount': user_data.get('reviewsCount', 0),
             'bio': user_data.get('bio', ''),
@@ -249,6 +250,14 @@ def update_profile_picture(request):
             'message': 'An error occurred while updating profile picture'
         }, status=500)
 
+def get_trips_planned(user_id, default=0):
+    """Count the user's trips from their trip summaries"""
+    try:
+        return get_repository().count(user_id)
+    except Exception as e:
+        logger.error(f"Error counting trips: {str(e)}")
+        return default
+
 def get_recent_activities(user_id):
     """Get user's recent activities from Firestore"""
     try:
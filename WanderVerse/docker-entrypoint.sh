@@ -4,6 +4,10 @@
 echo "Apply database migrations"
 python manage.py migrate
 
+# Create the table behind the 'state' cache
+echo "Create cache tables"
+python manage.py createcachetable
+
 # Start server
 echo "Starting server"
 exec "$@" 
\ No newline at end of file
@@ -1,30 +1,29 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-import os
 from datetime import datetime
+from .utils.trip_repository import get_repository
 
-# Initialize Firebase app only once
-cred_path = os.getenv("FIREBASE_KEY_PATH", "firebase/serviceAccountKey.json")
-cred = credentials.Certificate(cred_path)
+# Trip persistence for the views. Validation and normalization happen
+# here; storage is delegated to the repository selected by
+# settings.TRIP_REPOSITORY (Firestore by default).
 
-try:
-    app = firebase_admin.get_app()
-except ValueError:
-    app = firebase_admin.initialize_app(cred)
 
-db = firestore.client()
+def _date_str(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    return value
 
-def save_trip(user_id, city_name, start_date, end_date, itinerary):
-    """Save a trip to Firestore with proper data validation"""
+
+def save_trip(user_id, city_name, start_date, end_date, itinerary, trip_id=None):
+    """
+    Save a trip to Firestore with proper data validation. With ``trip_id``
+    the existing trip is modified and keeps its creation time.
+    """
     try:
         # Only use the city_name string provided by the view
         if not isinstance(city_name, str) or not city_name.strip():
             raise ValueError("City name must be a non-empty string")
         # Ensure dates are in correct format
-        if isinstance(start_date, datetime):
-            start_date = start_date.strftime('%Y-%m-%d')
-        if isinstance(end_date, datetime):
-            end_date = end_date.strftime('%Y-%m-%d')
+        start_date = _date_str(start_date)
+        end_date = _date_str(end_date)
         # Include time in itinerary items and sort by time
         for date, items in itinerary.items():
             for item in items:
@@ -48,27 +47,27 @@ def save_trip(user_id, city_name, start_date, end_date, itinerary):
             'startDate': start_date,
             'endDate': end_date,
             'itinerary': itinerary,  # Each item now includes 'time'
-            'createdAt': firestore.SERVER_TIMESTAMP
         }
         print(f"Saving trip for user {user_id}: {trip_data}")
-        trips_ref = db.collection('trips')
-        doc_ref = trips_ref.add(trip_data)
-        print(f"Trip saved successfully with ID: {doc_ref[1].id}")
-        return doc_ref[1].id
+        if trip_id:
+            get_repository().patch('trip', user_id, trip_id, trip_data)
+        else:
+            trip_id = get_repository().save('trip', user_id, trip_data)
+        print(f"Trip saved successfully with ID: {trip_id}")
+        return trip_id
     except Exception as e:
         print(f"Error saving trip: {str(e)}")
         raise
 
-def save_ai_trip(user_id, city_name, start_date, end_date, itinerary):
+def save_ai_trip(user_id, city_name, start_date, end_date, itinerary,
+                 total_estimated_cost=None, additional_tips=None):
     """Save an AI generated trip to Firestore"""
     try:
         if not isinstance(city_name, str) or not city_name.strip():
             raise ValueError("City name must be a non-empty string")
         
-        if isinstance(start_date, datetime):
-            start_date = start_date.strftime('%Y-%m-%d')
-        if isinstance(end_date, datetime):
-            end_date = end_date.strftime('%Y-%m-%d')
+        start_date = _date_str(start_date)
+        end_date = _date_str(end_date)
 
         trip_data = {
             'userId': user_id,
@@ -76,15 +75,28 @@ def save_ai_trip(user_id, city_name, start_date, end_date, itinerary):
             'startDate': start_date,
             'endDate': end_date,
             'itinerary': itinerary,
+            'total_estimated_cost': total_estimated_cost,
+            'additional_tips': additional_tips or [],
             'isAIGenerated': True,
-            'createdAt': firestore.SERVER_TIMESTAMP
         }
         
         print(f"Saving AI generated trip for user {user_id}: {trip_data}")
-        trips_ref = db.collection('ai_generated_trips')
-        doc_ref = trips_ref.add(trip_data)
-        print(f"AI generated trip saved successfully with ID: {doc_ref[1].id}")
-        return doc_ref[1].id
+        trip_id = get_repository().save('ai', user_id, trip_data)
+        print(f"AI generated trip saved successfully with ID: {trip_id}")
+        return trip_id
     except Exception as e:
         print(f"Error saving AI generated trip: {str(e)}")
         raise
+
+def get_trip(kind, trip_id):
+    """Fetch a trip as a dict, or None if it does not exist."""
+    return get_repository().get(kind, trip_id)
+
+def delete_trip(user_id, kind, trip_id):
+    """Delete a trip and its trip index entry"""
+    try:
+        get_repository().delete(kind, user_id, trip_id)
+        print(f"Deleted {kind} trip {trip_id} for user {user_id}")
+    except Exception as e:
+        print(f"Error deleting trip: {str(e)}")
+        raise
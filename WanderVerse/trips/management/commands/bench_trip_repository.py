@@ -0,0 +1,67 @@
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from trips.utils.trip_repository import REPOSITORIES, InMemoryTripRepository, SQLiteTripRepository, get_repository
+
+
+class Command(BaseCommand):
+    help = "Time save, get, list, patch and delete against a trip repository backend"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', default='memory',
+                            help="'memory', 'sqlite' (a temporary file) or 'configured' for settings.TRIP_REPOSITORY")
+        parser.add_argument('--trips', type=int, default=200, help='Number of trips to save')
+        parser.add_argument('--days', type=int, default=5, help='Days per trip')
+        parser.add_argument('--user', default='bench-user', help='User id the trips are saved for')
+
+    def handle(self, *args, **options):
+        backend = options['backend']
+        if backend == 'memory':
+            repository = InMemoryTripRepository()
+        elif backend == 'sqlite':
+            repository = SQLiteTripRepository(os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'))
+        elif backend == 'configured':
+            repository = get_repository()
+        else:
+            raise CommandError(f"Unknown backend {backend}; choose memory, sqlite or configured "
+                               f"(configured may be one of {', '.join(REPOSITORIES)})")
+
+        user_id = options['user']
+        start = date.today()
+        trips = [self._trip(index, start, options['days']) for index in range(options['trips'])]
+
+        trip_ids = self._time('save', trips, lambda trip: repository.save('trip', user_id, trip))
+        self._time('get', trip_ids, lambda trip_id: repository.get('trip', trip_id))
+        self._time('list', range(20), lambda _: repository.list(user_id))
+        self._time('patch', trip_ids, lambda trip_id: repository.patch('trip', user_id, trip_id, {'city': 'Patched'}))
+        self._time('delete', trip_ids, lambda trip_id: repository.delete('trip', user_id, trip_id))
+
+    def _trip(self, index, start, days):
+        first = start + timedelta(days=index % 365)
+        return {
+            'city': f"City {index}",
+            'startDate': first.isoformat(),
+            'endDate': (first + timedelta(days=days - 1)).isoformat(),
+            'itinerary': {
+                (first + timedelta(days=day)).isoformat(): [
+                    {'type': 'poi', 'id': f"poi-{index}-{day}-{slot}", 'name': f"Place {slot}", 'time': f"{9 + slot * 2:02d}:00"}
+                    for slot in range(4)
+                ]
+                for day in range(days)
+            },
+        }
+
+    def _time(self, name, items, call):
+        items = list(items)
+        results = []
+        started = time.perf_counter()
+        for item in items:
+            results.append(call(item))
+        elapsed = time.perf_counter() - started
+        per_call = elapsed / len(items) * 1000 if items else 0
+        self.stdout.write(f"  {name:<8} {len(items):>6} calls {elapsed:>8.3f}s {per_call:>8.3f} ms/call")
+        return results
@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from trips.utils.llm_stats import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = "Show token, latency and cache statistics for AI itinerary generation"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Print the raw statistics as JSON')
+        parser.add_argument('--reset', action='store_true', help='Forget all recorded statistics')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS("LLM statistics reset"))
+            return
+
+        stats = get_stats()
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=2, sort_keys=True))
+            return
+        if not stats['total']:
+            self.stdout.write("No LLM calls recorded yet")
+            return
+
+        self._write_rows('Total', {'all': stats['total']})
+        self._write_rows('By prompt mode', stats['prompt_mode'])
+        self._write_rows('By city', stats['city'])
+        self._write_rows('By user', stats['user'])
+
+    def _write_rows(self, title, rows):
+        if not rows:
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        self.stdout.write(
+            f"  {'':<24} {'calls':>6} {'llm':>6} {'hit%':>6} {'fail':>5} {'err':>5} "
+            f"{'in tok':>8} {'out tok':>8} {'avg s':>7} {'max s':>7}"
+        )
+        for name, row in sorted(rows.items(), key=lambda item: -item[1]['calls']):
+            self.stdout.write(
+                f"  {name[:24]:<24} {row['calls']:>6} {row['llm_calls']:>6} "
+                f"{row['cache_hit_rate'] * 100:>5.0f}% {row['parse_failures']:>5} {row['errors']:>5} "
+                f"{row['prompt_tokens_avg']:>8.0f} {row['output_tokens_avg']:>8.0f} "
+                f"{row['latency_avg']:>7.2f} {row['latency_max']:>7.2f}"
+            )
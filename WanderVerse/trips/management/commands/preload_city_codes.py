@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from trips.utils.city_codes import preload_city_codes
+from trips.utils.hotel_api import get_city_code
+
+
+class Command(BaseCommand):
+    help = "Preload city name to IATA code mappings into the learned city code cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'mapping_file', nargs='?',
+            help='JSON file containing an object of {"city name": "IATA"} pairs',
+        )
+        parser.add_argument(
+            '--resolve', nargs='+', default=[], metavar='CITY',
+            help='City names to resolve through Amadeus and remember',
+        )
+
+    def handle(self, *args, **options):
+        if not options['mapping_file'] and not options['resolve']:
+            raise CommandError('Provide a mapping file and/or --resolve CITY [CITY ...]')
+
+        if options['mapping_file']:
+            try:
+                with open(options['mapping_file'], encoding='utf-8') as f:
+                    mapping = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read mapping file: {e}")
+            if not isinstance(mapping, dict):
+                raise CommandError('Mapping file must contain a JSON object')
+            count, skipped = preload_city_codes(mapping)
+            self.stdout.write(self.style.SUCCESS(f"Loaded {count} city codes"))
+            for city_name in skipped:
+                self.stdout.write(self.style.WARNING(
+                    f"Skipped {city_name!r}: {mapping[city_name]!r} is not a three-letter IATA code"
+                ))
+
+        for city_name in options['resolve']:
+            city_code = get_city_code(city_name)
+            if city_code:
+                self.stdout.write(f"{city_name}: {city_code}")
+            else:
+                self.stdout.write(self.style.WARNING(f"{city_name}: no city code found"))
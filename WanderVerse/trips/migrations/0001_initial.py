@@ -0,0 +1,35 @@
+# Generated by Django 5.1.3 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(max_length=20)),
+                ('name', models.CharField(blank=True, max_length=255)),
+                ('calls', models.BigIntegerField(default=0)),
+                ('llm_calls', models.BigIntegerField(default=0)),
+                ('cache_hits', models.BigIntegerField(default=0)),
+                ('parse_failures', models.BigIntegerField(default=0)),
+                ('errors', models.BigIntegerField(default=0)),
+                ('prompt_tokens', models.BigIntegerField(default=0)),
+                ('output_tokens', models.BigIntegerField(default=0)),
+                ('latency_total', models.FloatField(default=0)),
+                ('latency_max', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'name'), name='unique_llm_usage_bucket')],
+            },
+        ),
+    ]
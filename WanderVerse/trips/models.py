@@ -1,3 +1,30 @@
 from django.db import models
 
-# Create your models here.
+
+class LLMUsage(models.Model):
+    """
+    Running totals of AI itinerary generations for one aggregate: the
+    overall total, or one city, user or prompt mode. Updated in place with
+    F() expressions (see trips.utils.llm_stats), so concurrent workers never
+    lose an update.
+    """
+    dimension = models.CharField(max_length=20)
+    name = models.CharField(max_length=255, blank=True)
+    calls = models.BigIntegerField(default=0)
+    llm_calls = models.BigIntegerField(default=0)
+    cache_hits = models.BigIntegerField(default=0)
+    parse_failures = models.BigIntegerField(default=0)
+    errors = models.BigIntegerField(default=0)
+    prompt_tokens = models.BigIntegerField(default=0)
+    output_tokens = models.BigIntegerField(default=0)
+    latency_total = models.FloatField(default=0)
+    latency_max = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'name'], name='unique_llm_usage_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.dimension}:{self.name}"
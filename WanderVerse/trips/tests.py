@@ -1,3 +1,840 @@
-from django.test import TestCase
+import asyncio
+import base64
+import copy
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from firebase_admin import firestore
+
+from .utils import (
+    amadeus_auth, cache_utils, city_bundle, city_codes, gemini_api, geoapify_api, hotel_api, itinerary_jobs,
+    llm_stats, poi_service, trip_index, trip_listing,
+)
+from .utils.cache_utils import StaleWhileRevalidateCache
+from .utils.itinerary_backends import LocalItineraryModel
+from .utils.itinerary_cache import get_cached_itinerary, store_itinerary
+from .utils.itinerary_chunks import merge_chunks, missing_days, renumber_days
+from .utils.json_stream import ArrayItemParser, repair_json
+from .utils.trip_listing import InvalidCursor, decode_cursor, encode_cursor, list_trips
+from .utils.trip_repository import (
+    CachedTripRepository, FirestoreTripRepository, InMemoryTripRepository, SQLiteTripRepository,
+)
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-shared'},
+    'state': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-state'},
+}
+
+RAW_HOTELS = [
+    {
+        'chainCode': 'XX', 'iataCode': 'PAR', 'dupeId': 700, 'name': 'Hotel One', 'hotelId': 'XXPAR001',
+        'geoCode': {'latitude': 48.85, 'longitude': 2.35, 'accuracy': 'EXACT'},
+        'address': {'countryCode': 'FR', 'cityName': 'PARIS', 'lines': ['1 RUE A'], 'postalCode': '75001'},
+        'distance': {'value': 0.5, 'unit': 'KM'}, 'lastUpdate': '2024-01-01T00:00:00',
+    },
+    {'name': 'Hotel "Two", [annex]', 'hotelId': 'XXPAR002', 'rating': 4},
+]
+COMPACT_HOTELS = [
+    {
+        'name': 'Hotel One', 'hotelId': 'XXPAR001', 'distance': {'value': 0.5, 'unit': 'KM'},
+        'geoCode': {'latitude': 48.85, 'longitude': 2.35},
+        'address': {'lines': ['1 RUE A'], 'cityName': 'PARIS', 'countryCode': 'FR'},
+    },
+    {'name': 'Hotel "Two", [annex]', 'hotelId': 'XXPAR002', 'rating': 4},
+]
+HOTELS_BODY = json.dumps({'data': RAW_HOTELS, 'meta': {'count': 2, 'links': {'self': 'https://example.com'}}})
+
+
+def _pieces(text, size=7):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _day(titles):
+    return {'activities': [{'title': title} for title in titles]}
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, body=HOTELS_BODY):
+        self.status_code = status_code
+        self.text = body
+        self.url = hotel_api.HOTELS_BY_CITY_URL
+        self.encoding = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def iter_content(self, chunk_size, decode_unicode):
+        return iter(_pieces(self.text))
+
+    async def aiter_text(self):
+        for piece in _pieces(self.text):
+            yield piece
+
+    async def aread(self):
+        return self.text.encode()
+
+
+class CompactHotelTests(SimpleTestCase):
+    def test_only_rendered_fields_are_kept(self):
+        self.assertEqual([hotel_api._compact_hotel(hotel) for hotel in RAW_HOTELS], COMPACT_HOTELS)
+
+    def test_missing_sections_are_left_out(self):
+        self.assertEqual(hotel_api._compact_hotel({'name': 'Bare', 'geoCode': None}), {'name': 'Bare'})
+
+
+@mock.patch.object(hotel_api, 'get_amadeus_token', return_value='token')
+class FetchHotelsTests(SimpleTestCase):
+    def test_streamed_response_is_parsed_and_projected(self, _):
+        with mock.patch.object(hotel_api.http_client, 'get', return_value=FakeResponse()) as get:
+            result = hotel_api._fetch_hotels_in_city('PAR', 20)
+        self.assertEqual(result, {'hotels': COMPACT_HOTELS, 'meta': None})
+        self.assertTrue(get.call_args.kwargs['stream'])
+
+    def test_error_response_is_not_cached(self, _):
+        with mock.patch.object(hotel_api.http_client, 'get', return_value=FakeResponse(401, '{"errors": []}')), \
+                mock.patch.object(hotel_api.token_manager, 'invalidate') as invalidate:
+            self.assertIsNone(hotel_api._fetch_hotels_in_city('PAR', 20))
+        invalidate.assert_called_once_with()
+
+
+class AsyncFetchHotelsTests(SimpleTestCase):
+    def _astream(self, response):
+        @asynccontextmanager
+        async def astream(method, url, **kwargs):
+            yield response
+        return astream
+
+    async def test_streamed_response_is_parsed_and_projected(self):
+        with mock.patch.object(hotel_api, 'aget_amadeus_token', mock.AsyncMock(return_value='token')), \
+                mock.patch.object(hotel_api.http_client, 'astream', self._astream(FakeResponse())):
+            result = await hotel_api._afetch_hotels_in_city('PAR', 20)
+        self.assertEqual(result, {'hotels': COMPACT_HOTELS, 'meta': None})
+
+    async def test_error_response_is_not_cached(self):
+        with mock.patch.object(hotel_api, 'aget_amadeus_token', mock.AsyncMock(return_value='token')), \
+                mock.patch.object(hotel_api.http_client, 'astream', self._astream(FakeResponse(500, 'oops'))):
+            self.assertIsNone(await hotel_api._afetch_hotels_in_city('PAR', 20))
+
+
+class ArrayItemParserTests(SimpleTestCase):
+    DOCUMENT = '```json\n{"city": "Paris", "itinerary": [{"day": 1, "note": "a, [b]"}, {"day": 2}], "tips": []}\n```'
+
+    def test_items_from_single_characters(self):
+        parser = ArrayItemParser('itinerary')
+        items = []
+        for ch in self.DOCUMENT:
+            items += parser.feed(ch)
+        self.assertEqual(items, [{'day': 1, 'note': 'a, [b]'}, {'day': 2}])
+        self.assertTrue(parser.done)
+
+    def test_key_split_across_chunks(self):
+        parser = ArrayItemParser('itinerary')
+        self.assertEqual(parser.feed('{"itin'), [])
+        self.assertEqual(parser.feed('erary": [{"day": 1}'), [{'day': 1}])
+        self.assertEqual(parser.feed(']}'), [])
+        self.assertTrue(parser.done)
+
+    def test_truncated_input_yields_complete_items_only(self):
+        parser = ArrayItemParser('itinerary')
+        self.assertEqual(parser.feed('{"itinerary": [{"day": 1}, {"day": 2, "activities": [{"ti'), [{'day': 1}])
+        self.assertFalse(parser.done)
+
+
+class RepairJsonTests(SimpleTestCase):
+    def test_fenced_object_with_trailing_comma(self):
+        self.assertEqual(repair_json('Here you go:\n```json\n{"a": [1, 2,], "b": 3,}\n```'), {'a': [1, 2], 'b': 3})
+
+    def test_truncated_object_keeps_complete_elements(self):
+        text = '{"itinerary": [{"day": 1, "activities": []}, {"day": 2, "activities": [{"title": "Lou'
+        self.assertEqual(repair_json(text), {'itinerary': [{'day': 1, 'activities': []}, {'day': 2}]})
+
+    def test_dangling_key_is_dropped(self):
+        self.assertEqual(repair_json('{"a": 1, "b":'), {'a': 1})
+
+    def test_no_object(self):
+        with self.assertRaises(ValueError):
+            repair_json('no json here')
+
+
+class StaleWhileRevalidateCacheTests(SimpleTestCase):
+    def _wait_for(self, predicate):
+        deadline = time.monotonic() + 5
+        while not predicate():
+            if time.monotonic() > deadline:
+                self.fail("condition not reached")
+            time.sleep(0.01)
+
+    def test_fresh_entry_is_not_reloaded(self):
+        loader = mock.Mock(return_value='v1')
+        cache = StaleWhileRevalidateCache(loader, fresh_ttl=60)
+        self.assertEqual(cache.get('k', 'arg'), 'v1')
+        self.assertEqual(cache.get('k', 'arg'), 'v1')
+        loader.assert_called_once_with('arg')
+
+    def test_stale_entry_is_served_then_refreshed(self):
+        loads = []
+
+        def loader():
+            loads.append(None)
+            return f"v{len(loads)}"
+
+        cache = StaleWhileRevalidateCache(loader, fresh_ttl=0)
+        self.assertEqual(cache.get('k'), 'v1')
+        self.assertEqual(cache.get('k'), 'v1')
+        self._wait_for(lambda: cache.stats()['refreshes'] == 1)
+        self.assertEqual(cache.get('k'), 'v2')
+        self.assertEqual(cache.stats()['stale_hits'], 2)
+
+    def test_failed_load_is_not_cached(self):
+        loader = mock.Mock(side_effect=[None, 'v1'])
+        cache = StaleWhileRevalidateCache(loader)
+        self.assertIsNone(cache.get('k'))
+        self.assertEqual(cache.get('k'), 'v1')
+        self.assertEqual(loader.call_count, 2)
+
+
+class TripCursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        position = ['2024-05-01T10:00:00.000000Z', 'ai', 'abc123']
+        cursor = encode_cursor(position)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), position)
+
+    def test_tampered_cursors(self):
+        def encoded(raw):
+            return base64.urlsafe_b64encode(raw).decode('ascii')
+
+        cursor = encode_cursor(['2024-05-01T10:00:00.000000Z', 'trip', 'abc'])
+        for tampered in ('!!!', cursor[:-3], encoded(b'{"a": 1}'), encoded(b'["x", "y"]'),
+                         encoded(b'["x", "y", 3]'), encoded(b'\xff\xfe')):
+            with self.subTest(cursor=tampered), self.assertRaises(InvalidCursor):
+                decode_cursor(tampered)
+
+    def test_pages_cover_every_trip_once(self):
+        repository = InMemoryTripRepository()
+        saved = {repository.save('trip' if i % 2 else 'ai', 'u1', {'city': f"City {i}"}) for i in range(7)}
+        repository.save('trip', 'u2', {'city': 'Elsewhere'})
+
+        listed, cursor = [], None
+        with mock.patch.object(trip_listing, 'get_repository', return_value=repository):
+            while True:
+                page = list_trips('u1', cursor=cursor, limit=3)
+                listed += page['trips']
+                cursor = page['next_cursor']
+                if not cursor:
+                    break
+
+        self.assertEqual([trip['id'] for trip in listed if trip['id'] in saved], [trip['id'] for trip in listed])
+        self.assertEqual({trip['id'] for trip in listed}, saved)
+        self.assertEqual(len(listed), 7)
+        created = [trip['createdAt'] for trip in listed]
+        self.assertEqual(created, sorted(created, reverse=True))
+
+
+class ItineraryChunkTests(SimpleTestCase):
+    def test_renumber_truncates_extra_days(self):
+        itinerary = {'itinerary': [_day(['a']), _day(['b']), _day(['c'])]}
+        renumber_days(itinerary, '2024-05-01', 3, 4)
+        self.assertEqual([(day['day'], day['date']) for day in itinerary['itinerary']],
+                         [(3, '2024-05-03'), (4, '2024-05-04')])
+        self.assertEqual(missing_days(itinerary, 3, 4), [])
+
+    def test_merge_drops_overlap_and_repeats(self):
+        chunks = [
+            ((4, 5), {'itinerary': [_day(['Louvre', 'Seine']), _day(['Orsay'])], 'additional_tips': ['Walk']}),
+            ((1, 3), {'itinerary': [_day(['Louvre']), _day(['Eiffel']), _day(['Montmartre']), _day(['Extra'])],
+                      'additional_tips': ['walk ']}),
+        ]
+        merged = merge_chunks(chunks)
+        self.assertEqual([[a['title'] for a in day['activities']] for day in merged['itinerary']],
+                         [['Louvre'], ['Eiffel'], ['Montmartre'], ['Seine'], ['Orsay']])
+        self.assertEqual(merged['additional_tips'], ['walk '])
+        self.assertNotIn('partial', merged)
+
+    def test_merge_marks_missing_days(self):
+        merged = merge_chunks([((1, 2), {'itinerary': [_day(['a']), _day(['b'])]}),
+                               ((3, 5), {'itinerary': [_day(['c'])]})])
+        self.assertEqual(len(merged['itinerary']), 3)
+        self.assertTrue(merged['partial'])
+        self.assertEqual(merged['missing_days'], [4, 5])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ItineraryCacheTests(SimpleTestCase):
+    ITINERARY = {'itinerary': [{'day': 1, 'date': '2024-05-01'}, {'day': 2, 'date': '2024-05-02'}]}
+
+    def setUp(self):
+        store_itinerary('Paris', '2024-05-01', '2024-05-02',
+                        {'prompt': 'museums food markets old town river walks', 'budget': 'mid'}, self.ITINERARY)
+
+    def test_equivalent_prompt_hits_and_is_redated(self):
+        cached = get_cached_itinerary(' paris ', '2025-01-10', '2025-01-11',
+                                      {'prompt': 'I want river walks, food, museums and markets in the old town',
+                                       'budget': 'Mid'})
+        self.assertEqual([day['date'] for day in cached['itinerary']], ['2025-01-10', '2025-01-11'])
+
+    def test_similar_prompt_hits(self):
+        cached = get_cached_itinerary('Paris', '2024-05-01', '2024-05-02',
+                                      {'prompt': 'museums food markets old town river walks wine', 'budget': 'mid'})
+        self.assertIsNotNone(cached)
+
+    def test_different_inputs_miss(self):
+        for city, end_date, preferences in (
+            ('Paris', '2024-05-02', {'prompt': 'nightlife and clubs', 'budget': 'mid'}),
+            ('Paris', '2024-05-03', {'prompt': 'museums food markets old town river walks', 'budget': 'mid'}),
+            ('Paris', '2024-05-02', {'prompt': 'museums food markets old town river walks', 'budget': 'luxury'}),
+            ('Rome', '2024-05-02', {'prompt': 'museums food markets old town river walks', 'budget': 'mid'}),
+        ):
+            with self.subTest(city=city, end_date=end_date, preferences=preferences):
+                self.assertIsNone(get_cached_itinerary(city, '2024-05-01', end_date, preferences))
+
+
+def _poi(name, lat, lon, *categories):
+    return {'properties': {'name': name, 'place_id': name, 'lat': lat, 'lon': lon, 'categories': list(categories)}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PoiTileTests(SimpleTestCase):
+    FEATURES = [
+        _poi('Louvre', 48.861, 2.336, 'tourism', 'tourism.sights', 'entertainment.museum'),
+        _poi('Tour Eiffel', 48.858, 2.294, 'tourism', 'tourism.sights', 'tourism.attraction'),
+        _poi('Far away', 49.5, 2.9, 'tourism.sights'),
+    ]
+
+    def setUp(self):
+        geoapify_api.caches['shared'].clear()
+
+    async def test_one_request_per_tile_split_by_category(self):
+        response = mock.Mock(status_code=200, json=lambda: {'features': self.FEATURES})
+        with mock.patch.object(geoapify_api.http_client, 'aget', mock.AsyncMock(return_value=response)) as aget:
+            pois, complete = await geoapify_api.aget_pois(48.857, 2.352, ['tourism.sights', 'tourism.attraction'], radius=5000)
+            cold_calls = aget.await_count
+            again, _ = await geoapify_api.aget_pois(48.857, 2.352, ['tourism.attraction', 'tourism.sights'], radius=5000)
+
+        self.assertEqual(cold_calls, len(geoapify_api._covering_tiles(48.857, 2.352, 5000)))
+        self.assertEqual(aget.await_count, cold_calls)
+        self.assertEqual(aget.call_args.kwargs['params']['categories'], 'tourism.attraction,tourism.sights')
+        self.assertTrue(complete)
+        self.assertEqual(again, pois)
+        self.assertEqual([p['properties']['name'] for p in pois['tourism.attraction']], ['Tour Eiffel'])
+        self.assertEqual([p['properties']['name'] for p in pois['tourism.sights']], ['Louvre', 'Tour Eiffel'])
+
+
+    async def test_failed_tile_is_incomplete_and_not_cached(self):
+        response = mock.Mock(status_code=500, text='oops')
+        with mock.patch.object(geoapify_api.http_client, 'aget', mock.AsyncMock(return_value=response)), \
+                mock.patch('builtins.print'):
+            pois, complete = await geoapify_api.aget_pois(48.857, 2.352, ['tourism.sights'], radius=5000)
+        self.assertFalse(complete)
+        self.assertEqual(pois, {'tourism.sights': []})
+        self.assertIsNone(geoapify_api.caches['shared'].get(geoapify_api._tile_cache_key(['tourism.sights'], 23, 488)))
+
+class CollectCityPoisTests(SimpleTestCase):
+    CENTRE = (48.857, 2.352)
+
+    async def _collect(self, result, **kwargs):
+        with mock.patch.object(poi_service, 'aget_pois', mock.AsyncMock(**result)):
+            return await poi_service.acollect_city_pois(*self.CENTRE, **kwargs)
+
+    async def test_ranked_by_distance_then_category_order(self):
+        near = _poi('Near', 48.858, 2.352)
+        same = _poi('Same spot', 48.858, 2.352)
+        far = _poi('Far', 48.87, 2.352)
+        by_category = {'tourism.museum': [same, near], 'tourism.sights': [far, near]}
+        pois, complete = await self._collect(
+            {'return_value': (by_category, True)}, categories=['tourism.sights', 'tourism.museum'])
+        self.assertTrue(complete)
+        self.assertEqual([p['properties']['name'] for p in pois], ['Near', 'Same spot', 'Far'])
+
+    async def test_limit_keeps_the_nearest(self):
+        by_category = {'tourism.sights': [_poi(f'P{i}', 48.857 + i / 1000, 2.352) for i in range(5, 0, -1)]}
+        pois, _ = await self._collect({'return_value': (by_category, True)}, categories=['tourism.sights'], limit=2)
+        self.assertEqual([p['properties']['name'] for p in pois], ['P1', 'P2'])
+
+    async def test_partial_lookup_is_not_complete(self):
+        pois, complete = await self._collect({'return_value': ({'tourism.sights': []}, False)})
+        self.assertEqual((pois, complete), ([], False))
+
+    async def test_errors_are_not_complete(self):
+        pois, complete = await self._collect({'side_effect': RuntimeError('boom')})
+        self.assertEqual((pois, complete), ([], False))
+
+
+class CacheWarmingTests(SimpleTestCase):
+    async def test_late_hotel_lookup_keeps_running(self):
+        finished = asyncio.Event()
+
+        async def slow_hotels(city_name):
+            await asyncio.sleep(0.05)
+            finished.set()
+            return [{'name': 'Late'}], city_bundle.HOTELS_OK
+
+        with mock.patch.object(city_bundle, '_afetch_hotels', slow_hotels), \
+                mock.patch.object(city_bundle, 'aget_city_coordinates', mock.AsyncMock(return_value=None)):
+            bundle = await city_bundle.abuild_city_bundle('Paris', deadline=0.01)
+        self.assertEqual(bundle.hotel_status, city_bundle.HOTELS_TIMEOUT)
+        self.assertEqual(bundle.warming, {'hotels'})
+        await asyncio.wait_for(finished.wait(), 1)
+
+    async def test_tasks_past_the_limit_are_cancelled(self):
+        task = asyncio.create_task(asyncio.sleep(1))
+        with mock.patch.object(cache_utils, 'CACHE_WARMING_LIMIT', 0):
+            self.assertFalse(cache_utils.keep_warming(task))
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AmadeusTokenManagerTests(SimpleTestCase):
+    def setUp(self):
+        amadeus_auth.caches['state'].clear()
+        self.entry = {'token': 'fresh', 'expires_at': time.time() + 1800}
+
+    def test_concurrent_callers_fetch_once(self):
+        manager = amadeus_auth.AmadeusTokenManager('id', 'secret')
+        start = threading.Barrier(8)
+        tokens = []
+
+        def call():
+            start.wait()
+            tokens.append(manager.get_token())
+
+        with mock.patch.object(manager, '_fetch', return_value=self.entry) as fetch:
+            threads = [threading.Thread(target=call) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(tokens, ['fresh'] * 8)
+        fetch.assert_called_once_with()
+
+    def test_waits_for_another_process_without_holding_the_thread_lock(self):
+        other_process = amadeus_auth.AmadeusTokenManager('id', 'secret')
+        manager = amadeus_auth.AmadeusTokenManager('id', 'secret')
+        self.assertTrue(other_process.cache.add(other_process.lock_key, True))
+        tokens = []
+        with mock.patch.object(manager, '_fetch') as fetch, \
+                mock.patch.object(amadeus_auth, 'REFRESH_POLL_INTERVAL', 0.01):
+            waiter = threading.Thread(target=lambda: tokens.append(manager.get_token()))
+            waiter.start()
+            time.sleep(0.05)
+            self.assertTrue(manager._lock.acquire(timeout=1))
+            manager._lock.release()
+            other_process.cache.set(other_process.cache_key, self.entry)
+            waiter.join(5)
+        self.assertEqual(tokens, ['fresh'])
+        fetch.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ItineraryJobTests(SimpleTestCase):
+    def test_concurrent_identical_requests_share_one_job(self):
+        release = threading.Event()
+        calls = []
+
+        def fake_stream(city_name, start_date, end_date, preferences, user_id):
+            calls.append(city_name)
+            release.wait(5)
+            yield 'day', {'day': 1}
+            yield 'done', {'itinerary': [{'day': 1}]}
+
+        job_ids = []
+        start = threading.Barrier(8)
+
+        def enqueue():
+            start.wait()
+            job_ids.append(itinerary_jobs.enqueue_itinerary_job('Paris', '2024-05-01', '2024-05-01', {'prompt': 'food'}))
+
+        with mock.patch.object(itinerary_jobs, 'stream_itinerary', fake_stream):
+            threads = [threading.Thread(target=enqueue) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            release.set()
+            deadline = time.monotonic() + 5
+            while itinerary_jobs.get_job(job_ids[0])['status'] != itinerary_jobs.JOB_DONE:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+
+        self.assertEqual(len(set(job_ids)), 1)
+        self.assertEqual(calls, ['Paris'])
+        job = itinerary_jobs.get_job(job_ids[0])
+        self.assertEqual(job['days'], [{'day': 1}])
+        self.assertEqual(job['result'], {'itinerary': [{'day': 1}]})
+
+    def test_attaches_to_a_job_queued_by_another_process(self):
+        flight_key = itinerary_jobs.generation_key('Rome', '2024-05-01', '2024-05-02', None)
+        itinerary_jobs._save_job('other', {'status': itinerary_jobs.JOB_RUNNING})
+        itinerary_jobs.caches['state'].add(itinerary_jobs._inflight_key(flight_key), 'other')
+        with mock.patch.object(itinerary_jobs._executor, 'submit') as submit:
+            job_id = itinerary_jobs.enqueue_itinerary_job('Rome', '2024-05-01', '2024-05-02')
+        self.assertEqual(job_id, 'other')
+        submit.assert_not_called()
+
+    def test_replaces_a_finished_job(self):
+        flight_key = itinerary_jobs.generation_key('Oslo', '2024-05-01', '2024-05-02', None)
+        itinerary_jobs._save_job('old', {'status': itinerary_jobs.JOB_DONE})
+        itinerary_jobs.caches['state'].add(itinerary_jobs._inflight_key(flight_key), 'old')
+        with mock.patch.object(itinerary_jobs._executor, 'submit') as submit, \
+                mock.patch.object(itinerary_jobs, '_pending', 0):
+            job_id = itinerary_jobs.enqueue_itinerary_job('Oslo', '2024-05-01', '2024-05-02')
+        self.assertNotEqual(job_id, 'old')
+        submit.assert_called_once()
+        self.assertEqual(itinerary_jobs.caches['state'].get(itinerary_jobs._inflight_key(flight_key)), job_id)
+
+    def test_job_without_heartbeat_is_failed(self):
+        itinerary_jobs._save_job('quiet', {'status': itinerary_jobs.JOB_RUNNING, 'days': []})
+        later = time.time() + itinerary_jobs.ITINERARY_JOB_STALE_AFTER + 1
+        with mock.patch.object(itinerary_jobs.time, 'time', return_value=later):
+            self.assertEqual(itinerary_jobs.get_job('quiet')['status'], itinerary_jobs.JOB_FAILED)
+
+    def test_heartbeat_refreshes_owned_jobs(self):
+        job = {'status': itinerary_jobs.JOB_QUEUED, 'days': []}
+        itinerary_jobs._save_job('queued', job)
+        saved_at = job['updated_at']
+        with mock.patch.dict(itinerary_jobs._owned_jobs, {'queued': job}), \
+                mock.patch.object(itinerary_jobs.time, 'time', return_value=saved_at + 30):
+            itinerary_jobs._touch_owned_jobs()
+        self.assertEqual(itinerary_jobs.get_job('queued')['updated_at'], saved_at + 30)
+
+    async def test_follower_gives_up_after_max_wait(self):
+        await asyncio.to_thread(itinerary_jobs._save_job, 'slow', {'status': itinerary_jobs.JOB_RUNNING, 'days': [{'day': 1}]})
+        with mock.patch.object(itinerary_jobs, 'ITINERARY_JOB_MAX_WAIT', 0.05), \
+                mock.patch.object(itinerary_jobs, 'ITINERARY_JOB_POLL_INTERVAL', 0.01):
+            events = [event async for event in itinerary_jobs.afollow_job('slow')]
+        self.assertEqual([name for name, _ in events], ['day', 'error'])
+
+
+class LLMStatsTests(TestCase):
+    def test_calls_are_aggregated_in_the_database(self):
+        llm_stats.record_call('Paris', 'u1', 'full', prompt_tokens=100, output_tokens=50, latency=2.0)
+        llm_stats.record_call('PARIS ', 'u2', 'full', prompt_tokens=300, output_tokens=150, latency=4.0, parsed=False)
+        llm_stats.record_call('Paris', 'u1', latency=0.1, cache_hit=True)
+        llm_stats.record_call('Rome', None, 'compact', latency=1.0, failed=True)
+
+        stats = llm_stats.get_stats()
+        total = stats['total']
+        self.assertEqual((total['calls'], total['llm_calls'], total['cache_hits']), (4, 3, 1))
+        self.assertEqual((total['parse_failures'], total['errors']), (1, 1))
+        self.assertEqual(total['latency_max'], 4.0)
+        self.assertEqual(total['prompt_tokens_avg'], 400 / 3)
+        self.assertEqual(stats['city']['paris']['calls'], 3)
+        self.assertEqual(set(stats['user']), {'u1', 'u2', 'anonymous'})
+        self.assertEqual(stats['prompt_mode']['full']['llm_calls'], 2)
+        self.assertEqual(stats['prompt_mode']['compact']['errors'], 1)
+
+        llm_stats.reset_stats()
+        self.assertIsNone(llm_stats.get_stats()['total'])
+
+
+class StreamItineraryStatsTests(SimpleTestCase):
+    def test_unexpected_error_is_recorded_once_as_failed(self):
+        with mock.patch.object(gemini_api, '_lookup_cached', return_value=None), \
+                mock.patch.object(gemini_api, 'get_model', side_effect=RuntimeError('no model')), \
+                mock.patch.object(gemini_api, 'record_call') as record_call, \
+                mock.patch('builtins.print'):
+            events = list(gemini_api.stream_itinerary('Paris', '2024-05-01', '2024-05-02'))
+        self.assertEqual([name for name, _ in events], ['error'])
+        record_call.assert_called_once()
+        self.assertTrue(record_call.call_args.kwargs['failed'])
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeDocRef:
+    def __init__(self, db, collection, doc_id):
+        self._db = db
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def _docs(self):
+        return self._db.collections.setdefault(self._collection, {})
+
+    def get(self, transaction=None):
+        return FakeSnapshot(self.id, self._docs.get(self.id))
+
+    def _write(self, data, merge, now):
+        if merge is True:
+            self._docs[self.id] = _merge_fields(self._docs.get(self.id, {}), data, now)
+        elif merge:
+            self._docs[self.id] = {**self._docs.get(self.id, {}), **_resolve({k: data[k] for k in merge}, now)}
+        else:
+            self._docs[self.id] = _resolve(data, now)
+
+
+class FakeQuery:
+    def __init__(self, db, collection, filters=()):
+        self._db = db
+        self._collection = collection
+        self._filters = filters
+
+    def document(self, doc_id=None):
+        return FakeDocRef(self._db, self._collection, doc_id or f"doc{next(self._db.ids)}")
+
+    def where(self, filter):
+        return FakeQuery(self._db, self._collection, self._filters + (filter,))
+
+    def stream(self, transaction=None):
+        for doc_id, data in list(self._db.collections.get(self._collection, {}).items()):
+            if all(data.get(f.field_path) == f.value for f in self._filters):
+                yield FakeSnapshot(doc_id, data)
+
+
+class FakeWriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref, copy.deepcopy(data), merge))
+
+    def delete(self, ref):
+        self._writes.append((ref, None, False))
+
+    def commit(self):
+        now = self._db.now()
+        for ref, data, merge in self._writes:
+            if data is None:
+                ref._docs.pop(ref.id, None)
+            else:
+                ref._write(data, merge, now)
+
+
+class FakeFirestore:
+    """Just enough of a Firestore client for trips and their index, in memory."""
+
+    def __init__(self):
+        self.collections = {}
+        self.ids = itertools.count()
+        self._clock = itertools.count()
+
+    def now(self):
+        return datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=next(self._clock))
+
+    def collection(self, name):
+        return FakeQuery(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    transaction = batch
+
+
+def _resolve(value, now):
+    if value is firestore.SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, dict):
+        return {key: _resolve(item, now) for key, item in value.items()}
+    return value
+
+
+def _merge_fields(current, data, now):
+    merged = dict(current)
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            merged.pop(key, None)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge_fields(merged[key], value, now)
+        else:
+            merged[key] = _resolve(value, now)
+    return merged
+
+
+def _transactional(function):
+    """Stand-in for firestore.transactional: run once, then commit."""
+    def run(transaction):
+        result = function(transaction)
+        transaction.commit()
+        return result
+    return run
+
+
+def _without_updated_at(entries):
+    return {key: {k: v for k, v in entry.items() if k != 'updatedAt'} for key, entry in entries.items()}
+
+
+@mock.patch.object(trip_index.firestore, 'transactional', _transactional)
+class TripIndexTests(SimpleTestCase):
+    TRIP = {'city': 'Paris', 'startDate': '2024-05-01', 'endDate': '2024-05-02',
+            'itinerary': {'2024-05-01': [{'title': 'Louvre'}], '2024-05-02': []}}
+    AI_TRIP = {'city': 'Rome', 'startDate': '2024-06-01', 'endDate': '2024-06-01',
+               'itinerary': [{'day': 1, 'activities': [{'title': 'Forum'}, {'title': 'Colosseum'}]}]}
+
+    def setUp(self):
+        self.db = FakeFirestore()
+        self.repository = FirestoreTripRepository(lambda: self.db)
+
+    def _stored_index(self):
+        return self.db.collections['trip_index']['u1']['trips']
+
+    def _expected_entries(self):
+        """Summaries recomputed from the stored trip documents."""
+        expected = {}
+        for kind, collection in trip_index.TRIP_COLLECTIONS.items():
+            for trip_id, trip in self.db.collections.get(collection, {}).items():
+                if trip['userId'] == 'u1':
+                    expected[trip_index.entry_key(kind, trip_id)] = trip_index.trip_summary(kind, trip)
+        return _without_updated_at(expected)
+
+    def test_save_patch_and_delete_keep_the_index_in_step(self):
+        trip_id = self.repository.save('trip', 'u1', self.TRIP)
+        ai_id = self.repository.save('ai', 'u1', self.AI_TRIP)
+        self.repository.save('trip', 'u2', self.TRIP)
+        self.assertEqual(_without_updated_at(self._stored_index()), self._expected_entries())
+        self.assertEqual(self._stored_index()[f'trip_{trip_id}']['activities'], 1)
+
+        self.repository.patch('trip', 'u1', trip_id, {'itinerary': {'2024-05-01': []}, 'endDate': '2024-05-01'})
+        self.repository.patch('ai', 'u1', ai_id, {'notes': 'not part of the summary'})
+        self.assertEqual(_without_updated_at(self._stored_index()), self._expected_entries())
+        self.assertEqual(self._stored_index()[f'trip_{trip_id}']['days'], 1)
+
+        self.repository.delete('ai', 'u1', ai_id)
+        self.assertEqual(list(self._stored_index()), [f'trip_{trip_id}'])
+        self.assertEqual(_without_updated_at(self._stored_index()), self._expected_entries())
+
+    def test_rebuild_reproduces_the_index(self):
+        trip_id = self.repository.save('trip', 'u1', self.TRIP)
+        ai_id = self.repository.save('ai', 'u1', self.AI_TRIP)
+        self.repository.patch('trip', 'u1', trip_id, {'city': 'Lyon'})
+        self.repository.delete('ai', 'u1', self.repository.save('ai', 'u1', self.AI_TRIP))
+        maintained = self._stored_index()
+
+        rebuilt = trip_index.rebuild_trip_index('u1', self.db)
+        self.assertEqual(set(rebuilt), {f'trip_{trip_id}', f'ai_{ai_id}'})
+        self.assertEqual(_without_updated_at(rebuilt), _without_updated_at(maintained))
+        self.assertTrue(self.db.collections['trip_index']['u1']['complete'])
+
+    def test_index_is_built_on_first_listing(self):
+        self.db.collections['trips'] = {'old': dict(self.TRIP, userId='u1', createdAt=self.db.now())}
+        self.assertEqual(list(self.repository.list('u1')), ['trip_old'])
+        self.assertEqual(self.repository.count('u1'), 1)
+
+
+class SQLiteTripRepositoryTests(SimpleTestCase):
+    TRIP = {
+        'city': 'Paris',
+        'startDate': datetime(2024, 5, 1, tzinfo=timezone.utc),
+        'endDate': datetime(2024, 5, 2, tzinfo=timezone.utc),
+        'itinerary': [{'day': 1, 'activities': [{'title': 'Louvre', 'time': datetime(2024, 5, 1, 9)}]}],
+        'preferences': {'budget': 'mid', 'tags': ['art']},
+    }
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.repository = SQLiteTripRepository(os.path.join(directory.name, 'trips.sqlite3'))
+
+    def test_round_trip_keeps_types(self):
+        trip_id = self.repository.save('trip', 'u1', self.TRIP)
+        trip = self.repository.get('trip', trip_id)
+        self.assertEqual({k: v for k, v in trip.items() if k not in ('userId', 'createdAt')}, self.TRIP)
+        self.assertIsInstance(trip['startDate'], datetime)
+        self.assertIsInstance(trip['itinerary'][0]['activities'][0]['time'], datetime)
+        self.assertIsInstance(trip['createdAt'], datetime)
+
+    def test_save_patch_list_and_delete(self):
+        trip_id = self.repository.save('trip', 'u1', self.TRIP)
+        ai_id = self.repository.save('ai', 'u1', {'city': 'Rome', 'itinerary': []})
+        self.repository.save('trip', 'u2', self.TRIP)
+        self.assertEqual(set(self.repository.list('u1')), {f'trip_{trip_id}', f'ai_{ai_id}'})
+        self.assertEqual(self.repository.list('u1')[f'trip_{trip_id}']['startDate'], '2024-05-01')
+
+        self.repository.patch('trip', 'u1', trip_id, {'city': 'Lyon'})
+        self.assertEqual(self.repository.get('trip', trip_id)['city'], 'Lyon')
+        self.assertEqual(self.repository.list('u1')[f'trip_{trip_id}']['city'], 'Lyon')
+        self.assertIsInstance(self.repository.list('u1')[f'trip_{trip_id}']['updatedAt'], datetime)
+
+        self.repository.delete('ai', 'u1', ai_id)
+        self.assertIsNone(self.repository.get('ai', ai_id))
+        self.assertEqual(self.repository.count('u1'), 1)
+        with self.assertRaises(KeyError):
+            self.repository.patch('ai', 'u1', ai_id, {'city': 'Oslo'})
+
+    def test_max_age(self):
+        trip_id = self.repository.save('trip', 'u1', self.TRIP)
+        self.assertIsNotNone(self.repository.get('trip', trip_id, max_age=60))
+        with mock.patch('trips.utils.trip_repository.time.time', return_value=time.time() + 61):
+            self.assertIsNone(self.repository.get('trip', trip_id, max_age=60))
+
+
+class CachedTripRepositoryTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.backend = InMemoryTripRepository()
+        self.repository = CachedTripRepository(
+            self.backend, SQLiteTripRepository(os.path.join(directory.name, 'cache.sqlite3')), ttl=60)
+        self.trip_id = self.backend.save('trip', 'u1', SQLiteTripRepositoryTests.TRIP)
+
+    def test_cache_hit_matches_the_backend_copy(self):
+        with mock.patch.object(self.backend, 'get', wraps=self.backend.get) as backend_get:
+            first = self.repository.get('trip', self.trip_id)
+            second = self.repository.get('trip', self.trip_id)
+        self.assertEqual(backend_get.call_count, 1)
+        self.assertEqual(second, first)
+        self.assertIsInstance(second['startDate'], datetime)
+        self.assertIsInstance(second['createdAt'], datetime)
+
+    def test_changes_drop_the_cached_copy(self):
+        self.repository.get('trip', self.trip_id)
+        self.repository.patch('trip', 'u1', self.trip_id, {'city': 'Lyon'})
+        self.assertEqual(self.repository.get('trip', self.trip_id)['city'], 'Lyon')
+
+        self.repository.delete('trip', 'u1', self.trip_id)
+        self.assertIsNone(self.repository.get('trip', self.trip_id))
+        self.assertEqual(self.repository.count('u1'), 0)
+
+
+class LocalItineraryModelTests(SimpleTestCase):
+    PROMPT = 'Create a 3-day itinerary for Lisbon from 2024-05-01 to 2024-05-03. Travel style: relaxed'
+
+    def test_streamed_and_whole_responses_match(self):
+        model = LocalItineraryModel(latency=0, latency_per_day=0, jitter=0)
+        streamed = model.generate_content(self.PROMPT, stream=True)
+        text = ''.join(chunk.text for chunk in streamed)
+        self.assertEqual(text, model.generate_content(self.PROMPT).text)
+        itinerary = json.loads(text)['itinerary']
+        self.assertEqual([day['date'] for day in itinerary], ['2024-05-01', '2024-05-02', '2024-05-03'])
+        self.assertEqual(len(itinerary[0]['activities']), 3)
+        self.assertGreater(streamed.usage_metadata.candidates_token_count, 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PreloadCityCodesTests(SimpleTestCase):
+    def test_invalid_entries_are_skipped(self):
+        loaded, skipped = city_codes.preload_city_codes({
+            'Porto Alegre': ' poa ',
+            'Nowhere': None,
+            'Numeric': 123,
+            'Too long': 'ABCD',
+            'Digits': 'A1B',
+            'List': ['XYZ'],
+            '  ': 'ABC',
+        })
+        self.assertEqual(loaded, 1)
+        self.assertEqual(skipped, ['Nowhere', 'Numeric', 'Too long', 'Digits', 'List', '  '])
+        self.assertEqual(city_codes.lookup_city_code('porto alegre'), (True, 'POA'))
+        self.assertEqual(city_codes.lookup_city_code('Too long'), (False, None))
 
-# Create your tests here.
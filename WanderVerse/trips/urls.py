@@ -8,11 +8,18 @@ urlpatterns = [
     path('create-itinerary/<str:city_name>/', views.create_itinerary, name='create_itinerary'),
     path('ai-itinerary/<str:city_name>/', views.ai_itinerary_form, name='ai_itinerary_form'),
     path('generate-ai-itinerary/<str:city_name>/', views.generate_ai_itinerary, name='generate_ai_itinerary'),
+    path('ai-itinerary-job/<str:city_name>/<str:job_id>/', views.ai_itinerary_job, name='ai_itinerary_job'),
+    path('ai-itinerary-job-status/<str:job_id>/', views.ai_itinerary_job_status, name='ai_itinerary_job_status'),
+    path('stream-ai-itinerary/<str:city_name>/', views.stream_ai_itinerary, name='stream_ai_itinerary'),
     path('show-ai-itinerary/<str:city_name>/', views.show_ai_itinerary, name='show_ai_itinerary'),
     # AJAX endpoint for loading more hotels - REMOVED as Amadeus returns all hotels at once
     # path('ajax/load_more_hotels/<str:city_name>/', views.load_more_hotels_ajax, name='load_more_hotels_ajax'),
     path('my-trips/', views.my_trips, name='my_trips'),
+    path('my-trips/api/', views.my_trips_api, name='my_trips_api'),
+    path('my-trips/api/save/', views.save_trip_api, name='save_trip_api'),
+    path('my-trips/api/<str:kind>/<str:trip_id>/delete/', views.delete_trip_api, name='delete_trip_api'),
     path('modify/<str:trip_id>/', views.modify_trip, name='modify_trip'),
     path('view_itinerary/<str:trip_id>/', views.view_itinerary, name='view_itinerary'),
     path('ai_trip/<str:trip_id>/', views.view_ai_itinerary, name='view_ai_itinerary'),
+    path('llm-stats/', views.llm_stats, name='llm_stats'),
 ]
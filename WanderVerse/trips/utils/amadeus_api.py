@@ -1,20 +1,8 @@
-import os
-import requests
-
-AMADEUS_API_KEY = os.getenv("AMADEUS_API_KEY")
-AMADEUS_SECRET = os.getenv("AMADEUS_SECRET")
+from . import http_client
+from .amadeus_auth import token_manager
 
 def get_amadeus_token():
-    url = "https://test.api.amadeus.com/v1/security/oauth2/token"
-    payload = {
-        "grant_type": "client_credentials",
-        "client_id": AMADEUS_API_KEY,
-        "client_secret": AMADEUS_SECRET
-    }
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    r = requests.post(url, data=payload, headers=headers)
-    r.raise_for_status()  # Optional: raise error if request fails
-    return r.json()["access_token"]
+    return token_manager.get_token()
 
 def get_points_of_interest(city_lat, city_lon):
     token = get_amadeus_token()
@@ -25,7 +13,7 @@ def get_points_of_interest(city_lat, city_lon):
         "radius": 10
     }
     headers = {"Authorization": f"Bearer {token}"}
-    r = requests.get(url, params=params, headers=headers)
+    r = http_client.get(url, params=params, headers=headers)
     r.raise_for_status()
     return r.json().get("data", [])
 
@@ -39,6 +27,6 @@ def get_hotels(city_lat, city_lon):
         "radiusUnit": "KM"
     }
     headers = {"Authorization": f"Bearer {token}"}
-    r = requests.get(url, params=params, headers=headers)
+    r = http_client.get(url, params=params, headers=headers)
     r.raise_for_status()
     return r.json().get("data", [])
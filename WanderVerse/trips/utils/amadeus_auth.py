@@ -0,0 +1,122 @@
+# trips/utils/amadeus_auth.py
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from django.core.cache import caches
+
+from . import http_client
+
+logger = logging.getLogger(__name__)
+
+TOKEN_URL = "https://test.api.amadeus.com/v1/security/oauth2/token"
+
+# Refresh this many seconds before Amadeus says the token expires so a token
+# never runs out between being handed to a caller and being used.
+REFRESH_MARGIN = 60
+# How long another process may hold the refresh lock before we stop waiting
+# for it and refresh ourselves.
+REFRESH_LOCK_TIMEOUT = 10
+REFRESH_POLL_INTERVAL = 0.1
+
+
+class AmadeusTokenManager:
+    """
+    Caches an Amadeus OAuth token until shortly before it expires.
+
+    Within a process only one thread refreshes at a time while the others
+    wait for its result. The token is also stored in the 'state' cache so
+    every worker process on the host reuses it, and a lock taken with that
+    cache's atomic ``add`` keeps processes from refreshing concurrently.
+    """
+
+    def __init__(self, client_id, client_secret, cache_alias='state'):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.cache_alias = cache_alias
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+        key_id = hashlib.sha1((client_id or '').encode()).hexdigest()[:12]
+        self.cache_key = f"amadeus:token:{key_id}"
+        self.lock_key = f"{self.cache_key}:refreshing"
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _local_token(self):
+        if self._token and time.time() < self._expires_at - REFRESH_MARGIN:
+            return self._token
+        return None
+
+    def _adopt(self, entry):
+        if entry and time.time() < entry['expires_at'] - REFRESH_MARGIN:
+            self._token = entry['token']
+            self._expires_at = entry['expires_at']
+            return self._token
+        return None
+
+    def _fetch(self):
+        data = {
+            "grant_type": "client_credentials",
+            "client_id": self.client_id,
+            "client_secret": self.client_secret
+        }
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        response = http_client.post(TOKEN_URL, data=data, headers=headers)
+        response.raise_for_status()
+        payload = response.json()
+        expires_in = int(payload.get("expires_in", 1799))
+        return {
+            'token': payload["access_token"],
+            'expires_at': time.time() + expires_in,
+        }
+
+    def _refresh(self):
+        """Fetch a new token and publish it. Call with ``self._lock`` held."""
+        entry = self._fetch()
+        timeout = max(int(entry['expires_at'] - time.time() - REFRESH_MARGIN), 1)
+        self.cache.set(self.cache_key, entry, timeout=timeout)
+        self._token = entry['token']
+        self._expires_at = entry['expires_at']
+        return self._token
+
+    def get_token(self):
+        """Return a valid access token, refreshing it if needed."""
+        token = self._local_token()
+        if token:
+            return token
+        deadline = time.time() + REFRESH_LOCK_TIMEOUT
+        while True:
+            with self._lock:
+                token = self._local_token() or self._adopt(self.cache.get(self.cache_key))
+                if token:
+                    return token
+                if self.cache.add(self.lock_key, True, timeout=REFRESH_LOCK_TIMEOUT):
+                    try:
+                        logger.info("Refreshing Amadeus access token")
+                        return self._refresh()
+                    finally:
+                        self.cache.delete(self.lock_key)
+                if time.time() >= deadline:
+                    logger.warning("Amadeus token refresh lock held too long; refreshing anyway")
+                    return self._refresh()
+            # Another process is refreshing; wait for it to publish the token
+            # without holding up this process's other threads.
+            time.sleep(REFRESH_POLL_INTERVAL)
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after Amadeus rejects it with a 401."""
+        with self._lock:
+            self._token = None
+            self._expires_at = 0
+            self.cache.delete(self.cache_key)
+
+
+token_manager = AmadeusTokenManager(
+    os.getenv("AMADEUS_API_KEY"),
+    os.getenv("AMADEUS_SECRET"),
+)
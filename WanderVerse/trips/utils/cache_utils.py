@@ -0,0 +1,199 @@
+# trips/utils/cache_utils.py
+import hashlib
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Stored in place of a result to remember that an upstream lookup found nothing.
+NEGATIVE = '__negative__'
+
+# Most lookups left running after missing a page's deadline, so they still
+# fill the cache for the next request. Past this they are cancelled.
+CACHE_WARMING_LIMIT = int(os.getenv("CACHE_WARMING_LIMIT", "32"))
+
+_warming = set()
+
+
+def normalize_key(text):
+    """
+    Normalize free text for use in a cache key.
+
+    Case, surrounding/repeated whitespace and diacritics are ignored, so
+    "  São  Paulo", "sao paulo" and "SAO PAULO" all map to "sao paulo".
+    """
+    if not text:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return ' '.join(stripped.casefold().split())
+
+
+def make_cache_key(prefix, *parts):
+    """Build a short, backend-safe cache key from arbitrary parts."""
+    raw = '|'.join(str(part) for part in parts)
+    return f"{prefix}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+
+def _warming_done(task):
+    _warming.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Background cache warming failed: {str(task.exception())}")
+
+
+def keep_warming(task):
+    """
+    Let an asyncio task that missed its deadline finish in the background so
+    its result still reaches the cache. Returns False, after cancelling the
+    task, when CACHE_WARMING_LIMIT tasks are already running.
+    """
+    if len(_warming) >= CACHE_WARMING_LIMIT:
+        task.cancel()
+        return False
+    _warming.add(task)
+    task.add_done_callback(_warming_done)
+    return True
+
+
+class LRUCache:
+    """
+    Small thread-safe in-process LRU cache with a per-entry TTL.
+
+    Used as a first tier in front of the shared Django cache so hot keys are
+    answered without touching disk or the network.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        """Return ``(found, value)``; expired entries count as not found."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._data[key]
+            self.misses += 1
+            return False, None
+
+    def get(self, key, default=None):
+        found, value = self.lookup(key)
+        return value if found else default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+
+class StaleWhileRevalidateCache:
+    """
+    LRU cache that serves stale entries immediately and refreshes them in
+    the background.
+
+    Entries younger than ``fresh_ttl`` are served as-is. Older entries (up to
+    ``max_stale``) are still served, and a single background refresh per key
+    is scheduled. Only a cold miss calls ``loader`` inline. ``loader`` must
+    return None on failure so errors are never cached.
+    """
+
+    def __init__(self, loader, maxsize=256, fresh_ttl=60 * 60, max_stale=60 * 60 * 24, refresh_workers=2):
+        self.loader = loader
+        self.fresh_ttl = fresh_ttl
+        self._entries = LRUCache(maxsize=maxsize, ttl=max_stale)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='swr-refresh')
+        self.stale_hits = 0
+        self.refreshes = 0
+
+    def get(self, key, *args, **kwargs):
+        """Return the value for ``key``, calling ``loader(*args, **kwargs)`` on a cold miss."""
+        found, entry = self._entries.lookup(key)
+        if not found:
+            return self._load(key, *args, **kwargs)
+        value, fetched_at = entry
+        self._refresh_if_stale(key, fetched_at, *args, **kwargs)
+        return value
+
+    async def aget(self, key, aloader, *args, **kwargs):
+        """
+        Async version of ``get``: a cold miss awaits ``aloader(*args, **kwargs)``.
+        Stale entries are still refreshed in the background with ``loader``.
+        """
+        found, entry = self._entries.lookup(key)
+        if not found:
+            value = await aloader(*args, **kwargs)
+            if value is not None:
+                self._entries.set(key, (value, time.monotonic()))
+            return value
+        value, fetched_at = entry
+        self._refresh_if_stale(key, fetched_at, *args, **kwargs)
+        return value
+
+    def _refresh_if_stale(self, key, fetched_at, *args, **kwargs):
+        if time.monotonic() - fetched_at <= self.fresh_ttl:
+            return
+        with self._lock:
+            self.stale_hits += 1
+            schedule = key not in self._refreshing
+            if schedule:
+                self._refreshing.add(key)
+        if schedule:
+            self._executor.submit(self._refresh, key, *args, **kwargs)
+
+    def _load(self, key, *args, **kwargs):
+        value = self.loader(*args, **kwargs)
+        if value is not None:
+            self._entries.set(key, (value, time.monotonic()))
+        return value
+
+    def _refresh(self, key, *args, **kwargs):
+        try:
+            self._load(key, *args, **kwargs)
+            with self._lock:
+                self.refreshes += 1
+        except Exception as e:
+            logger.error(f"Background refresh failed for {key}: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def invalidate(self, key):
+        self._entries.delete(key)
+
+    def stats(self):
+        stats = self._entries.stats()
+        with self._lock:
+            stats.update({'stale_hits': self.stale_hits, 'refreshes': self.refreshes})
+        return stats
@@ -0,0 +1,106 @@
+# trips/utils/city_bundle.py
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+
+from .cache_utils import keep_warming
+from .geodb_api import aget_city_coordinates
+from .hotel_api import aget_amadeus_token, aget_city_code, aget_hotels_in_city
+from .poi_service import acollect_city_pois
+
+logger = logging.getLogger(__name__)
+
+# Total time budget, in seconds, for building a city bundle. Whatever has not
+# finished by then is left out and flagged as partial; it keeps loading in the
+# background (within CACHE_WARMING_LIMIT) so a reload can pick it up.
+CITY_BUNDLE_DEADLINE = float(os.getenv("CITY_BUNDLE_DEADLINE", "8"))
+
+# Values for CityBundle.hotel_status
+HOTELS_OK = 'ok'
+HOTELS_NO_TOKEN = 'no_token'
+HOTELS_NO_CITY_CODE = 'no_city_code'
+HOTELS_EMPTY = 'empty'
+HOTELS_TIMEOUT = 'timeout'
+
+
+@dataclass
+class CityBundle:
+    """Everything a trip page needs about a city, plus which parts are missing."""
+    city_name: str
+    city_info: dict = None
+    pois: list = field(default_factory=list)
+    hotels: list = field(default_factory=list)
+    hotel_status: str = HOTELS_OK
+    partial: set = field(default_factory=set)
+    warming: set = field(default_factory=set)
+
+    @property
+    def is_partial(self):
+        return bool(self.partial)
+
+
+async def _afetch_hotels(city_name):
+    token = await aget_amadeus_token()
+    if not token:
+        return [], HOTELS_NO_TOKEN
+    city_code = await aget_city_code(city_name, token)
+    if not city_code:
+        return [], HOTELS_NO_CITY_CODE
+    hotels = (await aget_hotels_in_city(city_code, token)).get("hotels", [])
+    return hotels, HOTELS_OK if hotels else HOTELS_EMPTY
+
+
+async def abuild_city_bundle(city_name, deadline=None):
+    """
+    Geocode a city and gather its POIs and hotels under one time budget.
+
+    The hotel branch (token, city code, hotels) does not depend on the
+    coordinates, so it runs alongside geocoding and the POI fan-out.
+    Sections that miss the deadline are returned empty or short and named
+    in ``bundle.partial``. Their lookups carry on in the background to fill
+    the cache; those that could be kept running are named in
+    ``bundle.warming``, the rest are cancelled.
+    """
+    budget = CITY_BUNDLE_DEADLINE if deadline is None else deadline
+    loop = asyncio.get_running_loop()
+    expires_at = loop.time() + budget
+    bundle = CityBundle(city_name=city_name)
+
+    def remaining():
+        return max(expires_at - loop.time(), 0)
+
+    hotels_task = asyncio.create_task(_afetch_hotels(city_name))
+    geocode_task = asyncio.create_task(aget_city_coordinates(city_name))
+
+    await asyncio.wait({geocode_task}, timeout=remaining())
+    if not geocode_task.done():
+        logger.warning(f"Geocoding '{city_name}' missed the {budget}s deadline")
+        bundle.partial.add('city_info')
+        if keep_warming(geocode_task):
+            bundle.warming.add('city_info')
+    elif geocode_task.exception():
+        logger.error(f"Error geocoding '{city_name}': {str(geocode_task.exception())}")
+    else:
+        bundle.city_info = geocode_task.result()
+
+    if bundle.city_info:
+        lat, lon = bundle.city_info['lat'], bundle.city_info['lon']
+        bundle.pois, complete = await acollect_city_pois(lat, lon, timeout=remaining())
+        if not complete:
+            bundle.partial.add('pois')
+
+    await asyncio.wait({hotels_task}, timeout=remaining())
+    if not hotels_task.done():
+        logger.warning(f"Hotel lookup for '{city_name}' missed the {budget}s deadline")
+        bundle.hotel_status = HOTELS_TIMEOUT
+        bundle.partial.add('hotels')
+        if keep_warming(hotels_task):
+            bundle.warming.add('hotels')
+    elif hotels_task.exception():
+        logger.error(f"Error fetching hotels for '{city_name}': {str(hotels_task.exception())}")
+        bundle.hotel_status = HOTELS_EMPTY
+    else:
+        bundle.hotels, bundle.hotel_status = hotels_task.result()
+
+    return bundle
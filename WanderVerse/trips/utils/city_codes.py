@@ -0,0 +1,165 @@
+# trips/utils/city_codes.py
+from django.core.cache import caches
+
+from .cache_utils import NEGATIVE, make_cache_key, normalize_key
+
+# Learned mappings are kept for 90 days; names Amadeus does not know are
+# retried after a day.
+CITY_CODE_TTL = 60 * 60 * 24 * 90
+CITY_CODE_NEGATIVE_TTL = 60 * 60 * 24
+
+# Amadeus city (metropolitan area) codes for common destinations, keyed by
+# normalized city name. Checked before the learned cache and the API.
+CITY_IATA_CODES = {
+    'abu dhabi': 'AUH',
+    'amsterdam': 'AMS',
+    'athens': 'ATH',
+    'atlanta': 'ATL',
+    'auckland': 'AKL',
+    'bangalore': 'BLR',
+    'bangkok': 'BKK',
+    'barcelona': 'BCN',
+    'beijing': 'BJS',
+    'bengaluru': 'BLR',
+    'berlin': 'BER',
+    'boston': 'BOS',
+    'brussels': 'BRU',
+    'budapest': 'BUD',
+    'buenos aires': 'BUE',
+    'cairo': 'CAI',
+    'cape town': 'CPT',
+    'chennai': 'MAA',
+    'chicago': 'CHI',
+    'copenhagen': 'CPH',
+    'delhi': 'DEL',
+    'denver': 'DEN',
+    'doha': 'DOH',
+    'dubai': 'DXB',
+    'dublin': 'DUB',
+    'edinburgh': 'EDI',
+    'florence': 'FLR',
+    'frankfurt': 'FRA',
+    'geneva': 'GVA',
+    'goa': 'GOI',
+    'helsinki': 'HEL',
+    'hanoi': 'HAN',
+    'ho chi minh city': 'SGN',
+    'hong kong': 'HKG',
+    'honolulu': 'HNL',
+    'hyderabad': 'HYD',
+    'istanbul': 'IST',
+    'jaipur': 'JAI',
+    'jakarta': 'JKT',
+    'kolkata': 'CCU',
+    'krakow': 'KRK',
+    'kuala lumpur': 'KUL',
+    'las vegas': 'LAS',
+    'lisbon': 'LIS',
+    'london': 'LON',
+    'los angeles': 'LAX',
+    'madrid': 'MAD',
+    'manila': 'MNL',
+    'marrakech': 'RAK',
+    'melbourne': 'MEL',
+    'mexico city': 'MEX',
+    'miami': 'MIA',
+    'milan': 'MIL',
+    'montreal': 'YMQ',
+    'moscow': 'MOW',
+    'mumbai': 'BOM',
+    'munich': 'MUC',
+    'naples': 'NAP',
+    'new delhi': 'DEL',
+    'new york': 'NYC',
+    'nice': 'NCE',
+    'orlando': 'ORL',
+    'osaka': 'OSA',
+    'oslo': 'OSL',
+    'paris': 'PAR',
+    'prague': 'PRG',
+    'reykjavik': 'REK',
+    'rio de janeiro': 'RIO',
+    'rome': 'ROM',
+    'san francisco': 'SFO',
+    'sao paulo': 'SAO',
+    'seattle': 'SEA',
+    'seoul': 'SEL',
+    'shanghai': 'SHA',
+    'singapore': 'SIN',
+    'stockholm': 'STO',
+    'sydney': 'SYD',
+    'taipei': 'TPE',
+    'tel aviv': 'TLV',
+    'tokyo': 'TYO',
+    'toronto': 'YTO',
+    'vancouver': 'YVR',
+    'venice': 'VCE',
+    'vienna': 'VIE',
+    'warsaw': 'WAW',
+    'washington': 'WAS',
+    'zurich': 'ZRH',
+}
+
+
+def _cache_key(key):
+    return make_cache_key("iata", key)
+
+
+def lookup_city_code(city_name):
+    """
+    Resolve a city name without calling Amadeus.
+
+    Returns ``(found, code)``: ``found`` is False when neither the bundled
+    table nor the learned cache knows the city, and ``code`` is None when the
+    city is known to have no Amadeus code.
+    """
+    key = normalize_key(city_name)
+    if not key:
+        return True, None
+    if key in CITY_IATA_CODES:
+        return True, CITY_IATA_CODES[key]
+    cached = caches['shared'].get(_cache_key(key))
+    if cached is None:
+        return False, None
+    return True, None if cached == NEGATIVE else cached
+
+
+def remember_city_code(city_name, code):
+    """Store an Amadeus lookup result (or the lack of one) in the learned cache."""
+    key = normalize_key(city_name)
+    if not key:
+        return
+    if code:
+        caches['shared'].set(_cache_key(key), code, timeout=CITY_CODE_TTL)
+    else:
+        caches['shared'].set(_cache_key(key), NEGATIVE, timeout=CITY_CODE_NEGATIVE_TTL)
+
+
+def _valid_code(code):
+    """Return ``code`` as an upper-case IATA code, or None if it is not three letters."""
+    if not isinstance(code, str):
+        return None
+    code = code.strip().upper()
+    if len(code) == 3 and code.isascii() and code.isalpha():
+        return code
+    return None
+
+
+def preload_city_codes(mapping):
+    """
+    Bulk-load ``{city_name: iata_code}`` pairs into the learned cache.
+
+    Returns ``(loaded, skipped)``: the number of codes stored and the city
+    names whose entry was not a three-letter code (or had no usable name).
+    """
+    entries = {}
+    skipped = []
+    for city, code in mapping.items():
+        key = normalize_key(city)
+        valid_code = _valid_code(code)
+        if key and valid_code:
+            entries[_cache_key(key)] = valid_code
+        else:
+            skipped.append(city)
+    caches['shared'].set_many(entries, timeout=CITY_CODE_TTL)
+    return len(entries), skipped
@@ -1,145 +1,412 @@
 import os
 import json
-import google.generativeai as genai
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from dataclasses import dataclass, field
 from datetime import datetime
+from .itinerary_cache import generation_key, get_cached_itinerary, store_itinerary
+from .json_stream import ArrayItemParser
+from .itinerary_schema import ITINERARY_SCHEMA, DayPlan, parse_itinerary
+from .itinerary_chunks import (
+    ITINERARY_CHUNK_RETRIES, chunk_context, chunk_dates, day_ranges, merge_chunks, missing_days, renumber_days,
+)
+from .llm_stats import record_call, usage_tokens
 
-# Configure the Gemini API
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY environment variable is not set")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "models/gemini-1.5-flash")
 
-# Configure the API with the correct version
-genai.configure(api_key=GOOGLE_API_KEY)
+# Prompt templates: "full" spells out the format and guidance, "compact"
+# relies on the response schema. "ab" splits requests between the two so
+# their token use and parse rates can be compared in the LLM stats.
+PROMPT_FULL = 'full'
+PROMPT_COMPACT = 'compact'
+PROMPT_AB = 'ab'
+ITINERARY_PROMPT_MODE = os.getenv("ITINERARY_PROMPT_MODE", PROMPT_FULL)
 
-def generate_itinerary(city_name, start_date, end_date, preferences=None):
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.8,
+    "top_k": 40,
+    # JSON mode: the model's output is constrained to the itinerary schema
+    "response_mime_type": "application/json",
+    "response_schema": ITINERARY_SCHEMA,
+}
+
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+]
+
+# google.generativeai is heavy to import, so it is loaded and configured on
+# the first AI request, and each model configuration is built only once.
+_genai = None
+_models = {}
+_models_lock = threading.Lock()
+
+def _get_genai():
+    """Import and configure the Gemini SDK on first use."""
+    global _genai
+    if _genai is None:
+        if not GOOGLE_API_KEY:
+            raise ValueError("GOOGLE_API_KEY environment variable is not set")
+        import google.generativeai as genai
+        genai.configure(api_key=GOOGLE_API_KEY)
+        _genai = genai
+    return _genai
+
+def _local_model():
+    from .itinerary_backends import LocalItineraryModel
+    return LocalItineraryModel(**getattr(settings, 'ITINERARY_LOCAL_BACKEND', {}))
+
+# Generator backends selectable with settings.ITINERARY_BACKEND
+BACKENDS = {
+    'local': _local_model,
+}
+
+def get_model(model_name=None, generation_config=None, safety_settings=None):
+    """
+    Return a shared GenerativeModel for this configuration, creating it on
+    first use. Models hold no per-request state, so one instance serves all
+    threads and event loops.
+
+    When ``settings.ITINERARY_BACKEND`` names another backend, its model is
+    returned instead; it implements the same generate_content method.
     """
-    Generate an AI-powered itinerary using Google's Gemini API.
+    backend = getattr(settings, 'ITINERARY_BACKEND', 'gemini')
+    if backend != 'gemini':
+        model = _models.get(backend)
+        if model is None:
+            with _models_lock:
+                model = _models.get(backend)
+                if model is None:
+                    if backend not in BACKENDS:
+                        raise ValueError(f"Unknown itinerary backend: {backend}")
+                    model = _models[backend] = BACKENDS[backend]()
+        return model
+
+    model_name = model_name or GEMINI_MODEL
+    generation_config = generation_config or GENERATION_CONFIG
+    safety_settings = safety_settings or SAFETY_SETTINGS
+    key = (
+        model_name,
+        json.dumps(generation_config, sort_keys=True, default=str),
+        json.dumps(safety_settings, sort_keys=True, default=str),
+    )
+    model = _models.get(key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                model = _get_genai().GenerativeModel(
+                    model_name=model_name,
+                    generation_config=generation_config,
+                    safety_settings=safety_settings
+                )
+                _models[key] = model
+    return model
+
+def _full_prompt(city_name, start_date, end_date, num_days):
+    """The original, fully spelled-out itinerary prompt."""
+    return f"""Create a detailed {num_days}-day travel itinerary for {city_name} from {start_date} to {end_date}.
+    
+    Please include:
+    1. Daily activities with suggested times
+    2. Popular attractions and landmarks
+    3. Local restaurants and food recommendations
+    4. Transportation tips between locations
+    5. Estimated costs for major activities
     
-    Args:
-        city_name (str): Name of the city
-        start_date (str): Start date in YYYY-MM-DD format
-        end_date (str): End date in YYYY-MM-DD format
-        preferences (dict, optional): User preferences including:
-            - prompt (str): User's custom prompt
-            - travel_style (str): 'relaxed', 'balanced', or 'intensive'
-            - budget (str): 'budget', 'medium', or 'luxury'
+    Format the response as a structured JSON with the following format:
+    {{
+        "itinerary": [
+            {{
+                "day": 1,
+                "date": "YYYY-MM-DD",
+                "activities": [
+                    {{
+                        "time": "HH:MM",
+                        "title": "Activity name",
+                        "description": "Brief description",
+                        "location": "Location name",
+                        "estimated_cost": "Cost in local currency",
+                        "duration": "Estimated duration"
+                    }}
+                ]
+            }}
+        ],
+        "total_estimated_cost": "Total cost in local currency",
+        "additional_tips": ["Tip 1", "Tip 2", ...]
+    }}
     
-    Returns:
-        dict: Generated itinerary with daily activities
+    Make the itinerary realistic and consider:
+    - Opening hours of attractions
+    - Travel time between locations
+    - Local customs and best times to visit places
+    - A mix of popular and off-the-beaten-path experiences
+    
+    IMPORTANT: Respond ONLY with valid JSON. Do not include any other text or explanation.
     """
+
+def _build_prompt(city_name, start_date, end_date, preferences=None, mode=PROMPT_FULL):
+    """Build the itinerary prompt for a trip and the user's preferences."""
+    # Format dates
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+    num_days = (end - start).days + 1
+    
+    if mode == PROMPT_COMPACT:
+        prompt = (
+            f"Plan a {num_days}-day trip to {city_name}, {start_date} to {end_date}, as JSON. "
+            f"Each day: timed activities (sights, local food, transport tips) with location, "
+            f"cost in local currency and duration. Respect opening hours and travel time; "
+            f"mix famous and lesser-known places."
+        )
+    else:
+        prompt = _full_prompt(city_name, start_date, end_date, num_days)
+
+    if preferences:
+        # Add user preferences to the prompt
+        prompt += f"\n\nConsider these preferences:\n"
+        if 'prompt' in preferences:
+            prompt += f"- Custom requirements: {preferences['prompt']}\n"
+        if 'travel_style' in preferences:
+            prompt += f"- Travel style: {preferences['travel_style']}\n"
+        if 'budget' in preferences:
+            prompt += f"- Budget level: {preferences['budget']}\n"
+    return prompt
+
+def _parse_text(text):
+    """Parse Gemini output text into validated itinerary data, or an error dict."""
     try:
-        # Initialize the model with safety settings
-        generation_config = {
-            "temperature": 0.7,
-            "top_p": 0.8,
-            "top_k": 40,
+        return parse_itinerary(text).to_dict()
+    except ValueError as e:
+        print(f"Error parsing Gemini response: {e}")
+        print(f"Raw response: {text}")
+        return {
+            "error": "Failed to parse itinerary",
+            "raw_response": text
         }
-        
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-        ]
-        
-        model = genai.GenerativeModel(
-            model_name="models/gemini-1.5-flash",
-            generation_config=generation_config,
-            safety_settings=safety_settings
+
+def _parse_day(day, position):
+    """Validate one streamed day block; returns a dict or None."""
+    plan = DayPlan.from_dict(day, position)
+    return plan.to_dict() if plan else None
+
+def _parse_response(response):
+    """Parse a Gemini response into itinerary data, or an error dict."""
+    return _parse_text(response.text)
+
+# Day ranges of long trips are generated concurrently on this pool.
+_chunk_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='gemini-chunk')
+
+@dataclass
+class _Generation:
+    """
+    One itinerary request plus what is needed to account for it. Token
+    usage of every LLM call made for it (e.g. one per chunk of a long trip)
+    is summed and recorded as a single generation.
+    """
+    city_name: str
+    start_date: str
+    end_date: str
+    preferences: dict = None
+    user_id: str = None
+    prompt_mode: str = PROMPT_FULL
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    recorded: bool = False
+    _usage_lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @classmethod
+    def create(cls, city_name, start_date, end_date, preferences=None, user_id=None):
+        generation = cls(city_name, start_date, end_date, preferences, user_id)
+        generation.prompt_mode = _prompt_mode(generation.key)
+        return generation
+
+    @property
+    def key(self):
+        return generation_key(self.city_name, self.start_date, self.end_date, self.preferences)
+
+    def prompt(self):
+        return _build_prompt(self.city_name, self.start_date, self.end_date, self.preferences, self.prompt_mode)
+
+    def add_usage(self, response):
+        prompt_tokens, output_tokens = usage_tokens(response)
+        with self._usage_lock:
+            self.prompt_tokens += prompt_tokens
+            self.output_tokens += output_tokens
+
+    def record(self, started, response=None, itinerary_data=None, cache_hit=False, failed=False):
+        if response is not None:
+            self.add_usage(response)
+        self.recorded = True
+        record_call(
+            self.city_name, self.user_id, self.prompt_mode,
+            prompt_tokens=self.prompt_tokens,
+            output_tokens=self.output_tokens,
+            latency=time.monotonic() - started,
+            parsed=cache_hit or failed or 'error' not in itinerary_data,
+            cache_hit=cache_hit,
+            failed=failed,
         )
-        
-        # Format dates
-        start = datetime.strptime(start_date, '%Y-%m-%d')
-        end = datetime.strptime(end_date, '%Y-%m-%d')
-        num_days = (end - start).days + 1
-        
-        # Create the prompt
-        prompt = f"""Create a detailed {num_days}-day travel itinerary for {city_name} from {start_date} to {end_date}.
-        
-        Please include:
-        1. Daily activities with suggested times
-        2. Popular attractions and landmarks
-        3. Local restaurants and food recommendations
-        4. Transportation tips between locations
-        5. Estimated costs for major activities
-        
-        Format the response as a structured JSON with the following format:
-        {{
-            "itinerary": [
-                {{
-                    "day": 1,
-                    "date": "YYYY-MM-DD",
-                    "activities": [
-                        {{
-                            "time": "HH:MM",
-                            "title": "Activity name",
-                            "description": "Brief description",
-                            "location": "Location name",
-                            "estimated_cost": "Cost in local currency",
-                            "duration": "Estimated duration"
-                        }}
-                    ]
-                }}
-            ],
-            "total_estimated_cost": "Total cost in local currency",
-            "additional_tips": ["Tip 1", "Tip 2", ...]
-        }}
-        
-        Make the itinerary realistic and consider:
-        - Opening hours of attractions
-        - Travel time between locations
-        - Local customs and best times to visit places
-        - A mix of popular and off-the-beaten-path experiences
-        
-        IMPORTANT: Respond ONLY with valid JSON. Do not include any other text or explanation.
-        """
-        
-        if preferences:
-            # Add user preferences to the prompt
-            prompt += f"\n\nConsider these preferences:\n"
-            if 'prompt' in preferences:
-                prompt += f"- Custom requirements: {preferences['prompt']}\n"
-            if 'travel_style' in preferences:
-                prompt += f"- Travel style: {preferences['travel_style']}\n"
-            if 'budget' in preferences:
-                prompt += f"- Budget level: {preferences['budget']}\n"
-        
-        # Generate the response
-        response = model.generate_content(prompt)
-        
-        # Parse the response
-        try:
-            # Clean the response text to ensure it's valid JSON
-            response_text = response.text.strip()
-            # Remove any markdown code block markers if present
-            response_text = response_text.replace('```json', '').replace('```', '').strip()
-            
-            # Parse the JSON response
-            itinerary_data = json.loads(response_text)
-            return itinerary_data
-        except json.JSONDecodeError as e:
-            print(f"Error parsing Gemini response: {e}")
-            print(f"Raw response: {response.text}")
-            return {
-                "error": "Failed to parse itinerary",
-                "raw_response": response.text
-            }
-            
+
+    def store(self, itinerary_data):
+        store_itinerary(self.city_name, self.start_date, self.end_date, self.preferences, itinerary_data)
+
+def _prompt_mode(key):
+    """Pick the prompt template; in A/B mode each set of inputs gets a stable half."""
+    if ITINERARY_PROMPT_MODE == PROMPT_AB:
+        return PROMPT_COMPACT if int(key[-8:], 16) % 2 else PROMPT_FULL
+    return ITINERARY_PROMPT_MODE
+
+def _chunk_prompt(generation, day_range, ranges):
+    first_day, last_day = day_range
+    chunk_start, chunk_end = chunk_dates(generation.start_date, first_day, last_day)
+    prompt = _build_prompt(
+        generation.city_name, chunk_start, chunk_end, generation.preferences, generation.prompt_mode
+    )
+    return prompt + chunk_context(generation.start_date, generation.end_date, first_day, last_day, ranges)
+
+def _finish_chunk(generation, itinerary_data, day_range):
+    if 'error' not in itinerary_data:
+        renumber_days(itinerary_data, generation.start_date, *day_range)
+    return day_range, itinerary_data
+
+def _generate_chunk(generation, day_range, ranges):
+    """
+    Generate one day range, asking again (up to ITINERARY_CHUNK_RETRIES
+    times) if the answer has fewer days than the range. The fullest answer
+    is kept; merge_chunks marks the itinerary partial if days are still missing.
+    """
+    best = None
+    for _ in range(ITINERARY_CHUNK_RETRIES + 1):
+        response = get_model().generate_content(_chunk_prompt(generation, day_range, ranges))
+        generation.add_usage(response)
+        itinerary_data = _parse_response(response)
+        _, itinerary_data = _finish_chunk(generation, itinerary_data, day_range)
+        if 'error' in itinerary_data:
+            break
+        if best is None or len(itinerary_data['itinerary']) > len(best['itinerary']):
+            best = itinerary_data
+        if not missing_days(best, *day_range):
+            break
+    return day_range, best or itinerary_data
+
+def _iter_chunks(generation, ranges):
+    """
+    Generate each day range of a long trip concurrently, yielding
+    ``(day_range, itinerary)`` in completion order. Chunks still pending
+    when the caller stops are cancelled.
+    """
+    futures = [_chunk_executor.submit(_generate_chunk, generation, day_range, ranges) for day_range in ranges]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def _lookup_cached(generation):
+    """Return a cached itinerary for ``generation`` (recording the hit), or None."""
+    started = time.monotonic()
+    cached = get_cached_itinerary(
+        generation.city_name, generation.start_date, generation.end_date, generation.preferences
+    )
+    if cached:
+        generation.record(started, cache_hit=True)
+    return cached
+
+def _finish_stream(text, parser, days):
+    """Parse the full streamed text, falling back to the days already parsed."""
+    itinerary_data = _parse_text(text)
+    if 'error' in itinerary_data and parser.done and days:
+        # The trailing fields were malformed but every day came through.
+        itinerary_data = {"itinerary": days}
+    return itinerary_data
+
+def stream_itinerary(city_name, start_date, end_date, preferences=None, user_id=None):
+    """
+    Generate an itinerary with Gemini's streamed responses.
+
+    Yields ``("day", day)`` as soon as each day block in the partial JSON is
+    complete, then ``("done", itinerary)`` with the whole document, or
+    ``("error", details)`` if generation fails.
+    """
+    generation = None
+    started = time.monotonic()
+    try:
+        generation = _Generation.create(city_name, start_date, end_date, preferences, user_id)
+        cached = _lookup_cached(generation)
+        if cached:
+            for day in cached.get('itinerary', []):
+                yield "day", day
+            yield "done", cached
+            return
+
+        # Long trips: yield each day range's days as that chunk completes
+        ranges = day_ranges(start_date, end_date)
+        if len(ranges) > 1:
+            started = time.monotonic()
+            chunks = []
+            for day_range, itinerary_data in _iter_chunks(generation, ranges):
+                if 'error' in itinerary_data:
+                    generation.record(started, itinerary_data=itinerary_data)
+                    yield "error", itinerary_data
+                    return
+                chunks.append((day_range, itinerary_data))
+                for day in itinerary_data['itinerary']:
+                    yield "day", day
+            itinerary_data = merge_chunks(chunks)
+            generation.record(started, itinerary_data=itinerary_data)
+            if not itinerary_data.get('partial'):
+                generation.store(itinerary_data)
+            yield "done", itinerary_data
+            return
+
+        started = time.monotonic()
+        model = get_model()
+        response = model.generate_content(generation.prompt(), stream=True)
+
+        parser = ArrayItemParser("itinerary")
+        days = []
+        text = []
+        for chunk in response:
+            text.append(chunk.text)
+            for day in parser.feed(chunk.text):
+                day = _parse_day(day, len(days) + 1)
+                if day is None:
+                    continue
+                days.append(day)
+                yield "day", day
+
+        itinerary_data = _finish_stream(''.join(text), parser, days)
+        generation.record(started, response, itinerary_data)
+        if 'error' in itinerary_data:
+            yield "error", itinerary_data
+            return
+        generation.store(itinerary_data)
+        yield "done", itinerary_data
     except Exception as e:
         print(f"Error generating itinerary: {e}")
-        return {
+        if generation is not None and not generation.recorded:
+            generation.record(started, failed=True)
+        yield "error", {
             "error": "Failed to generate itinerary",
             "details": str(e)
-        } 
\ No newline at end of file
+        }
@@ -1,16 +1,171 @@
-import requests
+from . import http_client
+from .cache_utils import keep_warming, make_cache_key
+from django.core.cache import caches
+import asyncio
+import math
 import os
 
 API_KEY = os.getenv("GEOAPIFY_API")
+GEOAPIFY_URL = "https://api.geoapify.com/v2/places"
 
-def get_pois(lat, lon, category):
-    url = "https://api.geoapify.com/v2/places"
-    params = {
-        "categories": category,
-        "filter": f"circle:{lon},{lat},10000",
-        "limit": 20,
+# POIs are cached on a fixed grid of TILE_SIZE-degree cells, so searches
+# around slightly different coordinates in the same area share upstream
+# results. Each cell is fetched with one request for all wanted categories
+# (comma-separated) and stored split by category. A 10 km search covers about
+# a dozen cells at European latitudes, so a cold city costs roughly one call
+# per cell; a very dense cell pages on in TILE_PAGE_SIZE steps up to
+# TILE_MAX_PAGES.
+TILE_SIZE = 0.1
+TILE_PAGE_SIZE = 500
+TILE_MAX_PAGES = int(os.getenv("GEOAPIFY_TILE_MAX_PAGES", "2"))
+POI_TILE_TTL = 60 * 60 * 24 * 7
+
+EARTH_RADIUS_M = 6371000
+METERS_PER_DEGREE = 111320
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in metres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def _covering_tiles(lat, lon, radius):
+    """Grid cells intersecting the bounding box of a ``radius`` metre circle."""
+    dlat = radius / METERS_PER_DEGREE
+    dlon = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    min_x, max_x = math.floor((lon - dlon) / TILE_SIZE), math.floor((lon + dlon) / TILE_SIZE)
+    min_y, max_y = math.floor((lat - dlat) / TILE_SIZE), math.floor((lat + dlat) / TILE_SIZE)
+    return [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+
+def _tile_params(categories, x, y, page):
+    west, south = x * TILE_SIZE, y * TILE_SIZE
+    east, north = west + TILE_SIZE, south + TILE_SIZE
+    return {
+        "categories": ",".join(categories),
+        "filter": f"rect:{west},{south},{east},{north}",
+        # A fixed order keeps offset paging stable
+        "bias": f"proximity:{west + TILE_SIZE / 2},{south + TILE_SIZE / 2}",
+        "limit": TILE_PAGE_SIZE,
+        "offset": page * TILE_PAGE_SIZE,
         "apiKey": API_KEY
     }
-    response = requests.get(url, params=params)
+
+
+def _parse_tile(categories, response):
+    if response.status_code != 200:
+        print(f"Error fetching POIs for {','.join(categories)}: {response.status_code} - {response.text}")
+        return None
     data = response.json()
     return data.get("features", [])
+
+
+def _matches(category, feature_categories):
+    prefix = category + "."
+    return any(c == category or c.startswith(prefix) for c in feature_categories)
+
+
+def _split_by_category(categories, features):
+    """Group features under each requested category they belong to."""
+    by_category = {category: [] for category in categories}
+    for feature in features:
+        feature_categories = feature.get("properties", {}).get("categories", [])
+        for category in categories:
+            if _matches(category, feature_categories):
+                by_category[category].append(feature)
+    return by_category
+
+
+async def _afetch_tile(categories, x, y):
+    features = []
+    for page in range(TILE_MAX_PAGES):
+        response = await http_client.aget(GEOAPIFY_URL, params=_tile_params(categories, x, y, page))
+        page_features = _parse_tile(categories, response)
+        if page_features is None:
+            return None
+        features.extend(page_features)
+        if len(page_features) < TILE_PAGE_SIZE:
+            break
+    return _split_by_category(categories, features)
+
+
+def _tile_cache_key(categories, x, y):
+    return make_cache_key("poi_tile", ",".join(categories), TILE_SIZE, x, y)
+
+
+async def _aget_tile(categories, x, y):
+    cache = caches['shared']
+    cache_key = _tile_cache_key(categories, x, y)
+    by_category = await cache.aget(cache_key)
+    if by_category is None:
+        by_category = await _afetch_tile(categories, x, y)
+        if by_category is None:
+            return None
+        await cache.aset(cache_key, by_category, timeout=POI_TILE_TTL)
+    return by_category
+
+
+def _select_nearby(lat, lon, radius, limit, tiles):
+    """Merge tile features, keeping the ``limit`` nearest within ``radius``."""
+    seen_ids = set()
+    nearby = []
+    for features in tiles:
+        for feature in features:
+            properties = feature.get("properties", {})
+            place_id = properties.get("place_id")
+            if place_id:
+                if place_id in seen_ids:
+                    continue
+                seen_ids.add(place_id)
+            poi_lat, poi_lon = properties.get("lat"), properties.get("lon")
+            if poi_lat is None or poi_lon is None:
+                continue
+            distance = distance_m(lat, lon, poi_lat, poi_lon)
+            if distance <= radius:
+                nearby.append((distance, feature))
+
+    nearby.sort(key=lambda item: item[0])
+    return [feature for _, feature in nearby[:limit]]
+
+
+async def aget_pois(lat, lon, categories, limit=20, radius=10000, timeout=None):
+    """
+    Return ``({category: pois}, complete)`` with up to ``limit`` POIs of each
+    category within ``radius`` metres, nearest first, by merging the cached
+    grid cells covering the circle (fetched concurrently, one request per
+    cell for all categories) and filtering them locally.
+
+    Cells that fail, or are still loading after ``timeout`` seconds, are
+    left out and ``complete`` is False. Late cells keep loading in the
+    background (see ``keep_warming``) so a reload finds them cached.
+    """
+    categories = sorted(set(categories))
+    lat, lon = float(lat), float(lon)
+    tasks = [
+        asyncio.create_task(_aget_tile(categories, x, y))
+        for x, y in _covering_tiles(lat, lon, radius)
+    ]
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        keep_warming(task)
+
+    tiles = []
+    for task in tasks:
+        if task not in done:
+            continue
+        try:
+            tile = task.result()
+        except Exception as e:
+            print(f"Error fetching POI tile: {str(e)}")
+            continue
+        if tile is not None:
+            tiles.append(tile)
+    complete = len(tiles) == len(tasks)
+    return {
+        category: _select_nearby(lat, lon, radius, limit, [tile.get(category, []) for tile in tiles])
+        for category in categories
+    }, complete
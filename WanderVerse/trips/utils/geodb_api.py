@@ -1,10 +1,23 @@
-import requests
+from . import http_client
+from .cache_utils import LRUCache, NEGATIVE, make_cache_key, normalize_key
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
 import os
 
 API_KEY = os.getenv("GEODB_API")
 
-def get_city_coordinates(city_name):
-    url = "https://wft-geo-db.p.rapidapi.com/v1/geo/cities"
+# City coordinates practically never change, so keep hits for a month and
+# remember unknown names for a day to avoid re-asking GeoDB about typos.
+GEOCODE_TTL = 60 * 60 * 24 * 30
+GEOCODE_NEGATIVE_TTL = 60 * 60 * 24
+
+_local_cache = LRUCache(maxsize=2048, ttl=60 * 60)
+
+
+GEODB_URL = "https://wft-geo-db.p.rapidapi.com/v1/geo/cities"
+
+
+def _request_kwargs(city_name):
     headers = {
         "X-RapidAPI-Key": API_KEY,
         "X-RapidAPI-Host": "wft-geo-db.p.rapidapi.com"
@@ -14,8 +27,15 @@ def get_city_coordinates(city_name):
         "limit": 1,
         "sort": "-population"
     }
-    response = requests.get(url, headers=headers, params=params)
-    data = response.json()
+    return {"headers": headers, "params": params}
+
+
+def _parse_city(city_name, status_code, data):
+    """Return ``(city, cacheable)`` for a GeoDB response body."""
+    if "data" not in data:
+        # Rate limited or otherwise rejected; report it without caching.
+        print(f"Error geocoding '{city_name}': {status_code} - {data}")
+        return None, False
 
     if data["data"]:
         city = data["data"][0]
@@ -23,5 +43,51 @@ def get_city_coordinates(city_name):
             "lat": city["latitude"],
             "lon": city["longitude"],
             "full_name": f"{city['city']}, {city['countryCode']}"
-        }
-    return None
+        }, True
+    return None, True
+
+
+async def _afetch_city_coordinates(city_name):
+    response = await http_client.aget(GEODB_URL, **_request_kwargs(city_name))
+    return _parse_city(city_name, response.status_code, response.json())
+
+
+def _lookup_shared(key):
+    """Return ``(found, city)`` from the shared cache, warming the local LRU."""
+    cached = caches['shared'].get(make_cache_key("geocode", key))
+    if cached is None:
+        return False, None
+    city = None if cached == NEGATIVE else cached
+    _local_cache.set(key, city)
+    return True, city
+
+
+def _store(key, city):
+    cache_key = make_cache_key("geocode", key)
+    if city:
+        caches['shared'].set(cache_key, city, timeout=GEOCODE_TTL)
+    else:
+        caches['shared'].set(cache_key, NEGATIVE, timeout=GEOCODE_NEGATIVE_TTL)
+    _local_cache.set(key, city)
+
+
+async def aget_city_coordinates(city_name):
+    """
+    Resolve a city name to coordinates, reading through an in-process LRU and
+    the shared cache before calling GeoDB. Names are normalized so case,
+    whitespace and diacritics variants share an entry.
+    """
+    key = normalize_key(city_name)
+    if not key:
+        return None
+
+    found, city = _local_cache.lookup(key)
+    if not found:
+        found, city = await sync_to_async(_lookup_shared, thread_sensitive=False)(key)
+    if found:
+        return city
+
+    city, cacheable = await _afetch_city_coordinates(' '.join(city_name.split()))
+    if cacheable:
+        await sync_to_async(_store, thread_sensitive=False)(key, city)
+    return city
@@ -1,75 +1,196 @@
+import httpx
 import requests
-import os
+from asgiref.sync import sync_to_async
+from . import http_client
+from .amadeus_auth import token_manager
+from .cache_utils import StaleWhileRevalidateCache
+from .city_codes import lookup_city_code, remember_city_code
+from .json_stream import ArrayItemParser, iter_array_items
 # from datetime import datetime, timedelta # No longer needed for offers
-import json
 
-CLIENT_ID = os.getenv("AMADEUS_API_KEY")
-CLIENT_SECRET = os.getenv("AMADEUS_SECRET")
+LOCATIONS_URL = "https://test.api.amadeus.com/v1/reference-data/locations"
+HOTELS_BY_CITY_URL = "https://test.api.amadeus.com/v1/reference-data/locations/hotels/by-city"
 
 def get_amadeus_token():
-    url = "https://test.api.amadeus.com/v1/security/oauth2/token"
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET
-    }
-    response = requests.post(url, data=data)
-    if response.status_code == 200:
-        return response.json().get("access_token")
-    else:
-        print(f"Error fetching Amadeus token: {response.status_code} - {response.text}")
+    """Return a cached Amadeus access token, refreshing it shortly before expiry."""
+    try:
+        return token_manager.get_token()
+    except (requests.RequestException, KeyError, ValueError) as e:
+        print(f"Error fetching Amadeus token: {e}")
         return None
 
-def get_city_code(city_name, token):
+def get_city_code(city_name, token=None):
+    """
+    Resolve a city name to its Amadeus IATA city code.
+
+    The bundled table and the learned cache are checked first; Amadeus is
+    only called (with ``token``, or a cached one if omitted) for cities
+    neither knows, and the answer is remembered for next time.
+    """
+    found, city_code = lookup_city_code(city_name)
+    if found:
+        return city_code
+
+    token = token or get_amadeus_token()
     if not token: return None
-    url = "https://test.api.amadeus.com/v1/reference-data/locations"
     headers = {"Authorization": f"Bearer {token}"}
     params = {"keyword": city_name, "subType": "CITY"}
-    response = requests.get(url, headers=headers, params=params)
+    try:
+        response = http_client.get(LOCATIONS_URL, headers=headers, params=params)
+    except requests.RequestException as e:
+        print(f"Error fetching city code: {e}")
+        return None
+    return _city_code_from_response(city_name, response)
+
+def _city_code_from_response(city_name, response):
     if response.status_code == 200:
         data = response.json().get("data", [])
-        if data:
-            print(f"--- Amadeus City Code API Response for {city_name} ---")
-            print(json.dumps(data, indent=2))
-            print("--- End of City Code API Response ---")
-            return data[0].get("iataCode")
+        city_code = data[0].get("iataCode") if data else None
+        remember_city_code(city_name, city_code)
+        return city_code
     else:
+        if response.status_code == 401:
+            token_manager.invalidate()
         print(f"Error fetching city code: {response.status_code} - {response.text}")
     return None
 
-def get_hotels_in_city(city_code, token, radius=20):
+# Hotel fields the trip pages actually render; everything else in the
+# Amadeus payload is dropped while parsing.
+HOTEL_FIELDS = ("name", "hotelId", "rating", "distance")
+HOTEL_ADDRESS_FIELDS = ("lines", "cityName", "countryCode")
+
+def _compact_hotel(hotel):
+    """Project a raw Amadeus hotel record onto the fields the UI uses."""
+    compact = {field: hotel[field] for field in HOTEL_FIELDS if field in hotel}
+    geo_code = hotel.get("geoCode")
+    if geo_code:
+        compact["geoCode"] = {
+            "latitude": geo_code.get("latitude"),
+            "longitude": geo_code.get("longitude")
+        }
+    address = hotel.get("address")
+    if address:
+        compact["address"] = {field: address[field] for field in HOTEL_ADDRESS_FIELDS if field in address}
+    return compact
+
+def _fetch_hotels_in_city(city_code, radius):
     """
     Fetches a list of hotels within a given city from Amadeus.
+
+    Returns None on failure so the result is not cached.
     """
-    if not token or not city_code: # Handles None or empty string for city_code
-        print(f"Skipping get_hotels_in_city: Missing token or city_code. Token present: {bool(token)}, City Code: '{city_code}'")
-        return {"hotels": [], "meta": None} # Return a dict with hotels and meta
-    
-    url = "https://test.api.amadeus.com/v1/reference-data/locations/hotels/by-city"
+    token = get_amadeus_token()
+    if not token:
+        return None
+
     headers = {"Authorization": f"Bearer {token}"}
-    params = {
+    params = _hotels_params(city_code, radius)
+    
+    print(f"Fetching hotels for city code '{city_code}' with radius {radius}km")
+    try:
+        response = http_client.get(HOTELS_BY_CITY_URL, headers=headers, params=params, stream=True)
+    except requests.RequestException as e:
+        print(f"Error fetching hotels by city: {e}")
+        return None
+    
+    with response:
+        if response.status_code == 200:
+            response.encoding = response.encoding or "utf-8"
+            try:
+                chunks = response.iter_content(chunk_size=16384, decode_unicode=True)
+                hotels_list = [_compact_hotel(hotel) for hotel in iter_array_items(chunks, "data")]
+            except requests.RequestException as e:
+                print(f"Error reading hotels by city response: {e}")
+                return None
+            print(f"Fetched {len(hotels_list)} hotels for city code '{city_code}'")
+            # Only the "data" array is parsed; pagination metadata is not used.
+            return {"hotels": hotels_list, "meta": None}
+        _report_hotels_error(response, params)
+    return None
+
+def _hotels_params(city_code, radius):
+    return {
         "cityCode": city_code,
         "radius": radius,
         "radiusUnit": "KM"
     }
-    
-    print(f"Fetching hotels for city code '{city_code}' with radius {radius}km using params: {params}")
-    response = requests.get(url, headers=headers, params=params)
-    
-    if response.status_code == 200:
-        raw_data = response.json()
-        # Ensure we print the full raw_data to inspect for any pagination clues
-        print(f"--- Amadeus Hotels by City API Response (City: {city_code}) ---")
-        print(json.dumps(raw_data, indent=2))
-        print("--- End of Hotels by City API Response ---")
-        hotels_list = raw_data.get("data", [])
-        meta = raw_data.get("meta") # Attempt to get metadata, might be None
-        return {"hotels": hotels_list, "meta": meta}
-    else:
-        print(f"Error fetching hotels by city: {response.status_code} - {response.text}")
-        # Log the URL and params that caused the error for easier debugging
-        print(f"Failed URL: {response.url}")
-        print(f"Failed Params: {params}")
-    return {"hotels": [], "meta": None} # Return a dict with hotels and meta
+
+def _report_hotels_error(response, params):
+    if response.status_code == 401:
+        token_manager.invalidate()
+    print(f"Error fetching hotels by city: {response.status_code} - {response.text}")
+    # Log the URL and params that caused the error for easier debugging
+    print(f"Failed URL: {response.url}")
+    print(f"Failed Params: {params}")
+
+# Hotel lists barely change day to day: serve entries up to a week old straight
+# away, refreshing anything older than six hours in the background (with the
+# sync _fetch_hotels_in_city, on the cache's refresh threads).
+hotel_cache = StaleWhileRevalidateCache(
+    _fetch_hotels_in_city,
+    maxsize=256,
+    fresh_ttl=60 * 60 * 6,
+    max_stale=60 * 60 * 24 * 7,
+)
+
+async def aget_amadeus_token():
+    """
+    Async version of ``get_amadeus_token``. The token is almost always served
+    from memory; the rare refresh runs in a worker thread.
+    """
+    return await sync_to_async(get_amadeus_token, thread_sensitive=False)()
+
+async def aget_city_code(city_name, token=None):
+    """Async version of ``get_city_code``."""
+    found, city_code = await sync_to_async(lookup_city_code, thread_sensitive=False)(city_name)
+    if found:
+        return city_code
+
+    token = token or await aget_amadeus_token()
+    if not token: return None
+    headers = {"Authorization": f"Bearer {token}"}
+    params = {"keyword": city_name, "subType": "CITY"}
+    try:
+        response = await http_client.aget(LOCATIONS_URL, headers=headers, params=params)
+    except httpx.HTTPError as e:
+        print(f"Error fetching city code: {e}")
+        return None
+    return await sync_to_async(_city_code_from_response, thread_sensitive=False)(city_name, response)
+
+async def _afetch_hotels_in_city(city_code, radius):
+    """Async version of ``_fetch_hotels_in_city``."""
+    token = await aget_amadeus_token()
+    if not token:
+        return None
+
+    headers = {"Authorization": f"Bearer {token}"}
+    params = _hotels_params(city_code, radius)
+    try:
+        async with http_client.astream("GET", HOTELS_BY_CITY_URL, headers=headers, params=params) as response:
+            if response.status_code != 200:
+                await response.aread()
+                _report_hotels_error(response, params)
+                return None
+            parser = ArrayItemParser("data")
+            hotels_list = []
+            async for text in response.aiter_text():
+                hotels_list.extend(_compact_hotel(hotel) for hotel in parser.feed(text))
+                if parser.done:
+                    break
+    except httpx.HTTPError as e:
+        print(f"Error fetching hotels by city: {e}")
+        return None
+    print(f"Fetched {len(hotels_list)} hotels for city code '{city_code}'")
+    return {"hotels": hotels_list, "meta": None}
+
+async def aget_hotels_in_city(city_code, token, radius=20):
+    """
+    Returns hotels for a city, served from the stale-while-revalidate cache
+    keyed by ``(city_code, radius)``.
+    """
+    if not token or not city_code:
+        return {"hotels": [], "meta": None}
+    result = await hotel_cache.aget((city_code, radius), _afetch_hotels_in_city, city_code, radius)
+    return result or {"hotels": [], "meta": None}
 
 # Removed get_hotel_offers function as per user request
\ No newline at end of file
@@ -0,0 +1,134 @@
+# trips/utils/http_client.py
+import asyncio
+import os
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))
+
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+_sessions = {}
+_lock = threading.Lock()
+
+# httpx.AsyncClient instances are bound to the event loop they were created
+# on, so keep one per loop. Under an ASGI server that is one client for the
+# life of the worker; under runserver every async view runs on a fresh loop,
+# so each client must be closed with its loop (see _hold_client).
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        pool_block=False,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # Sessions are shared between threads and users, so never carry cookies
+    # from one call over to the next.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def get_session(url):
+    """Return the keep-alive session for the host of ``url``, creating it once."""
+    host = urlsplit(url).netloc
+    session = _sessions.get(host)
+    if session is None:
+        with _lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = _build_session()
+                _sessions[host] = session
+    return session
+
+
+def request(method, url, timeout=None, **kwargs):
+    """
+    Send a request through the pooled session for the target host.
+
+    Accepts the same keyword arguments as ``requests.request``; ``timeout``
+    defaults to ``(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)``.
+    """
+    session = get_session(url)
+    return session.request(method, url, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def close_all():
+    """Close every pooled session, e.g. on worker shutdown."""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+async def _hold_client(loop, client):
+    """
+    Keep ``client`` open until ``loop`` shuts down. The loop closes every
+    unfinished async generator on shutdown (``asyncio.run`` and ASGI servers
+    call ``shutdown_asyncgens``), which runs the ``finally`` here.
+    """
+    try:
+        yield client
+    finally:
+        if _async_clients.get(loop, (None,))[0] is client:
+            del _async_clients[loop]
+        await client.aclose()
+
+
+async def get_async_client():
+    """Return the pooled ``httpx.AsyncClient`` for the running event loop."""
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None or entry[0].is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_MAXSIZE * HTTP_POOL_CONNECTIONS,
+                max_keepalive_connections=HTTP_POOL_MAXSIZE,
+            ),
+            cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+        )
+        holder = _hold_client(loop, client)
+        await holder.__anext__()
+        entry = _async_clients[loop] = (client, holder)
+    return entry[0]
+
+
+async def arequest(method, url, **kwargs):
+    """Async counterpart of ``request``, sharing its timeout and pool settings."""
+    client = await get_async_client()
+    return await client.request(method, url, **kwargs)
+
+
+async def aget(url, **kwargs):
+    return await arequest("GET", url, **kwargs)
+
+
+@asynccontextmanager
+async def astream(method, url, **kwargs):
+    """Async context manager yielding a streamed ``httpx.Response``."""
+    client = await get_async_client()
+    async with client.stream(method, url, **kwargs) as response:
+        yield response
@@ -0,0 +1,154 @@
+# trips/utils/itinerary_backends.py
+import hashlib
+import json
+import random
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+# A generator backend is any object with the subset of Gemini's
+# GenerativeModel interface that gemini_api uses:
+#
+#   generate_content(prompt)               -> response with ``text`` and
+#                                             ``usage_metadata`` (chunked trips)
+#   generate_content(prompt, stream=True)  -> iterable of chunks with ``text``,
+#                                             with ``usage_metadata`` on the
+#                                             response itself (stream_itinerary)
+
+
+class BackendError(Exception):
+    """Raised by the local backend to simulate an upstream API failure."""
+
+
+@dataclass
+class _Usage:
+    prompt_token_count: int
+    candidates_token_count: int
+
+
+class _Response:
+    def __init__(self, text, usage):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class _StreamedResponse:
+    def __init__(self, chunks, usage, delay):
+        self._chunks = chunks
+        self._delay = delay
+        self.usage_metadata = usage
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            time.sleep(self._delay)
+            yield _Response(chunk, None)
+
+
+_SLOTS = [
+    ('09:00', 'Breakfast at {place}', 'Local cafe near {place}', '15', '1 hour'),
+    ('10:30', 'Guided walk through {place}', 'Highlights of {place} with a local guide', '25', '2 hours'),
+    ('13:00', 'Lunch in {place}', 'Regional dishes at a family-run restaurant', '20', '1.5 hours'),
+    ('15:00', 'Visit the {place} museum', 'Collections on the history of {place}', '18', '2 hours'),
+    ('17:30', 'Sunset viewpoint above {place}', 'Short transit ride to the viewpoint', '5', '1 hour'),
+    ('19:30', 'Dinner in {place}', 'Evening meal in a lively neighbourhood', '35', '2 hours'),
+]
+_DISTRICTS = ['the Old Town', 'the Harbour', 'the Market Quarter', 'the Riverside', 'the Castle Hill',
+              'the Arts District', 'the University Quarter', 'the Botanical Gardens']
+_ACTIVITIES_PER_DAY = {'relaxed': 3, 'balanced': 4, 'intensive': 6}
+
+
+def _prompt_trip(prompt):
+    """Recover the city, day count, first date and travel style from a full or compact prompt."""
+    days = re.search(r'(\d+)-day', prompt)
+    dates = re.findall(r'\d{4}-\d{2}-\d{2}', prompt)
+    city = re.search(r'itinerary for (.+?) from \d{4}|trip to (.+?), \d{4}', prompt)
+    style = re.search(r'Travel style: (\w+)', prompt)
+    return (
+        (city.group(1) or city.group(2)) if city else 'the city',
+        int(days.group(1)) if days else 1,
+        dates[0] if dates else datetime.now().strftime('%Y-%m-%d'),
+        style.group(1).lower() if style else 'balanced',
+    )
+
+
+class LocalItineraryModel:
+    """
+    Deterministic offline stand-in for Gemini.
+
+    The same prompt always yields the same schema-valid itinerary. Latency
+    is ``latency + latency_per_day * days`` seconds with +/- ``jitter``
+    (a fraction), and ``failure_rate`` / ``malformed_rate`` make that share
+    of calls raise ``BackendError`` or return truncated JSON.
+    """
+
+    def __init__(self, latency=2.0, latency_per_day=0.5, jitter=0.2, failure_rate=0.0, malformed_rate=0.0):
+        self.latency = latency
+        self.latency_per_day = latency_per_day
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self._random = random.Random()
+
+    def _itinerary(self, prompt):
+        city, num_days, start_date, style = _prompt_trip(prompt)
+        seeded = random.Random(hashlib.sha1(prompt.encode('utf-8')).hexdigest())
+        start = datetime.strptime(start_date, '%Y-%m-%d')
+        per_day = _ACTIVITIES_PER_DAY.get(style, 4)
+        days = []
+        for index in range(num_days):
+            district = seeded.choice(_DISTRICTS)
+            place = f"{district} of {city}"
+            slots = sorted(seeded.sample(_SLOTS, min(per_day, len(_SLOTS))))
+            days.append({
+                "day": index + 1,
+                "date": (start + timedelta(days=index)).strftime('%Y-%m-%d'),
+                "activities": [
+                    {
+                        "time": slot_time,
+                        "title": title.format(place=place),
+                        "description": description.format(place=place),
+                        "location": place,
+                        "estimated_cost": f"{cost} EUR",
+                        "duration": duration,
+                    }
+                    for slot_time, title, description, cost, duration in slots
+                ],
+            })
+        return num_days, {
+            "itinerary": days,
+            "total_estimated_cost": f"{sum(int(slot[3]) for slot in _SLOTS[:per_day]) * num_days} EUR",
+            "additional_tips": [f"Buy a public transport pass for {city}", "Book popular museums in advance"],
+        }
+
+    def _plan(self, prompt):
+        """Return ``(text, usage, delay)`` for one call; ``text`` is None for an injected failure."""
+        num_days, itinerary = self._itinerary(prompt)
+        delay = max((self.latency + self.latency_per_day * num_days) * (
+            1 + self._random.uniform(-self.jitter, self.jitter)
+        ), 0)
+        roll = self._random.random()
+        if roll < self.failure_rate:
+            return None, None, delay
+        text = json.dumps(itinerary)
+        if roll < self.failure_rate + self.malformed_rate:
+            text = text[:int(len(text) * self._random.uniform(0.3, 0.9))]
+        usage = _Usage(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4)
+        return text, usage, delay
+
+    @staticmethod
+    def _chunks(text, count=8):
+        size = max(len(text) // count, 1)
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def generate_content(self, prompt, stream=False):
+        text, usage, delay = self._plan(prompt)
+        if text is None:
+            time.sleep(delay)
+            raise BackendError("Injected local backend failure")
+        if stream:
+            chunks = self._chunks(text)
+            return _StreamedResponse(chunks, usage, delay / len(chunks))
+        time.sleep(delay)
+        return _Response(text, usage)
+
@@ -0,0 +1,133 @@
+# trips/utils/itinerary_cache.py
+import copy
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+from django.core.cache import caches
+
+from .cache_utils import make_cache_key, normalize_key
+
+ITINERARY_CACHE_TTL = int(os.getenv("ITINERARY_CACHE_TTL", str(60 * 60 * 24 * 7)))
+# Prompts whose word sets overlap at least this much (Jaccard) reuse each
+# other's itinerary.
+ITINERARY_SIMILARITY_THRESHOLD = float(os.getenv("ITINERARY_SIMILARITY_THRESHOLD", "0.85"))
+# Number of distinct prompts remembered per (city, days, style, budget).
+ITINERARY_BUCKET_SIZE = 20
+
+_STOPWORDS = {
+    'a', 'an', 'and', 'the', 'of', 'in', 'to', 'for', 'with', 'on', 'at',
+    'i', 'we', 'my', 'our', 'me', 'us', 'want', 'would', 'like', 'please',
+    'some', 'is', 'are', 'be', 'it', 'that', 'this',
+}
+
+
+def _num_days(start_date, end_date):
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+    return (end - start).days + 1
+
+
+def _prompt_words(prompt):
+    words = re.findall(r'\w+', normalize_key(prompt))
+    return frozenset(word for word in words if word not in _STOPWORDS)
+
+
+def _similarity(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def normalize_inputs(city_name, start_date, end_date, preferences=None):
+    """
+    Reduce generation inputs to what determines the plan: the city, the trip
+    length (not the dates), travel style, budget and the prompt's words.
+    """
+    preferences = preferences or {}
+    words = _prompt_words(preferences.get('prompt', ''))
+    return {
+        'city': normalize_key(city_name),
+        'days': _num_days(start_date, end_date),
+        'travel_style': normalize_key(preferences.get('travel_style', '')),
+        'budget': normalize_key(preferences.get('budget', '')),
+        'prompt': ' '.join(sorted(words)),
+    }
+
+
+def generation_key(city_name, start_date, end_date, preferences=None):
+    """Key shared by all requests that would generate the same itinerary."""
+    inputs = normalize_inputs(city_name, start_date, end_date, preferences)
+    return make_cache_key(
+        'itinerary_generation', inputs['city'], inputs['days'], inputs['travel_style'], inputs['budget'], inputs['prompt']
+    )
+
+
+def _bucket_key(inputs):
+    return make_cache_key('itinerary_bucket', inputs['city'], inputs['days'], inputs['travel_style'], inputs['budget'])
+
+
+def _entry_key(inputs):
+    return make_cache_key(
+        'itinerary', inputs['city'], inputs['days'], inputs['travel_style'], inputs['budget'], inputs['prompt']
+    )
+
+
+def redate_itinerary(itinerary, start_date):
+    """Return a copy of ``itinerary`` with each day's date counted from ``start_date``."""
+    itinerary = copy.deepcopy(itinerary)
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    for index, day in enumerate(itinerary.get('itinerary', [])):
+        try:
+            offset = int(day.get('day', index + 1)) - 1
+        except (TypeError, ValueError):
+            offset = index
+        day['date'] = (start + timedelta(days=offset)).strftime('%Y-%m-%d')
+    return itinerary
+
+
+def get_cached_itinerary(city_name, start_date, end_date, preferences=None):
+    """
+    Return a cached itinerary for equivalent inputs, re-dated to
+    ``start_date``, or None.
+
+    An exact match on the normalized inputs is tried first, then the most
+    similar remembered prompt for the same city, length, style and budget.
+    """
+    cache = caches['shared']
+    inputs = normalize_inputs(city_name, start_date, end_date, preferences)
+
+    itinerary = cache.get(_entry_key(inputs))
+    if itinerary is None:
+        words = frozenset(inputs['prompt'].split())
+        best_key, best_score = None, ITINERARY_SIMILARITY_THRESHOLD
+        for entry in cache.get(_bucket_key(inputs), []):
+            score = _similarity(words, frozenset(entry['prompt'].split()))
+            if score >= best_score:
+                best_key, best_score = entry['key'], score
+        if best_key:
+            itinerary = cache.get(best_key)
+
+    if itinerary is None:
+        return None
+    return redate_itinerary(itinerary, start_date)
+
+
+def store_itinerary(city_name, start_date, end_date, preferences, itinerary):
+    """Remember a successfully generated itinerary for equivalent requests."""
+    if not itinerary or 'error' in itinerary:
+        return
+    cache = caches['shared']
+    inputs = normalize_inputs(city_name, start_date, end_date, preferences)
+    entry_key = _entry_key(inputs)
+    cache.set(entry_key, itinerary, timeout=ITINERARY_CACHE_TTL)
+
+    bucket_key = _bucket_key(inputs)
+    now = time.time()
+    bucket = [
+        entry for entry in cache.get(bucket_key, [])
+        if entry['key'] != entry_key and entry['stored_at'] > now - ITINERARY_CACHE_TTL
+    ]
+    bucket.append({'key': entry_key, 'prompt': inputs['prompt'], 'stored_at': now})
+    cache.set(bucket_key, bucket[-ITINERARY_BUCKET_SIZE:], timeout=ITINERARY_CACHE_TTL)
@@ -0,0 +1,123 @@
+# trips/utils/itinerary_chunks.py
+import os
+from datetime import datetime, timedelta
+
+from .cache_utils import normalize_key
+
+# Trips longer than this many days are generated as several concurrent
+# requests of at most ITINERARY_CHUNK_DAYS days each.
+ITINERARY_CHUNK_THRESHOLD = int(os.getenv("ITINERARY_CHUNK_THRESHOLD", "7"))
+ITINERARY_CHUNK_DAYS = int(os.getenv("ITINERARY_CHUNK_DAYS", "4"))
+# A chunk that comes back with fewer days than asked for is regenerated up
+# to this many times before the merged itinerary is marked partial.
+ITINERARY_CHUNK_RETRIES = int(os.getenv("ITINERARY_CHUNK_RETRIES", "1"))
+
+
+def trip_days(start_date, end_date):
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+    return (end - start).days + 1
+
+
+def day_ranges(start_date, end_date):
+    """
+    Split a trip into ``(first_day, last_day)`` ranges, or return a single
+    range if the trip is short enough to generate in one request.
+    """
+    num_days = trip_days(start_date, end_date)
+    if num_days <= ITINERARY_CHUNK_THRESHOLD:
+        return [(1, num_days)]
+    return [
+        (first, min(first + ITINERARY_CHUNK_DAYS - 1, num_days))
+        for first in range(1, num_days + 1, ITINERARY_CHUNK_DAYS)
+    ]
+
+
+def chunk_dates(start_date, first_day, last_day):
+    """Return the start and end dates of days ``first_day``..``last_day``."""
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    return (
+        (start + timedelta(days=first_day - 1)).strftime('%Y-%m-%d'),
+        (start + timedelta(days=last_day - 1)).strftime('%Y-%m-%d'),
+    )
+
+
+def chunk_context(start_date, end_date, first_day, last_day, ranges):
+    """Prompt text telling one chunk where it sits in the whole trip."""
+    num_days = trip_days(start_date, end_date)
+    others = ', '.join(f"{first}-{last}" for first, last in ranges if first != first_day)
+    return (
+        f"\n\nThis is part of a {num_days}-day trip from {start_date} to {end_date}. "
+        f"Plan only days {first_day} to {last_day}. Days {others} are planned separately, "
+        f"so spread the city's highlights across the trip rather than packing them all "
+        f"into these days, and use specific activity titles."
+    )
+
+
+def renumber_days(itinerary, start_date, first_day, last_day):
+    """
+    Keep at most the days ``first_day``..``last_day`` of a chunk, numbered
+    and dated within the whole trip. Extra days would overlap the next chunk.
+    """
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    days = itinerary.get('itinerary', [])[:last_day - first_day + 1]
+    for offset, day in enumerate(days):
+        day['day'] = first_day + offset
+        day['date'] = (start + timedelta(days=first_day + offset - 1)).strftime('%Y-%m-%d')
+    itinerary['itinerary'] = days
+    return itinerary
+
+
+def missing_days(itinerary, first_day, last_day):
+    """Day numbers of ``first_day``..``last_day`` that a renumbered chunk does not cover."""
+    return list(range(first_day + len(itinerary.get('itinerary', [])), last_day + 1))
+
+
+def merge_chunks(chunks):
+    """
+    Merge ``[((first_day, last_day), itinerary), ...]`` into one itinerary.
+
+    Chunks are generated concurrently and cannot see each other's picks, so
+    an activity whose title already appears in an earlier chunk is dropped
+    (unless that would leave its day empty). Tips are de-duplicated and the
+    per-chunk cost estimates are listed by day range.
+
+    Each chunk contributes at most its own range's days. If any chunk came
+    back short, the result has ``partial: True`` and the ``missing_days``.
+    """
+    seen = set()
+    days, tips, costs, missing = [], [], [], []
+    seen_tips = set()
+    for (first_day, last_day), itinerary in sorted(chunks, key=lambda chunk: chunk[0]):
+        chunk_days = itinerary.get('itinerary', [])[:last_day - first_day + 1]
+        missing += list(range(first_day + len(chunk_days), last_day + 1))
+        chunk_titles = set()
+        for day in chunk_days:
+            activities = []
+            for activity in day.get('activities', []):
+                title = normalize_key(activity.get('title'))
+                if title in seen:
+                    continue
+                chunk_titles.add(title)
+                activities.append(activity)
+            if activities:
+                day['activities'] = activities
+            days.append(day)
+        seen |= chunk_titles
+
+        for tip in itinerary.get('additional_tips', []):
+            if normalize_key(tip) not in seen_tips:
+                seen_tips.add(normalize_key(tip))
+                tips.append(tip)
+        if itinerary.get('total_estimated_cost'):
+            costs.append(f"Days {first_day}-{last_day}: {itinerary['total_estimated_cost']}")
+
+    merged = {
+        'itinerary': days,
+        'total_estimated_cost': '; '.join(costs),
+        'additional_tips': tips,
+    }
+    if missing:
+        merged['partial'] = True
+        merged['missing_days'] = missing
+    return merged
@@ -0,0 +1,262 @@
+# trips/utils/itinerary_jobs.py
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+
+from .cache_utils import make_cache_key
+from .gemini_api import stream_itinerary
+from .itinerary_cache import generation_key, normalize_inputs
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of itinerary generations running at once in this process;
+# further jobs wait in the queue.
+ITINERARY_JOB_WORKERS = int(os.getenv("ITINERARY_JOB_WORKERS", "2"))
+# Jobs waiting or running beyond this are refused instead of queued.
+ITINERARY_JOB_QUEUE_LIMIT = int(os.getenv("ITINERARY_JOB_QUEUE_LIMIT", "50"))
+# How long job status and results stay available for polling.
+ITINERARY_JOB_TTL = 60 * 60 * 24
+# How long identical requests can attach to a queued or running job.
+ITINERARY_JOB_INFLIGHT_TTL = 60 * 10
+# How often a streaming request checks its job for new days, in seconds.
+ITINERARY_JOB_POLL_INTERVAL = float(os.getenv("ITINERARY_JOB_POLL_INTERVAL", "0.5"))
+# How often the owning process re-saves its queued and running jobs, in
+# seconds, so other processes can tell they are still alive.
+ITINERARY_JOB_HEARTBEAT = float(os.getenv("ITINERARY_JOB_HEARTBEAT", "10"))
+# A queued or running job not updated for this many seconds is treated as
+# failed (its process probably died).
+ITINERARY_JOB_STALE_AFTER = float(os.getenv("ITINERARY_JOB_STALE_AFTER", "60"))
+# Longest a streaming request follows a job before giving up with an error.
+ITINERARY_JOB_MAX_WAIT = float(os.getenv("ITINERARY_JOB_MAX_WAIT", "300"))
+
+# Values for a job's "status"
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+_executor = ThreadPoolExecutor(max_workers=ITINERARY_JOB_WORKERS, thread_name_prefix='itinerary-job')
+_pending = 0
+_pending_lock = threading.Lock()
+_enqueue_lock = threading.Lock()
+# Jobs this process has queued and not yet finished, kept alive by the
+# heartbeat thread. Changes to these dicts are saved under _jobs_lock.
+_owned_jobs = {}
+_jobs_lock = threading.Lock()
+_heartbeat_thread = None
+
+
+class QueueFull(Exception):
+    """Raised when too many itinerary jobs are already waiting."""
+
+
+def _job_key(job_id):
+    return make_cache_key('itinerary_job', job_id)
+
+
+def _is_stale(job):
+    return (job['status'] in (JOB_QUEUED, JOB_RUNNING)
+            and time.time() - job.get('updated_at', 0) > ITINERARY_JOB_STALE_AFTER)
+
+
+def get_job(job_id):
+    """
+    Return the state dict of a job, or None if it is unknown or expired.
+    A queued or running job whose heartbeat stopped is returned as failed.
+    """
+    job = caches['state'].get(_job_key(job_id))
+    if job and _is_stale(job):
+        job['status'] = JOB_FAILED
+        job['error'] = {"error": "Failed to generate itinerary", "details": "The itinerary job stopped responding"}
+    return job
+
+
+def _inflight_key(flight_key):
+    return make_cache_key('itinerary_job_inflight', flight_key)
+
+
+def _active_job(flight_key):
+    """Return the id of a queued or running job for these inputs, if any."""
+    job_id = caches['state'].get(_inflight_key(flight_key))
+    if job_id:
+        job = get_job(job_id)
+        if job and job['status'] in (JOB_QUEUED, JOB_RUNNING):
+            return job_id
+    return None
+
+
+def _claim_inflight(flight_key, job_id):
+    """
+    Register ``job_id`` as the job for ``flight_key``, relying on the atomic
+    ``add`` of the 'state' cache so only one process can win. Returns the id
+    of another process's queued or running job to attach to instead, or None.
+    """
+    cache = caches['state']
+    key = _inflight_key(flight_key)
+    for _ in range(2):
+        if cache.add(key, job_id, timeout=ITINERARY_JOB_INFLIGHT_TTL):
+            return None
+        other_job_id = _active_job(flight_key)
+        if other_job_id:
+            return other_job_id
+        # The registered job already finished; clear it and race again.
+        cache.delete(key)
+    logger.warning(f"Could not register itinerary job {job_id}; running it unshared")
+    return None
+
+
+def _save_job(job_id, job):
+    job['updated_at'] = time.time()
+    caches['state'].set(_job_key(job_id), job, timeout=ITINERARY_JOB_TTL)
+
+
+def _touch_owned_jobs():
+    """Re-save every job this process owns so its ``updated_at`` stays fresh."""
+    with _jobs_lock:
+        for job_id, job in list(_owned_jobs.items()):
+            try:
+                _save_job(job_id, job)
+            except Exception as e:
+                logger.error(f"Itinerary job {job_id} heartbeat failed: {str(e)}")
+
+
+def _heartbeat():
+    while True:
+        time.sleep(ITINERARY_JOB_HEARTBEAT)
+        _touch_owned_jobs()
+
+
+def _start_heartbeat():
+    global _heartbeat_thread
+    if _heartbeat_thread is None:
+        _heartbeat_thread = threading.Thread(target=_heartbeat, name='itinerary-job-heartbeat', daemon=True)
+        _heartbeat_thread.start()
+
+
+def _run_job(job_id, job, flight_key, city_name, start_date, end_date, preferences, user_id):
+    global _pending
+    try:
+        with _jobs_lock:
+            job['status'] = JOB_RUNNING
+            _save_job(job_id, job)
+        for event, data in stream_itinerary(city_name, start_date, end_date, preferences, user_id):
+            with _jobs_lock:
+                if event == 'day':
+                    job['days_done'] += 1
+                    job['days'].append(data)
+                elif event == 'done':
+                    job['status'] = JOB_DONE
+                    job['result'] = data
+                elif event == 'error':
+                    job['status'] = JOB_FAILED
+                    job['error'] = data
+                _save_job(job_id, job)
+    except Exception as e:
+        logger.error(f"Itinerary job {job_id} failed: {str(e)}")
+        with _jobs_lock:
+            job['status'] = JOB_FAILED
+            job['error'] = {"error": "Failed to generate itinerary", "details": str(e)}
+            _save_job(job_id, job)
+    finally:
+        with _jobs_lock:
+            _owned_jobs.pop(job_id, None)
+        cache = caches['state']
+        if cache.get(_inflight_key(flight_key)) == job_id:
+            cache.delete(_inflight_key(flight_key))
+        with _pending_lock:
+            _pending -= 1
+
+
+def enqueue_itinerary_job(city_name, start_date, end_date, preferences=None, user_id=None):
+    """
+    Queue an itinerary generation and return its job id immediately.
+
+    The job runs on a bounded worker pool, so at most ``ITINERARY_JOB_WORKERS``
+    LLM calls are in flight per process. Its progress (days generated so far)
+    and result are kept in the 'state' cache, where any process can answer
+    ``get_job`` for it. A request whose normalized inputs match a queued or
+    running job, from any process, gets that job's id instead of a new job.
+    Until it finishes the job is re-saved every ``ITINERARY_JOB_HEARTBEAT``
+    seconds; one that goes quiet for ``ITINERARY_JOB_STALE_AFTER`` seconds is
+    reported as failed. Raises ``QueueFull`` when the backlog is too long.
+    """
+    global _pending
+    flight_key = generation_key(city_name, start_date, end_date, preferences)
+    with _enqueue_lock:
+        job_id = _active_job(flight_key)
+        if job_id:
+            return job_id
+
+        with _pending_lock:
+            if _pending >= ITINERARY_JOB_QUEUE_LIMIT:
+                raise QueueFull()
+            _pending += 1
+
+        job_id = uuid.uuid4().hex
+        job = {
+            'status': JOB_QUEUED,
+            'city_name': city_name,
+            'days_total': normalize_inputs(city_name, start_date, end_date, preferences)['days'],
+            'days_done': 0,
+            'days': [],
+            'result': None,
+            'error': None,
+            'created_at': time.time(),
+        }
+        try:
+            _save_job(job_id, job)
+            other_job_id = _claim_inflight(flight_key, job_id)
+            if other_job_id:
+                caches['state'].delete(_job_key(job_id))
+                with _pending_lock:
+                    _pending -= 1
+                return other_job_id
+            with _jobs_lock:
+                _owned_jobs[job_id] = job
+                _start_heartbeat()
+            _executor.submit(_run_job, job_id, job, flight_key, city_name, start_date, end_date, preferences, user_id)
+        except Exception:
+            with _jobs_lock:
+                _owned_jobs.pop(job_id, None)
+            with _pending_lock:
+                _pending -= 1
+            raise
+    return job_id
+
+
+async def afollow_job(job_id):
+    """
+    Follow a job from an async view, yielding ``("day", day)`` for each day
+    as the job generates it, then ``("done", itinerary)`` or
+    ``("error", details)``. Every request attached to the same job sees the
+    same days, from whichever process runs it. Gives up with an error after
+    ``ITINERARY_JOB_MAX_WAIT`` seconds.
+    """
+    sent = 0
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + ITINERARY_JOB_MAX_WAIT
+    while True:
+        job = await sync_to_async(get_job, thread_sensitive=False)(job_id)
+        if job is None:
+            yield "error", {"error": "Failed to generate itinerary", "details": "The itinerary job expired"}
+            return
+        for day in job['days'][sent:]:
+            yield "day", day
+        sent = len(job['days'])
+        if job['status'] == JOB_DONE:
+            yield "done", job['result']
+            return
+        if job['status'] == JOB_FAILED:
+            yield "error", job['error']
+            return
+        if loop.time() >= give_up_at:
+            yield "error", {"error": "Failed to generate itinerary", "details": "Timed out waiting for the itinerary"}
+            return
+        await asyncio.sleep(ITINERARY_JOB_POLL_INTERVAL)
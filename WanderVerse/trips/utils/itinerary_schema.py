@@ -0,0 +1,147 @@
+# trips/utils/itinerary_schema.py
+from dataclasses import asdict, dataclass, field
+
+from .json_stream import repair_json
+
+# JSON schema Gemini's JSON mode constrains its output to. Mirrors the
+# dataclasses below.
+_ACTIVITY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "time": {"type": "string"},
+        "title": {"type": "string"},
+        "description": {"type": "string"},
+        "location": {"type": "string"},
+        "estimated_cost": {"type": "string"},
+        "duration": {"type": "string"},
+    },
+    "required": ["time", "title", "description", "location"],
+}
+
+DAY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "day": {"type": "integer"},
+        "date": {"type": "string"},
+        "activities": {"type": "array", "items": _ACTIVITY_SCHEMA},
+    },
+    "required": ["day", "activities"],
+}
+
+ITINERARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "itinerary": {"type": "array", "items": DAY_SCHEMA},
+        "total_estimated_cost": {"type": "string"},
+        "additional_tips": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["itinerary"],
+}
+
+
+class ItineraryValidationError(ValueError):
+    """Raised when generated output does not contain a usable itinerary."""
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return ''
+    return str(value).strip()
+
+
+@dataclass
+class Activity:
+    title: str
+    time: str = ''
+    description: str = ''
+    location: str = ''
+    estimated_cost: str = ''
+    duration: str = ''
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build an Activity, or return None if ``data`` has no title."""
+        if not isinstance(data, dict):
+            return None
+        title = _text(data.get('title') or data.get('name') or data.get('activity'))
+        if not title:
+            return None
+        return cls(
+            title=title,
+            time=_text(data.get('time')),
+            description=_text(data.get('description')),
+            location=_text(data.get('location')),
+            estimated_cost=_text(data.get('estimated_cost')),
+            duration=_text(data.get('duration')),
+        )
+
+
+@dataclass
+class DayPlan:
+    day: int
+    date: str = ''
+    activities: list = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data, position=1):
+        """
+        Build a DayPlan, or return None if ``data`` has no usable activities.
+        ``position`` is used when the day number is missing or invalid.
+        """
+        if not isinstance(data, dict):
+            return None
+        try:
+            day = int(data.get('day'))
+        except (TypeError, ValueError):
+            day = position
+        activities = [
+            activity for activity in map(Activity.from_dict, data.get('activities') or [])
+            if activity is not None
+        ]
+        if not activities:
+            return None
+        return cls(day=day, date=_text(data.get('date')), activities=activities)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass
+class Itinerary:
+    itinerary: list
+    total_estimated_cost: str = ''
+    additional_tips: list = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Validate parsed output, dropping malformed parts. Raises ItineraryValidationError."""
+        if not isinstance(data, dict):
+            raise ItineraryValidationError("Itinerary is not an object")
+        days = []
+        for position, day in enumerate(data.get('itinerary') or [], start=1):
+            plan = DayPlan.from_dict(day, position)
+            if plan is not None:
+                days.append(plan)
+        if not days:
+            raise ItineraryValidationError("Itinerary has no valid days")
+        tips = data.get('additional_tips') or []
+        if not isinstance(tips, list):
+            tips = [tips]
+        return cls(
+            itinerary=days,
+            total_estimated_cost=_text(data.get('total_estimated_cost')),
+            additional_tips=[tip for tip in map(_text, tips) if tip],
+        )
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def parse_itinerary(text):
+    """
+    Parse model output into a validated ``Itinerary``, repairing stray text,
+    trailing commas and truncation. Raises ValueError if nothing usable is left.
+    """
+    return Itinerary.from_dict(repair_json(text))
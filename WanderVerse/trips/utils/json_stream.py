@@ -0,0 +1,151 @@
+# trips/utils/json_stream.py
+import json
+import re
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+class ArrayItemParser:
+    """
+    Incrementally yields the items of a JSON array found under ``key``.
+
+    Text is fed in arbitrary chunks (network reads, streamed LLM output) and
+    every item is returned as soon as it is complete, so callers never need
+    the whole document in memory. Text before the array (code fences, other
+    keys) is skipped; anything after it is ignored.
+    """
+
+    def __init__(self, key):
+        self._start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self._buffer = ''
+        self._in_array = False
+        self.done = False
+
+    def feed(self, text):
+        """Add ``text`` and return the list of items completed by it."""
+        if self.done:
+            return []
+        self._buffer += text
+        items = []
+        if not self._in_array:
+            match = self._start.search(self._buffer)
+            if not match:
+                # Keep just enough of the tail to match a key split across chunks.
+                self._buffer = self._buffer[-(len(self._start.pattern) + 16):]
+                return items
+            self._buffer = self._buffer[match.end():]
+            self._in_array = True
+
+        pos = 0
+        while True:
+            while pos < len(self._buffer) and self._buffer[pos] in _WHITESPACE + ',':
+                pos += 1
+            if pos >= len(self._buffer):
+                break
+            if self._buffer[pos] == ']':
+                self.done = True
+                pos += 1
+                break
+            try:
+                item, end = _decoder.raw_decode(self._buffer, pos)
+            except json.JSONDecodeError:
+                # Item not complete yet; wait for more text.
+                break
+            items.append(item)
+            pos = end
+        self._buffer = self._buffer[pos:]
+        return items
+
+
+def iter_array_items(chunks, key):
+    """Yield items of the array under ``key`` from an iterable of text chunks."""
+    parser = ArrayItemParser(key)
+    for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+        if parser.done:
+            return
+
+
+def _close_json(text):
+    """
+    Drop trailing commas and dangling keys from ``text`` and close any open
+    object or array, so a truncated document becomes parseable. Returns None
+    if ``text`` ends inside a string.
+    """
+    out = []
+    stack = []
+    in_string = escaped = False
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+        elif ch in '}]':
+            while out and out[-1] in _WHITESPACE + ',':
+                out.pop()
+            if stack:
+                stack.pop()
+        out.append(ch)
+
+    if in_string:
+        # A cut-off string value is unreliable; let the caller cut earlier.
+        return None
+    closed = ''.join(out).rstrip(_WHITESPACE + ',')
+    # A key without a value ("key" or "key":) cannot be completed; drop it.
+    if stack and stack[-1] == '}':
+        closed = re.sub(r'(?:^|(?<=[{,]))\s*"(?:[^"\\]|\\.)*"\s*:?\s*$', '', closed).rstrip(_WHITESPACE + ',')
+    return closed + ''.join(reversed(stack))
+
+
+def repair_json(text):
+    """
+    Parse the first JSON object in ``text``, tolerating what LLMs commonly
+    get wrong: code fences or prose around the object, trailing commas, and
+    output cut off part-way. Truncated documents are closed at the last
+    complete element. Raises ``ValueError`` if nothing usable is found.
+    """
+    start = text.find('{')
+    if start == -1:
+        raise ValueError("No JSON object found")
+    text = text[start:]
+    try:
+        return _decoder.raw_decode(text)[0]
+    except json.JSONDecodeError:
+        pass
+
+    # Retry at each comma outside a string, newest first, so that a
+    # half-written final element is discarded rather than failing the lot.
+    cut_points = [len(text)]
+    in_string = escaped = False
+    for pos, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == ',':
+            cut_points.append(pos)
+    for end in sorted(cut_points, reverse=True)[:64]:
+        closed = _close_json(text[:end])
+        if closed is None:
+            continue
+        try:
+            return _decoder.raw_decode(closed)[0]
+        except json.JSONDecodeError:
+            continue
+    raise ValueError("Could not repair JSON")
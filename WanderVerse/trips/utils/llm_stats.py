@@ -0,0 +1,101 @@
+# trips/utils/llm_stats.py
+import logging
+
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from ..models import LLMUsage
+from .cache_utils import normalize_key
+
+logger = logging.getLogger(__name__)
+
+# At most this many cities and users (the busiest) are listed in the report.
+LLM_STATS_MAX_KEYS = 500
+
+_COUNTERS = (
+    'calls', 'llm_calls', 'cache_hits', 'parse_failures', 'errors',
+    'prompt_tokens', 'output_tokens', 'latency_total', 'latency_max',
+)
+
+
+def usage_tokens(response):
+    """Return ``(prompt_tokens, output_tokens)`` from a Gemini response, or zeros."""
+    usage = getattr(response, 'usage_metadata', None)
+    if not usage:
+        return 0, 0
+    return (
+        getattr(usage, 'prompt_token_count', 0) or 0,
+        getattr(usage, 'candidates_token_count', 0) or 0,
+    )
+
+
+def _add(dimension, name, call):
+    # Counters are incremented in SQL, so updates from concurrent workers
+    # and processes are never lost.
+    LLMUsage.objects.get_or_create(dimension=dimension, name=name)
+    LLMUsage.objects.filter(dimension=dimension, name=name).update(
+        calls=F('calls') + 1,
+        llm_calls=F('llm_calls') + (0 if call['cache_hit'] else 1),
+        cache_hits=F('cache_hits') + (1 if call['cache_hit'] else 0),
+        parse_failures=F('parse_failures') + (0 if call['parsed'] else 1),
+        errors=F('errors') + (1 if call['failed'] else 0),
+        prompt_tokens=F('prompt_tokens') + call['prompt_tokens'],
+        output_tokens=F('output_tokens') + call['output_tokens'],
+        latency_total=F('latency_total') + call['latency'],
+        latency_max=Greatest('latency_max', Value(float(call['latency']))),
+    )
+
+
+def record_call(city_name, user_id=None, prompt_mode='', prompt_tokens=0, output_tokens=0,
+                latency=0.0, parsed=True, cache_hit=False, failed=False):
+    """
+    Record one itinerary generation (LLM calls or a cache hit) in the
+    totals and in the per-city, per-user and per-prompt-mode aggregates.
+    A long trip generated in chunks is one generation, with the tokens of
+    all its chunks. ``failed`` marks a generation that raised before it
+    produced a result. Never raises: accounting must not break generation.
+    """
+    call = {
+        'prompt_tokens': prompt_tokens,
+        'output_tokens': output_tokens,
+        'latency': latency,
+        'parsed': parsed,
+        'cache_hit': cache_hit,
+        'failed': failed,
+    }
+    try:
+        with transaction.atomic():
+            _add('total', '', call)
+            _add('city', normalize_key(city_name), call)
+            _add('user', user_id or 'anonymous', call)
+            if not cache_hit:
+                _add('prompt_mode', prompt_mode, call)
+    except Exception as e:
+        logger.error(f"Error recording LLM stats: {str(e)}")
+
+
+def _summary(bucket):
+    llm_calls = bucket['llm_calls']
+    summary = dict(bucket)
+    summary['latency_avg'] = bucket['latency_total'] / bucket['calls'] if bucket['calls'] else 0
+    summary['prompt_tokens_avg'] = bucket['prompt_tokens'] / llm_calls if llm_calls else 0
+    summary['output_tokens_avg'] = bucket['output_tokens'] / llm_calls if llm_calls else 0
+    summary['cache_hit_rate'] = bucket['cache_hits'] / bucket['calls'] if bucket['calls'] else 0
+    return summary
+
+
+def get_stats():
+    """Return the totals and the per-city, per-user and per-prompt-mode aggregates."""
+    total = LLMUsage.objects.filter(dimension='total').values(*_COUNTERS).first()
+    stats = {'total': _summary(total) if total else None}
+    for dimension in ('prompt_mode', 'city', 'user'):
+        rows = (LLMUsage.objects.filter(dimension=dimension).values('name', *_COUNTERS)
+                .order_by('-calls', 'name')[:LLM_STATS_MAX_KEYS])
+        stats[dimension] = {row.pop('name'): _summary(row) for row in rows}
+    return stats
+
+
+def reset_stats():
+    """Forget all recorded statistics."""
+    LLMUsage.objects.all().delete()
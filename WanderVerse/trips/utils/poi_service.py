@@ -0,0 +1,67 @@
+# trips/utils/poi_service.py
+import logging
+
+from .geoapify_api import aget_pois, distance_m
+
+logger = logging.getLogger(__name__)
+
+TOURISM_CATEGORIES = [
+    'tourism.sights',
+    'tourism.museum',
+    'tourism.attraction',
+    'tourism.historic',
+    'tourism.art',
+    'tourism.park',
+    'tourism.viewpoint',
+    'tourism.architecture',
+    'tourism.monument',
+    'tourism.cultural',
+]
+
+MAX_POIS = 20
+
+
+def _poi_name(poi):
+    return poi.get('properties', {}).get('name')
+
+
+def _poi_distance(lat, lon, poi):
+    properties = poi.get('properties', {})
+    return distance_m(lat, lon, properties['lat'], properties['lon'])
+
+
+async def acollect_city_pois(lat, lon, categories=None, limit=MAX_POIS, timeout=None):
+    """
+    Fetch up to ``limit`` unique (by name) POIs around a point.
+
+    All categories are looked up together, one request per grid cell, and
+    every cell that answers within ``timeout`` seconds is used. POIs are
+    ranked by distance, then by the order of ``categories``, so the same
+    inputs always give the same list.
+
+    Returns ``(pois, complete)``; ``complete`` is False when a cell failed
+    or was still loading at the timeout.
+    """
+    categories = categories or TOURISM_CATEGORIES
+    lat, lon = float(lat), float(lon)
+    try:
+        by_category, complete = await aget_pois(lat, lon, categories, limit=limit, timeout=timeout)
+    except Exception as e:
+        logger.error(f"Error fetching POIs: {str(e)}")
+        return [], False
+    if not complete:
+        logger.warning("POI lookup is incomplete; some areas failed or timed out")
+
+    ranked = sorted((
+        (_poi_distance(lat, lon, poi), rank, poi)
+        for rank, category in enumerate(categories)
+        for poi in by_category.get(category, [])
+    ), key=lambda item: item[:2])
+    seen_names = set()
+    unique_pois = []
+    for _, _, poi in ranked:
+        name = _poi_name(poi)
+        if name and name not in seen_names:
+            seen_names.add(name)
+            unique_pois.append(poi)
+    return unique_pois[:limit], complete
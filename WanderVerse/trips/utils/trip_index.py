@@ -0,0 +1,141 @@
+# trips/utils/trip_index.py
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+# Every user has one trip_index/{uid} document summarizing all their saved
+# and AI generated trips, so listing and counting read one small document
+# instead of every itinerary. It is written in the same batch as the trip
+# itself (see FirestoreTripRepository).
+TRIP_INDEX_COLLECTION = 'trip_index'
+TRIP_COLLECTIONS = {
+    'trip': 'trips',
+    'ai': 'ai_generated_trips',
+}
+
+
+def entry_key(kind, trip_id):
+    return f"{kind}_{trip_id}"
+
+
+def _index_ref(db, user_id):
+    return db.collection(TRIP_INDEX_COLLECTION).document(user_id)
+
+
+def _date(value):
+    """Return a trip date as 'YYYY-MM-DD', whether stored as a string or a timestamp."""
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, str) and value:
+        return value[:10]
+    return None
+
+
+def _day_activities(itinerary):
+    """Activity lists per day, for ``{date: [...]}`` and ``[{'activities': [...]}]`` itineraries."""
+    if isinstance(itinerary, dict):
+        days = itinerary.values()
+    elif isinstance(itinerary, list):
+        days = [day.get('activities') for day in itinerary if isinstance(day, dict)]
+    else:
+        days = []
+    return [activities for activities in days if isinstance(activities, list)]
+
+
+def trip_summary(kind, trip_data):
+    """
+    Build the index entry for a trip document: city, dates, number of days
+    and activities, and when it was created and last modified.
+    """
+    start_date = _date(trip_data.get('startDate'))
+    end_date = _date(trip_data.get('endDate'))
+    days = _day_activities(trip_data.get('itinerary'))
+    try:
+        num_days = (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(start_date, '%Y-%m-%d')).days + 1
+    except (TypeError, ValueError):
+        num_days = len(days)
+
+    summary = {
+        'type': kind,
+        'city': trip_data.get('city'),
+        'startDate': start_date,
+        'endDate': end_date,
+        'days': num_days,
+        'activities': sum(len(activities) for activities in days),
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }
+    # Left out on modification so the entry keeps its original value.
+    if trip_data.get('createdAt') is not None:
+        summary['createdAt'] = trip_data['createdAt']
+    return summary
+
+
+def stage_put(batch, db, user_id, kind, trip_id, summary):
+    """Add or update a trip's entry in the user's index as part of ``batch``."""
+    batch.set(_index_ref(db, user_id), {
+        'trips': {entry_key(kind, trip_id): summary},
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+
+
+def stage_remove(batch, db, user_id, kind, trip_id):
+    """Remove a trip's entry from the user's index as part of ``batch``."""
+    batch.set(_index_ref(db, user_id), {
+        'trips': {entry_key(kind, trip_id): firestore.DELETE_FIELD},
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+
+
+def rebuild_trip_index(user_id, db=None):
+    """
+    Recompute a user's index from their trip documents and return its
+    entries. This reads every trip in full, so it is only needed once per
+    user, for trips saved before the index existed.
+
+    The scan and the write run in one transaction that also reads the index
+    document. Trip saves and deletes write that document in their batch, so
+    one landing mid-rebuild makes the transaction retry instead of being
+    overwritten by the stale scan.
+    """
+    db = db or firestore.client()
+    index_ref = _index_ref(db, user_id)
+
+    @firestore.transactional
+    def rebuild(transaction):
+        index_ref.get(transaction=transaction)
+        entries = {}
+        for kind, collection in TRIP_COLLECTIONS.items():
+            query = db.collection(collection).where(filter=firestore.FieldFilter('userId', '==', user_id))
+            for doc in query.stream(transaction=transaction):
+                summary = trip_summary(kind, doc.to_dict())
+                summary['updatedAt'] = summary.get('createdAt')
+                entries[entry_key(kind, doc.id)] = summary
+        transaction.set(index_ref, {
+            'trips': entries,
+            'complete': True,
+            'updatedAt': firestore.SERVER_TIMESTAMP,
+        })
+        return entries
+
+    return rebuild(db.transaction())
+
+
+def get_trip_index(user_id, db=None):
+    """
+    Return ``{entry_key: summary}`` for all of a user's trips with one
+    document read. The index is built on first use for users whose trips
+    predate it.
+    """
+    db = db or firestore.client()
+    doc = _index_ref(db, user_id).get()
+    data = doc.to_dict() if doc.exists else None
+    if not data or not data.get('complete'):
+        return rebuild_trip_index(user_id, db)
+    return data.get('trips') or {}
+
+
+def sort_time(value):
+    """A timestamp as a fixed-width UTC string, so entries sort and page by text."""
+    if not hasattr(value, 'astimezone'):
+        return ''
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
@@ -0,0 +1,75 @@
+# trips/utils/trip_listing.py
+import base64
+import binascii
+import json
+import os
+
+from .trip_index import sort_time
+from .trip_repository import get_repository
+
+TRIP_PAGE_SIZE = int(os.getenv("TRIP_PAGE_SIZE", "20"))
+TRIP_PAGE_SIZE_MAX = 50
+
+
+class InvalidCursor(ValueError):
+    """Raised for a page cursor that was not produced by ``list_trips``."""
+
+
+def encode_cursor(position):
+    raw = json.dumps(position, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the ``[created_at, type, trip_id]`` sort position of the last trip listed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeError):
+        raise InvalidCursor(cursor)
+    if not (isinstance(position, list) and len(position) == 3 and all(isinstance(part, str) for part in position)):
+        raise InvalidCursor(cursor)
+    return position
+
+
+def _json_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def list_trips(user_id, cursor=None, limit=TRIP_PAGE_SIZE):
+    """
+    Return one page of a user's saved and AI generated trips, newest first,
+    as ``{'trips': [...], 'next_cursor': str or None}``.
+
+    Trips are read from the repository's summaries (with Firestore, the
+    user's trip index document), so a page never loads an itinerary.
+    Raises ``InvalidCursor`` for a bad cursor.
+    """
+    limit = max(1, min(limit, TRIP_PAGE_SIZE_MAX))
+    after = decode_cursor(cursor) if cursor else None
+
+    trips = []
+    for key, entry in get_repository().list(user_id).items():
+        kind = entry.get('type')
+        trip_id = key[len(kind) + 1:] if kind else key
+        position = [sort_time(entry.get('createdAt')), kind or '', trip_id]
+        if after and position >= after:
+            continue
+        trips.append((position, {
+            'id': trip_id,
+            'type': kind,
+            'city': entry.get('city'),
+            'startDate': entry.get('startDate'),
+            'endDate': entry.get('endDate'),
+            'days': entry.get('days'),
+            'activities': entry.get('activities'),
+            'createdAt': _json_value(entry.get('createdAt')),
+            'updatedAt': _json_value(entry.get('updatedAt')),
+        }))
+
+    trips.sort(key=lambda trip: trip[0], reverse=True)
+    page = trips[:limit]
+    return {
+        'trips': [summary for _, summary in page],
+        'next_cursor': encode_cursor(page[-1][0]) if len(trips) > limit else None,
+    }
@@ -0,0 +1,346 @@
+# trips/utils/trip_repository.py
+import copy
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from django.conf import settings
+from firebase_admin import firestore
+
+from . import trip_index
+from .trip_index import TRIP_COLLECTIONS, entry_key, trip_summary
+
+logger = logging.getLogger(__name__)
+
+# A trip repository stores manual ('trip') and AI generated ('ai') trips:
+#
+#   get(kind, trip_id)                    -> trip dict or None
+#   list(user_id)                         -> {entry_key: summary} for all the user's trips
+#   count(user_id)                        -> number of trips
+#   save(kind, user_id, trip_data)        -> id of the new trip
+#   patch(kind, user_id, trip_id, fields) -> replace those top-level fields
+#   delete(kind, user_id, trip_id)
+#
+# Summaries are the small trip index entries built by trip_index.trip_summary.
+# Every backend sets createdAt on save and updatedAt on patch.
+
+# Fields a summary is computed from; patching any other field leaves it alone.
+_SUMMARY_INPUTS = {'city', 'startDate', 'endDate', 'itinerary'}
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+class TripRepository:
+    """Common behaviour; backends implement get, list, save, patch and delete."""
+
+    def count(self, user_id):
+        return len(self.list(user_id))
+
+    def _check_kind(self, kind):
+        if kind not in TRIP_COLLECTIONS:
+            raise ValueError(f"Unknown trip type: {kind}")
+
+
+class FirestoreTripRepository(TripRepository):
+    """
+    Trips in the trips and ai_generated_trips collections, with the per-user
+    trip index document written in the same batch as each change.
+    """
+
+    def __init__(self, get_db=None):
+        self._get_db = get_db or firestore.client
+
+    def _db(self):
+        db = self._get_db()
+        if not db:
+            raise RuntimeError("Firestore is not available")
+        return db
+
+    def _ref(self, db, kind, trip_id=None):
+        self._check_kind(kind)
+        collection = db.collection(TRIP_COLLECTIONS[kind])
+        return collection.document(trip_id) if trip_id else collection.document()
+
+    def get(self, kind, trip_id):
+        trip_doc = self._ref(self._db(), kind, trip_id).get()
+        return trip_doc.to_dict() if trip_doc.exists else None
+
+    def list(self, user_id):
+        return trip_index.get_trip_index(user_id, self._db())
+
+    def save(self, kind, user_id, trip_data):
+        db = self._db()
+        trip_ref = self._ref(db, kind)
+        trip_data = dict(trip_data, userId=user_id, createdAt=firestore.SERVER_TIMESTAMP)
+        batch = db.batch()
+        batch.set(trip_ref, trip_data)
+        trip_index.stage_put(batch, db, user_id, kind, trip_ref.id, trip_summary(kind, trip_data))
+        batch.commit()
+        return trip_ref.id
+
+    def patch(self, kind, user_id, trip_id, fields):
+        db = self._db()
+        trip_ref = self._ref(db, kind, trip_id)
+        fields = dict(fields, updatedAt=firestore.SERVER_TIMESTAMP)
+        # The summary needs all its inputs; read the rest if the patch lacks some.
+        current = {} if _SUMMARY_INPUTS <= set(fields) else (self.get(kind, trip_id) or {})
+        current.pop('createdAt', None)
+        batch = db.batch()
+        # The field mask replaces each given field whole, so days removed
+        # from an itinerary map really disappear.
+        batch.set(trip_ref, fields, merge=list(fields))
+        trip_index.stage_put(batch, db, user_id, kind, trip_id, trip_summary(kind, {**current, **fields}))
+        batch.commit()
+
+    def delete(self, kind, user_id, trip_id):
+        db = self._db()
+        batch = db.batch()
+        batch.delete(self._ref(db, kind, trip_id))
+        trip_index.stage_remove(batch, db, user_id, kind, trip_id)
+        batch.commit()
+
+
+class InMemoryTripRepository(TripRepository):
+    """Trips in a dict, for tests, benchmarks and running without Firestore."""
+
+    def __init__(self):
+        self._trips = {}
+        self._lock = threading.Lock()
+
+    def get(self, kind, trip_id):
+        self._check_kind(kind)
+        with self._lock:
+            trip = self._trips.get((kind, trip_id))
+            return copy.deepcopy(trip) if trip is not None else None
+
+    def list(self, user_id):
+        with self._lock:
+            trips = [(key, trip) for key, trip in self._trips.items() if trip.get('userId') == user_id]
+            return {entry_key(kind, trip_id): _summary(kind, trip) for (kind, trip_id), trip in trips}
+
+    def save(self, kind, user_id, trip_data):
+        self._check_kind(kind)
+        trip_id = uuid.uuid4().hex
+        with self._lock:
+            self._trips[(kind, trip_id)] = copy.deepcopy(dict(trip_data, userId=user_id, createdAt=_now()))
+        return trip_id
+
+    def patch(self, kind, user_id, trip_id, fields):
+        self._check_kind(kind)
+        with self._lock:
+            trip = self._trips.get((kind, trip_id))
+            if trip is None:
+                raise KeyError(trip_id)
+            trip.update(copy.deepcopy(fields))
+            trip['updatedAt'] = _now()
+
+    def delete(self, kind, user_id, trip_id):
+        self._check_kind(kind)
+        with self._lock:
+            self._trips.pop((kind, trip_id), None)
+
+
+def _summary(kind, trip):
+    summary = trip_summary(kind, trip)
+    summary['updatedAt'] = trip.get('updatedAt') or trip.get('createdAt')
+    return summary
+
+
+# Datetimes are stored as {"__datetime__": iso} so they load back as
+# datetimes wherever they appear in a trip (startDate, nested fields...).
+_DATETIME_TAG = '__datetime__'
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {_DATETIME_TAG: value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__} in a trip")
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and _DATETIME_TAG in obj:
+        return datetime.fromisoformat(obj[_DATETIME_TAG])
+    return obj
+
+
+# Rows written before datetimes were tagged hold these as plain ISO strings.
+_TIMESTAMP_FIELDS = ('createdAt', 'updatedAt')
+
+
+def _load(text):
+    """Decode a stored trip or summary, turning its datetimes back into datetimes."""
+    data = json.loads(text, object_hook=_decode_object)
+    for field in _TIMESTAMP_FIELDS:
+        if isinstance(data.get(field), str):
+            data[field] = datetime.fromisoformat(data[field])
+    return data
+
+
+class SQLiteTripRepository(TripRepository):
+    """
+    Trips in a local SQLite file, one row per trip with its summary kept
+    alongside. Each thread has its own connection; WAL mode lets readers
+    run while a write is in progress.
+
+    Also used as the cache tier of ``CachedTripRepository``: ``put`` stores
+    another backend's trip as-is and ``get`` can ignore rows older than
+    ``max_age`` seconds.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS trips ("
+                " kind TEXT NOT NULL, id TEXT NOT NULL, user_id TEXT NOT NULL,"
+                " data TEXT NOT NULL, summary TEXT NOT NULL, stored_at REAL NOT NULL,"
+                " PRIMARY KEY (kind, id))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS trips_user ON trips (user_id)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, kind, trip_id, max_age=None):
+        self._check_kind(kind)
+        row = self._connection().execute(
+            "SELECT data, stored_at FROM trips WHERE kind = ? AND id = ?", (kind, trip_id)
+        ).fetchone()
+        if row is None or (max_age is not None and time.time() - row[1] > max_age):
+            return None
+        return _load(row[0])
+
+    def list(self, user_id):
+        rows = self._connection().execute(
+            "SELECT kind, id, summary FROM trips WHERE user_id = ?", (user_id,)
+        ).fetchall()
+        return {entry_key(kind, trip_id): _load(summary) for kind, trip_id, summary in rows}
+
+    def put(self, kind, trip_id, trip):
+        """Store ``trip`` under ``trip_id`` exactly as given, replacing any stored copy."""
+        self._check_kind(kind)
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO trips (kind, id, user_id, data, summary, stored_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, trip_id, trip.get('userId') or '', json.dumps(trip, default=_json_default),
+                 json.dumps(_summary(kind, trip), default=_json_default), time.time()),
+            )
+
+    def save(self, kind, user_id, trip_data):
+        trip_id = uuid.uuid4().hex
+        self.put(kind, trip_id, dict(trip_data, userId=user_id, createdAt=_now()))
+        return trip_id
+
+    def patch(self, kind, user_id, trip_id, fields):
+        trip = self.get(kind, trip_id)
+        if trip is None:
+            raise KeyError(trip_id)
+        trip.update(fields)
+        trip['updatedAt'] = _now()
+        self.put(kind, trip_id, trip)
+
+    def delete(self, kind, user_id, trip_id):
+        self._check_kind(kind)
+        with self._connection() as conn:
+            conn.execute("DELETE FROM trips WHERE kind = ? AND id = ?", (kind, trip_id))
+
+
+class CachedTripRepository(TripRepository):
+    """
+    Reads trips through a local SQLite cache in front of another backend,
+    typically Firestore. Trips are cached for ``ttl`` seconds after they are
+    read; this process drops its cached copy whenever it changes a trip.
+    Listing and counting go to the backend, whose index is one small read.
+    """
+
+    def __init__(self, backend, cache, ttl):
+        self.backend = backend
+        self.cache = cache
+        self.ttl = ttl
+
+    def get(self, kind, trip_id):
+        trip = self.cache.get(kind, trip_id, max_age=self.ttl)
+        if trip is None:
+            trip = self.backend.get(kind, trip_id)
+            if trip is not None:
+                try:
+                    self.cache.put(kind, trip_id, trip)
+                except Exception as e:
+                    logger.error(f"Error caching trip {trip_id}: {str(e)}")
+        return trip
+
+    def list(self, user_id):
+        return self.backend.list(user_id)
+
+    def count(self, user_id):
+        return self.backend.count(user_id)
+
+    def save(self, kind, user_id, trip_data):
+        return self.backend.save(kind, user_id, trip_data)
+
+    def patch(self, kind, user_id, trip_id, fields):
+        try:
+            self.backend.patch(kind, user_id, trip_id, fields)
+        finally:
+            self.cache.delete(kind, user_id, trip_id)
+
+    def delete(self, kind, user_id, trip_id):
+        try:
+            self.backend.delete(kind, user_id, trip_id)
+        finally:
+            self.cache.delete(kind, user_id, trip_id)
+
+
+def _firestore_repository():
+    from accounts.firebase_auth import FirebaseAuth
+    return FirestoreTripRepository(FirebaseAuth.get_db)
+
+
+def _sqlite_repository():
+    return SQLiteTripRepository(settings.TRIP_REPOSITORY_SQLITE_PATH)
+
+
+# Backends selectable with settings.TRIP_REPOSITORY
+REPOSITORIES = {
+    'firestore': _firestore_repository,
+    'memory': InMemoryTripRepository,
+    'sqlite': _sqlite_repository,
+}
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_repository():
+    """
+    Return the process-wide trip repository named by
+    ``settings.TRIP_REPOSITORY``, behind the SQLite cache tier when
+    ``settings.TRIP_REPOSITORY_CACHE_TTL`` is set.
+    """
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                backend = getattr(settings, 'TRIP_REPOSITORY', 'firestore')
+                if backend not in REPOSITORIES:
+                    raise ValueError(f"Unknown trip repository: {backend}")
+                repository = REPOSITORIES[backend]()
+                ttl = getattr(settings, 'TRIP_REPOSITORY_CACHE_TTL', 0)
+                if ttl and backend != 'sqlite':
+                    cache = SQLiteTripRepository(settings.TRIP_REPOSITORY_CACHE_PATH)
+                    repository = CachedTripRepository(repository, cache, ttl)
+                _repository = repository
+    return _repository
@@ -1,19 +1,24 @@
 from django.shortcuts import render, redirect
 from django.urls import reverse
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
 from .forms import TripForm
-from .utils.geodb_api import get_city_coordinates
-from .utils.geoapify_api import get_pois
-from .utils.hotel_api import get_amadeus_token, get_city_code, get_hotels_in_city 
-from .utils.gemini_api import generate_itinerary
+from . import firestore as trip_store
+from .utils import city_bundle, itinerary_jobs
+from .utils.city_bundle import abuild_city_bundle
+from .utils.itinerary_cache import redate_itinerary
+from .utils.llm_stats import get_stats as get_llm_stats
+from .utils.trip_listing import TRIP_PAGE_SIZE, InvalidCursor, list_trips
 from datetime import datetime, timedelta
+import hashlib
+import hmac
 import json
-from django.contrib.auth.decorators import login_required
-import firebase_admin
-from firebase_admin import credentials, firestore
+import os
 from accounts.firebase_auth import FirebaseAuth
 import logging
+from asgiref.sync import sync_to_async
 
 logger = logging.getLogger(__name__)
 
@@ -45,67 +50,44 @@ from django.contrib import messages
 from django.utils.safestring import mark_safe
 import json
 
-def show_trip_results(request, city_name):
-    city_info = get_city_coordinates(city_name)
-    context = {'city_name_searched': city_name}
-    
-    check_in_date_str = request.session.get('start_date') 
-    check_out_date_str = request.session.get('end_date')
+def _city_not_found(request, bundle):
+    """Add the right error for a bundle without coordinates."""
+    if 'city_info' in bundle.partial:
+        messages.error(request, f"Looking up '{bundle.city_name}' is taking too long. Please try again.")
+    else:
+        messages.error(request, f"Sorry, city '{bundle.city_name}' could not be found.")
 
-    if not city_info:
-        messages.error(request, f"Sorry, city '{city_name}' could not be found.")
-        return redirect(reverse('create_trip'))
+def _add_bundle_messages(request, bundle):
+    """Tell the user which parts of a city bundle are missing or incomplete."""
+    city_name = bundle.city_name
+    if bundle.hotel_status == city_bundle.HOTELS_NO_TOKEN:
+        messages.warning(request, "Failed to authenticate for hotel search. Hotel list may be unavailable.")
+    elif bundle.hotel_status == city_bundle.HOTELS_NO_CITY_CODE:
+        messages.warning(request, f"Could not find IATA code for '{city_name}'. Hotel list may be unavailable.")
+    elif bundle.hotel_status == city_bundle.HOTELS_EMPTY:
+        messages.info(request, f"No hotels found for '{city_name}' via Amadeus.")
+    elif bundle.hotel_status == city_bundle.HOTELS_TIMEOUT:
+        if 'hotels' in bundle.warming:
+            messages.warning(request, "Hotel search is taking longer than usual. Reload the page to see hotels.")
+        else:
+            messages.warning(request, "Hotel search is taking longer than usual. Please try again later.")
+    if 'pois' in bundle.partial:
+        messages.info(request, "Some points of interest could not be loaded in time. Reload the page to try again.")
 
-    lat, lon = city_info['lat'], city_info['lon']
-    
-    # Fetch POIs with multiple categories
-    pois = []
-    categories = [
-        'tourism.sights',
-        'tourism.museum',
-        'tourism.attraction',
-        'tourism.historic',
-        'tourism.art',
-        'tourism.park',
-        'tourism.viewpoint',
-        'tourism.architecture',
-        'tourism.monument',
-        'tourism.cultural',
-    ]
-    
-    for category in categories:
-        category_pois = get_pois(lat, lon, category=[category])
-        pois.extend(category_pois)
-    
-    # Remove duplicates based on name
-    seen_names = set()
-    unique_pois = []
-    for poi in pois:
-        name = poi.get('properties', {}).get('name')
-        if name and name not in seen_names:
-            seen_names.add(name)
-            unique_pois.append(poi)
+async def show_trip_results(request, city_name):
+    bundle = await abuild_city_bundle(city_name)
+    context = {'city_name_searched': city_name}
     
-    pois = unique_pois[:20]  # Limit to 20 unique POIs
-
-    token = get_amadeus_token()
-    hotels_list = []
+    check_in_date_str = await request.session.aget('start_date') 
+    check_out_date_str = await request.session.aget('end_date')
 
-    if not token:
-        messages.warning(request, "Failed to authenticate for hotel search. Hotel list may be unavailable.")
-    else:
-        city_code = get_city_code(city_name, token)
-        if not city_code:
-            messages.warning(request, f"Could not find IATA code for '{city_name}'. Hotel list may be unavailable.")
-        else:
-            print(f"Fetching hotel details for city code: {city_code}")
-            hotel_data_response = get_hotels_in_city(city_code, token)
-            hotels_list = hotel_data_response.get("hotels", [])
+    if not bundle.city_info:
+        _city_not_found(request, bundle)
+        return redirect(reverse('create_trip'))
 
-            if not hotels_list:
-                messages.info(request, f"No hotels found for '{city_name}' via Amadeus.")
-            else:
-                print(f"--- Hotels Data from get_hotels_in_city in View ({city_name}) - Count: {len(hotels_list)} ---")
+    _add_bundle_messages(request, bundle)
+    pois = bundle.pois
+    hotels_list = bundle.hotels
 
     # JSON serialization and marking as safe
     pois_json = mark_safe(json.dumps(pois))
@@ -113,15 +95,16 @@ def show_trip_results(request, city_name):
 
     context.update({
         'city_name': city_name,
-        'city_info': city_info,
+        'city_info': bundle.city_info,
         'pois': pois,  # Still used for template looping
         'hotels': hotels_list,  # Still used for template looping
         'pois_json': pois_json,
         'hotels_json': hotels_json,
+        'partial_sections': sorted(bundle.partial),
         'check_in_date': check_in_date_str,
         'check_out_date': check_out_date_str
     })
-    return render(request, 'trips/trip_results.html', context)
+    return await sync_to_async(render)(request, 'trips/trip_results.html', context)
 
 
 # load_more_hotels_ajax view is removed as it's no longer needed for Amadeus hotels
@@ -132,7 +115,7 @@ def ai_itinerary_form(request, city_name):
         'city_name': city_name
     })
 
-def generate_ai_itinerary(request, city_name):
+async def generate_ai_itinerary(request, city_name):
     """Handle the AI itinerary generation form submission"""
     if request.method == 'POST':
         try:
@@ -146,40 +129,45 @@ def generate_ai_itinerary(request, city_name):
                 return redirect('ai_itinerary_form', city_name=city_name)
             
             # Get dates from session
-            check_in_date_str = request.session.get('start_date')
-            check_out_date_str = request.session.get('end_date')
+            check_in_date_str = await request.session.aget('start_date')
+            check_out_date_str = await request.session.aget('end_date')
             
             # Debug logging
             print(f"Session dates in generate_ai_itinerary:")
             print(f"Start date: {check_in_date_str}")
             print(f"End date: {check_out_date_str}")
-            print(f"Session keys: {request.session.keys()}")
+            print(f"Session keys: {await request.session.akeys()}")
             
             if not check_in_date_str or not check_out_date_str:
                 messages.error(request, 'Missing date information. Please start over.')
                 return redirect('create_trip')
             
-            # Generate itinerary with custom prompt
-            itinerary = generate_itinerary(
-                city_name=city_name,
-                start_date=check_in_date_str,
-                end_date=check_out_date_str,
-                preferences={
-                    "prompt": prompt,
-                    "travel_style": travel_style,
-                    "budget": budget
-                }
-            )
-            
-            # Store the itinerary in session for display
-            request.session['ai_itinerary'] = itinerary
-            
-            # Make sure dates are still in session
-            request.session['start_date'] = check_in_date_str
-            request.session['end_date'] = check_out_date_str
-            
-            # Redirect to display the generated itinerary
-            return redirect('show_ai_itinerary', city_name=city_name)
+            # Queue the generation so this request returns immediately
+            try:
+                job_id = await sync_to_async(itinerary_jobs.enqueue_itinerary_job, thread_sensitive=False)(
+                    city_name=city_name,
+                    start_date=check_in_date_str,
+                    end_date=check_out_date_str,
+                    preferences={
+                        "prompt": prompt,
+                        "travel_style": travel_style,
+                        "budget": budget
+                    },
+                    user_id=await request.session.aget('uid')
+                )
+            except itinerary_jobs.QueueFull:
+                messages.error(request, 'We are generating a lot of itineraries right now. Please try again in a minute.')
+                return redirect('ai_itinerary_form', city_name=city_name)
+
+            # Only this session may poll the job and receive its result
+            await request.session.aset('ai_itinerary_job', job_id)
+
+            if 'application/json' in request.headers.get('Accept', ''):
+                return JsonResponse({
+                    'job_id': job_id,
+                    'status_url': reverse('ai_itinerary_job_status', kwargs={'job_id': job_id})
+                }, status=202)
+            return redirect('ai_itinerary_job', city_name=city_name, job_id=job_id)
             
         except Exception as e:
             messages.error(request, f'Error generating itinerary: {str(e)}')
@@ -187,6 +175,103 @@ def generate_ai_itinerary(request, city_name):
     
     return redirect('ai_itinerary_form', city_name=city_name)
 
+async def ai_itinerary_job(request, city_name, job_id):
+    """Show a progress page that polls a queued AI itinerary job"""
+    if await request.session.aget('ai_itinerary_job') != job_id:
+        messages.error(request, 'That itinerary request has expired. Please try again.')
+        return redirect('ai_itinerary_form', city_name=city_name)
+    return await sync_to_async(render)(request, 'trips/ai_itinerary_job.html', {
+        'city_name': city_name,
+        'status_url': reverse('ai_itinerary_job_status', kwargs={'job_id': job_id}),
+    })
+
+async def ai_itinerary_job_status(request, job_id):
+    """Report the progress of a queued AI itinerary job, delivering its result when done"""
+    if await request.session.aget('ai_itinerary_job') != job_id:
+        return JsonResponse({'error': 'Unknown job'}, status=404)
+    job = await sync_to_async(itinerary_jobs.get_job, thread_sensitive=False)(job_id)
+    if job is None:
+        return JsonResponse({'error': 'Unknown job'}, status=404)
+
+    data = {
+        'status': job['status'],
+        'days_done': job['days_done'],
+        'days_total': job['days_total'],
+    }
+    if job['status'] == itinerary_jobs.JOB_DONE:
+        # The job may be shared with an identical request for other dates
+        itinerary = job['result']
+        start_date = await request.session.aget('start_date')
+        if start_date:
+            itinerary = redate_itinerary(itinerary, start_date)
+        await request.session.aset('ai_itinerary', itinerary)
+        data['result'] = itinerary
+        data['redirect'] = reverse('show_ai_itinerary', kwargs={'city_name': job['city_name']})
+    elif job['status'] == itinerary_jobs.JOB_FAILED:
+        data['error'] = job['error'].get('error', 'Failed to generate itinerary')
+    return JsonResponse(data)
+
+def _sse_event(event, data):
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_ai_itinerary(request, city_name):
+    """Stream an AI itinerary to the browser day by day as Server-Sent Events"""
+    if request.method != 'POST':
+        return redirect('ai_itinerary_form', city_name=city_name)
+
+    prompt = request.POST.get('prompt')
+    travel_style = request.POST.get('travel_style', 'balanced')
+    budget = request.POST.get('budget', 'medium')
+    if not prompt:
+        return JsonResponse({'error': 'Please provide a prompt for the itinerary generation.'}, status=400)
+
+    check_in_date_str = await request.session.aget('start_date')
+    check_out_date_str = await request.session.aget('end_date')
+    if not check_in_date_str or not check_out_date_str:
+        return JsonResponse({
+            'error': 'Missing date information. Please start over.',
+            'redirect': reverse('create_trip')
+        }, status=400)
+
+    # Streams attach to the same job queue as the no-JS path, so a refresh
+    # or a second tab with the same inputs follows the generation already
+    # running instead of starting another one.
+    try:
+        job_id = await sync_to_async(itinerary_jobs.enqueue_itinerary_job, thread_sensitive=False)(
+            city_name=city_name,
+            start_date=check_in_date_str,
+            end_date=check_out_date_str,
+            preferences={
+                "prompt": prompt,
+                "travel_style": travel_style,
+                "budget": budget
+            },
+            user_id=await request.session.aget('uid')
+        )
+    except itinerary_jobs.QueueFull:
+        return JsonResponse({
+            'error': 'We are generating a lot of itineraries right now. Please try again in a minute.'
+        }, status=503)
+
+    async def events():
+        async for event, data in itinerary_jobs.afollow_job(job_id):
+            # The job may be shared with an identical request for other dates
+            if event == 'day':
+                data = redate_itinerary({'itinerary': [data]}, check_in_date_str)['itinerary'][0]
+            elif event == 'done':
+                # The response headers are already sent, so save the session
+                # explicitly for show_ai_itinerary to pick the result up.
+                await request.session.aset('ai_itinerary', redate_itinerary(data, check_in_date_str))
+                await request.session.asave()
+                data = {'redirect': reverse('show_ai_itinerary', kwargs={'city_name': city_name})}
+            yield _sse_event(event, data)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 def show_ai_itinerary(request, city_name):
     """Display the generated AI itinerary"""
     itinerary = request.session.get('ai_itinerary')
@@ -236,74 +321,33 @@ def show_ai_itinerary(request, city_name):
         'start_date': start_date
     })
 
-def create_itinerary(request, city_name):
+async def create_itinerary(request, city_name):
     """View for creating a manual itinerary"""
-    # Get city info
-    city_info = get_city_coordinates(city_name)
-    if not city_info:
-        messages.error(request, f"Sorry, city '{city_name}' could not be found.")
-        return redirect(reverse('create_trip'))
-    
     # Get dates from session
-    check_in_date_str = request.session.get('start_date')
-    check_out_date_str = request.session.get('end_date')
+    check_in_date_str = await request.session.aget('start_date')
+    check_out_date_str = await request.session.aget('end_date')
     
     if not check_in_date_str or not check_out_date_str:
         messages.error(request, 'Missing date information. Please start over.')
         return redirect('create_trip')
     
-    # Get POIs and hotels for the city
-    lat, lon = city_info['lat'], city_info['lon']
-    
-    # Fetch POIs
-    pois = []
-    categories = [
-        'tourism.sights',
-        'tourism.museum',
-        'tourism.attraction',
-        'tourism.historic',
-        'tourism.art',
-        'tourism.park',
-        'tourism.viewpoint',
-        'tourism.architecture',
-        'tourism.monument',
-        'tourism.cultural',
-    ]
-    
-    for category in categories:
-        category_pois = get_pois(lat, lon, category=[category])
-        pois.extend(category_pois)
-    
-    # Remove duplicates
-    seen_names = set()
-    unique_pois = []
-    for poi in pois:
-        name = poi.get('properties', {}).get('name')
-        if name and name not in seen_names:
-            seen_names.add(name)
-            unique_pois.append(poi)
-    
-    pois = unique_pois[:20]  # Limit to 20 unique POIs
-    
-    # Fetch hotels
-    hotels_list = []
-    token = get_amadeus_token()
-    if token:
-        city_code = get_city_code(city_name, token)
-        if city_code:
-            hotel_data_response = get_hotels_in_city(city_code, token)
-            hotels_list = hotel_data_response.get("hotels", [])
+    # Get city info, POIs and hotels for the city
+    bundle = await abuild_city_bundle(city_name)
+    if not bundle.city_info:
+        _city_not_found(request, bundle)
+        return redirect(reverse('create_trip'))
     
     context = {
         'city_name': city_name,
-        'city_info': city_info,
-        'pois': pois,
-        'hotels': hotels_list,
+        'city_info': bundle.city_info,
+        'pois': bundle.pois,
+        'hotels': bundle.hotels,
+        'partial_sections': sorted(bundle.partial),
         'check_in_date': check_in_date_str,
         'check_out_date': check_out_date_str
     }
     
-    return render(request, 'trips/create_itinerary.html', context)
+    return await sync_to_async(render)(request, 'trips/create_itinerary.html', context)
 
 def my_trips(request):
     """Render the user's trips page"""
@@ -317,32 +361,113 @@ def my_trips(request):
         if not user_data:
             messages.error(request, 'Failed to load user data')
             return redirect('/')
-            
-        return render(request, 'trips/my_trips.html')
+
+        # The first page is rendered into the page so it shows without a
+        # second request; the script asks my_trips_api for the rest.
+        try:
+            first_page = list_trips(request.session['uid'])
+        except Exception as e:
+            logger.error(f"Error listing trips: {str(e)}")
+            first_page = None
+        return render(request, 'trips/my_trips.html', {'first_page': first_page})
     except Exception as e:
         logger.error(f"Error loading trips page: {str(e)}")
         messages.error(request, 'An error occurred while loading your trips')
         return redirect('/')
 
-def modify_trip(request, trip_id):
-    """Show trip results for a saved trip, pre-filling all fields from Firestore."""
+# Browsers may reuse a page of the trip listing for this long; the page
+# script revalidates after deleting a trip.
+TRIP_LIST_MAX_AGE = 30
+
+def my_trips_api(request):
+    """List the user's trips as JSON, one page per cursor, newest first"""
     if not request.session.get('uid'):
+        return JsonResponse({'error': 'Not authenticated'}, status=401)
+    try:
+        limit = int(request.GET.get('limit', TRIP_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    try:
+        page = list_trips(request.session['uid'], request.GET.get('cursor'), limit)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    except Exception as e:
+        logger.error(f"Error listing trips: {str(e)}")
+        return JsonResponse({'error': 'Failed to load trips'}, status=500)
+
+    response = JsonResponse(page)
+    response['ETag'] = f'"{hashlib.sha1(response.content).hexdigest()}"'
+    patch_cache_control(response, private=True, max_age=TRIP_LIST_MAX_AGE)
+    patch_vary_headers(response, ['Cookie'])
+    return get_conditional_response(request, etag=response['ETag'], response=response)
+
+@require_POST
+def save_trip_api(request):
+    """Save a new trip or changes to an existing one, keeping the trip index up to date"""
+    uid = request.session.get('uid')
+    if not uid:
+        return JsonResponse({'error': 'Not authenticated'}, status=401)
+    try:
+        data = json.loads(request.body)
+        kind = data.get('type', 'trip')
+        trip_id = data.get('tripId')
+        if kind not in ('trip', 'ai') or (trip_id and kind != 'trip'):
+            return JsonResponse({'error': 'Invalid trip type'}, status=400)
+        if trip_id:
+            existing = trip_store.get_trip(kind, trip_id)
+            if not existing or existing.get('userId') != uid:
+                return JsonResponse({'error': 'Trip not found'}, status=404)
+            trip_id = trip_store.save_trip(uid, data.get('city'), data.get('startDate'), data.get('endDate'),
+                                           data.get('itinerary') or {}, trip_id=trip_id)
+        elif kind == 'trip':
+            trip_id = trip_store.save_trip(uid, data.get('city'), data.get('startDate'), data.get('endDate'),
+                                           data.get('itinerary') or {})
+        else:
+            trip_id = trip_store.save_ai_trip(uid, data.get('city'), data.get('startDate'), data.get('endDate'),
+                                              data.get('itinerary') or {}, data.get('total_estimated_cost'),
+                                              data.get('additional_tips'))
+        return JsonResponse({'tripId': trip_id})
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception as e:
+        logger.error(f"Error saving trip: {str(e)}")
+        return JsonResponse({'error': 'Failed to save trip'}, status=500)
+
+@require_POST
+def delete_trip_api(request, kind, trip_id):
+    """Delete one of the user's trips and its trip index entry"""
+    uid = request.session.get('uid')
+    if not uid:
+        return JsonResponse({'error': 'Not authenticated'}, status=401)
+    if kind not in ('trip', 'ai'):
+        return JsonResponse({'error': 'Invalid trip type'}, status=400)
+    try:
+        existing = trip_store.get_trip(kind, trip_id)
+        if not existing or existing.get('userId') != uid:
+            return JsonResponse({'error': 'Trip not found'}, status=404)
+        trip_store.delete_trip(uid, kind, trip_id)
+        return JsonResponse({'deleted': trip_id})
+    except Exception as e:
+        logger.error(f"Error deleting trip: {str(e)}")
+        return JsonResponse({'error': 'Failed to delete trip'}, status=500)
+
+async def modify_trip(request, trip_id):
+    """Show trip results for a saved trip, pre-filling all fields from the saved trip."""
+    uid = await request.session.aget('uid')
+    if not uid:
         messages.warning(request, 'Please sign in to modify trips')
         return redirect('/')
     try:
-        db = firestore.client()
-        trip_ref = db.collection('trips').document(trip_id)
-        trip_doc = trip_ref.get()
-        if not trip_doc.exists:
+        trip_data = await sync_to_async(trip_store.get_trip, thread_sensitive=False)('trip', trip_id)
+        if not trip_data:
             messages.error(request, 'Trip not found')
             return redirect('my_trips')
-        trip_data = trip_doc.to_dict()
-        if trip_data['userId'] != request.session['uid']:
+        if trip_data['userId'] != uid:
             messages.error(request, 'You do not have permission to modify this trip')
             return redirect('my_trips')
         # Log activity
-        FirebaseAuth.log_user_activity(
-            request.session['uid'],
+        await sync_to_async(FirebaseAuth.log_user_activity, thread_sensitive=False)(
+            uid,
             title='Modified a trip',
             description=f"Modified trip to {trip_data.get('city', 'Unknown City')} (Trip ID: {trip_id})"
         )
@@ -363,38 +488,14 @@ def modify_trip(request, trip_id):
         city_name = trip_data['city']
         start_date = to_iso(trip_data['startDate'])
         end_date = to_iso(trip_data['endDate'])
-        # Get city info
-        city_info = get_city_coordinates(city_name)
-        if not city_info:
-            messages.error(request, f"Sorry, city '{city_name}' could not be found.")
+        # Get city info, POIs and hotels
+        bundle = await abuild_city_bundle(city_name)
+        if not bundle.city_info:
+            _city_not_found(request, bundle)
             return redirect('my_trips')
-        lat, lon = city_info['lat'], city_info['lon']
-        # Fetch POIs
-        pois = []
-        categories = [
-            'tourism.sights', 'tourism.museum', 'tourism.attraction', 'tourism.historic',
-            'tourism.art', 'tourism.park', 'tourism.viewpoint', 'tourism.architecture',
-            'tourism.monument', 'tourism.cultural',
-        ]
-        for category in categories:
-            category_pois = get_pois(lat, lon, category=[category])
-            pois.extend(category_pois)
-        seen_names = set()
-        unique_pois = []
-        for poi in pois:
-            name = poi.get('properties', {}).get('name')
-            if name and name not in seen_names:
-                seen_names.add(name)
-                unique_pois.append(poi)
-        pois = unique_pois[:20]
-        # Fetch hotels
-        token = get_amadeus_token()
-        hotels_list = []
-        if token:
-            city_code = get_city_code(city_name, token)
-            if city_code:
-                hotel_data_response = get_hotels_in_city(city_code, token)
-                hotels_list = hotel_data_response.get("hotels", [])
+        city_info = bundle.city_info
+        pois = bundle.pois
+        hotels_list = bundle.hotels
         # JSON serialization and marking as safe
         pois_json = mark_safe(json.dumps(pois))
         hotels_json = mark_safe(json.dumps(hotels_list))
@@ -410,9 +511,10 @@ def modify_trip(request, trip_id):
             'check_in_date': start_date,
             'check_out_date': end_date,
             'itinerary_json': itinerary_json,
+            'partial_sections': sorted(bundle.partial),
             'trip_id': trip_id,
         }
-        return render(request, 'trips/trip_results.html', context)
+        return await sync_to_async(render)(request, 'trips/trip_results.html', context)
     except Exception as e:
         logger.error(f"Error modifying trip: {str(e)}")
         messages.error(request, 'An error occurred while loading the trip')
@@ -424,13 +526,10 @@ def view_itinerary(request, trip_id):
         messages.warning(request, 'Please sign in to view itineraries')
         return redirect('/')
     try:
-        db = firestore.client()
-        trip_ref = db.collection('trips').document(trip_id)
-        trip_doc = trip_ref.get()
-        if not trip_doc.exists:
+        trip_data = trip_store.get_trip('trip', trip_id)
+        if not trip_data:
             messages.error(request, 'Trip not found')
             return redirect('my_trips')
-        trip_data = trip_doc.to_dict()
         if trip_data['userId'] != request.session['uid']:
             messages.error(request, 'You do not have permission to view this itinerary')
             return redirect('my_trips')
@@ -455,15 +554,10 @@ def view_ai_itinerary(request, trip_id):
         messages.warning(request, 'Please sign in to view itineraries')
         return redirect('/')
     try:
-        db = firestore.client()
-        trip_ref = db.collection('ai_generated_trips').document(trip_id)
-        trip_doc = trip_ref.get()
-        
-        if not trip_doc.exists:
+        trip = trip_store.get_trip('ai', trip_id)
+        if not trip:
             return render(request, '404.html', {'error': 'Trip not found'})
 
-        trip = trip_doc.to_dict()
-
         # Sort itinerary by date
         itinerary_dict = trip.get('itinerary', {})
         sorted_itinerary = sorted(itinerary_dict.items(), key=lambda x: x[0])
@@ -492,4 +586,14 @@ def view_ai_itinerary(request, trip_id):
 
     except Exception as e:
         print(f"Error in view_ai_itinerary: {str(e)}")
-        return render(request, 'error.html', {'error': str(e)})
\ No newline at end of file
+        return render(request, 'error.html', {'error': str(e)})
+
+def llm_stats(request):
+    """Report LLM usage statistics to callers holding the LLM_STATS_TOKEN"""
+    token = os.getenv('LLM_STATS_TOKEN')
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not token or not hmac.compare_digest(supplied, token):
+        return JsonResponse({'error': 'Not found'}, status=404)
+    response = JsonResponse(get_llm_stats())
+    response['Cache-Control'] = 'no-store'
+    return response